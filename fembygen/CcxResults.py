@@ -0,0 +1,135 @@
+# Reading CalculiX result files of the generations without FreeCAD, so that they can be read in worker processes.
+# .dat files are memory mapped, result blocks are found by their headers and only the values of the requested blocks
+# are parsed, the whole text is never copied. Nodal results of .frd files are read by the bulk reader of beso_lib.
+import glob
+import mmap
+import os.path
+import re
+import numpy as np
+from fembygen.topology import beso_lib
+
+# header of a .dat result block, e.g. " internal energy (element, energy) for set EALL and time  0.1000000E+01"
+DAT_HEADER = re.compile(rb"^ ([a-z][a-z .]*?[a-z])(?: \([^\n]*?\))? for set (\S+) and time +(\S+)[ \t]*\r?$", re.M)
+BLOCK_END = re.compile(rb"\n[ \t\r]*(?:\n|\Z)")  # values end before the next blank line
+FIRST_VALUE = re.compile(rb"\S")
+ENERGY_BLOCKS = ("internal energy", "total internal energy", "volume", "total volume", "internal energy density")
+
+_datCache = {}  # load case directory: ((dat file, size, modification time), values)
+_metricsCache = {}  # load case directory: (resultStamp, loadCaseMetrics), filled by the process using the metrics
+
+
+def datBlocks(fileName, names):
+    """First block of each result name (e.g. "internal energy", "total volume") in the .dat file as
+    {name: array of value rows}, the file is walked once and stops when all names are found"""
+    blocks = {}
+    with open(fileName, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return blocks
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text:
+            for header in DAT_HEADER.finditer(text):
+                name = header.group(1).decode()
+                if name not in names or name in blocks:
+                    continue
+                first = FIRST_VALUE.search(text, header.end())
+                if first is None:
+                    break
+                start = first.start()
+                end = len(text)
+                for pattern in (BLOCK_END, DAT_HEADER):
+                    found = pattern.search(text, start)
+                    if found is not None:
+                        end = min(end, found.start())
+                block = text[start:end]
+                columns = len(block.split(b"\n", 1)[0].split())
+                blocks[name] = np.fromstring(block, sep=" ").reshape(-1, columns)
+                if len(blocks) == len(names):
+                    break
+    return blocks
+
+
+def energyAndVolume(resultPath):
+    """Element internal energies, total internal energy, element volumes, total volume and internal energy densities
+    of integration points from the .dat file of the load case directory, cached until the file changes"""
+    directory = os.path.normpath(resultPath)
+    fileName = glob.glob(os.path.join(directory, "*.dat"))[0]
+    stat = os.stat(fileName)
+    stamp = (fileName, stat.st_size, stat.st_mtime_ns)
+    cached = _datCache.get(directory)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    blocks = datBlocks(fileName, ENERGY_BLOCKS)
+    values = (blocks["internal energy"][:, 1], float(blocks["total internal energy"][0, 0]),
+              blocks["volume"][:, 1], float(blocks["total volume"][0, 0]),
+              blocks["internal energy density"][:, 2])
+    _datCache[directory] = (stamp, values)
+    return values
+
+
+def intEnergyAndVolume(resultPath):
+    """energyAndVolume of the load case directory in Joule and mm^3"""
+    intData, totalInt, volData, totalVol, denData = energyAndVolume(resultPath)
+    # Joule , Joule, mm^3, mm^3, Joule
+    return intData*1000, totalInt*1000, volData, totalVol, denData*1000
+
+
+def vonMises(stress):
+    """von Mises stress of rows of stress components sxx, syy, szz, sxy, syz, szx"""
+    sxx, syy, szz, sxy, syz, szx = stress.T
+    return np.sqrt(0.5 * ((sxx - syy)**2 + (syy - szz)**2 + (szz - sxx)**2) + 3 * (sxy**2 + syz**2 + szx**2))
+
+
+def loadCaseMetrics(resultPath):
+    """FEA metrics of the load case directory read from its .frd and .dat files, returns
+    [volume, max von Mises stress, max displacement, mean von Mises stress, internal energy, std of energy density]
+    and energy densities of integration points, nodal values are taken from the last step"""
+    fileName = glob.glob(os.path.join(resultPath, "*.frd"))[0]
+    blocks = {name: values for name, _, values in beso_lib.read_frd(fileName[:-4], ["DISP", "STRESS"])[3]}
+    stress = vonMises(blocks["STRESS"][:, :6])
+    maxDisp = np.max(np.linalg.norm(blocks["DISP"][:, :3], axis=1))
+
+    intData, totalInt, volData, totalVol, denData = intEnergyAndVolume(resultPath)
+    return [totalVol, np.max(stress), maxDisp, np.mean(stress), totalInt, np.std(denData)], denData
+
+
+def resultStamp(resultPath):
+    """Names, sizes and modification times of the .frd and .dat files of the load case directory"""
+    stamp = []
+    fileNames = glob.glob(os.path.join(resultPath, "*.frd")) + glob.glob(os.path.join(resultPath, "*.dat"))
+    for fileName in sorted(fileNames):
+        stat = os.stat(fileName)
+        stamp.append((fileName, stat.st_size, stat.st_mtime_ns))
+    return tuple(stamp)
+
+
+def cachedMetrics(resultPath, stamp):
+    """loadCaseMetrics of the load case directory stored by cacheMetrics, None if its result files have changed"""
+    cached = _metricsCache.get(os.path.normpath(resultPath))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    return None
+
+
+def cacheMetrics(resultPath, stamp, metrics):
+    """Keep loadCaseMetrics of the load case directory read while the result files had the stamp, e.g. in a worker"""
+    _metricsCache[os.path.normpath(resultPath)] = (stamp, metrics)
+
+
+# ways of combining results of load cases
+COMBINATION_MODES = ["Sum", "Envelope max", "Weighted sum"]
+
+
+def combineLoadCases(values, mode="Sum", weights=None):
+    """Combine results of load cases, values is an (n_cases, n_fields, n_nodes) array
+    Sum and Weighted sum add fields of load cases (weights are 1 for missing ones), Envelope max takes the value with the
+    largest magnitude of all load cases keeping its sign"""
+    if mode == "Envelope max":
+        largest = np.argmax(np.abs(values), axis=0)
+        return np.take_along_axis(values, largest[None], axis=0)[0]
+    if mode == "Weighted sum":
+        factors = np.ones(len(values))
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)[:len(values)]
+            factors[:len(weights)] = weights
+        return np.tensordot(factors, values, axes=1)
+    return values.sum(axis=0)
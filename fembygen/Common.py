@@ -2,16 +2,25 @@ import FreeCAD
 import FreeCADGui as Gui
 from PySide import QtCore, QtGui    # FreeCAD's PySide!
 import os.path
+import shutil
+import subprocess
+import sys
 import numpy as np
-import operator
 import glob
+import hashlib
+import json
 import Fem
+from concurrent.futures import ThreadPoolExecutor
 
 g_master = None
 g_workingDir = ''
 
 
 LOCATION = os.path.normpath('Mod/FEMbyGEN/fembygen')
+# file in a load case directory with the hash of the input file of its successful analysis
+HASH_FILE = "inp.sha1"
+# file in the working directory with analysis statuses of all generations and load cases
+STATUS_FILE = "analysis_status.json"
 
 g_master = None
 g_workingDir = ''
@@ -56,6 +65,38 @@ def checkGenerations(workingDir=None):
     return numGens-1
 
 
+_workerPython = None  # (interpreter found by workerPython or None,) once it is searched
+
+
+def pythonVersion(python):
+    """(major, minor) version of the python interpreter, None if it can't be run"""
+    try:
+        output = subprocess.run([python, "-c", "import sys; print(*sys.version_info[:2])"], capture_output=True,
+                                text=True, timeout=30).stdout
+        return tuple(int(part) for part in output.split())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+def workerPython():
+    """Python interpreter of FreeCAD to start worker processes with, None if not found
+    FreeCAD installed with the system python (e.g. distribution packages) uses a python on PATH of the same version"""
+    global _workerPython
+    if _workerPython is not None:
+        return _workerPython[0]
+    candidates = [os.path.join(FreeCAD.getHomePath(), "bin", name) for name in ("python.exe", "python3", "python")]
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        candidates.insert(0, sys.executable)
+    python = next((python for python in candidates if os.path.isfile(python)), None)
+    if python is None:
+        version = tuple(sys.version_info[:2])
+        names = ["python{}.{}".format(*version), f"python{version[0]}", "python"]
+        found = dict.fromkeys(shutil.which(name) for name in names)
+        python = next((python for python in found if python and pythonVersion(python) == version), None)
+    _workerPython = (python,)
+    return python
+
+
 def error(msg: str):
     """Show error message"""
     FreeCAD.Console.PrintError(msg + '\n')
@@ -85,45 +126,123 @@ def purge_results(doc):
 
 
 def searchAnalysed(master):
-    numAnalysed = 0
-    statuses = []
+    """Statuses of load cases of all generations, number of analysed load cases and number of load cases
+    statuses are read from the status index, load case directories are scanned only if it is missing or stale"""
     workingDir = '/'.join(master.FileName.split('/')[0:-1])
-    numGenerations = checkGenerations(workingDir)
-    for i in range(1, numGenerations+1):
-        # Checking the loadcases in generated file
-        lc = 0
-        lcStatus = []
-        for obj in master.Objects:
-            if obj.TypeId == "Fem::FemAnalysis":  # to choose analysis objects
-                lc += 1
-                analysisfolder = os.path.join(
-                    workingDir + f"/Gen{i}/loadCase_{lc}/")
-                print("analysisfolder", analysisfolder)
-                try:
-                    # This returns an exception if analysis failed for this .frd file, because there is no results data
-                    FRDPath = glob.glob(analysisfolder + "*.frd")[0]
-                    print("frdpadh", FRDPath)
-                    try:
-                        with open(FRDPath, "r") as file:
-                            file.readline().decode().strip()
-                    except:
-                        status = "Failed"
-                except:
-                    status = "Not analysed"
-                else:
-                    status = "Analysed"
-                    numAnalysed += 1
-                try:
-                    lcStatus.append(status)
-                except:
-                    FreeCAD.Console.PrintError("Analysis not found.\n")
-        statuses.append(lcStatus)
+    lc = len([obj for obj in master.Objects if obj.TypeId == "Fem::FemAnalysis"])
+    statuses = readStatusIndex(workingDir, lc)
+    if statuses is None:
+        statuses = scanAnalysed(workingDir, checkGenerations(workingDir), lc)
+        writeStatusIndex(workingDir, statuses)
+    numAnalysed = sum(row.count("Analysed") for row in statuses)
     return (statuses, numAnalysed, lc)
 
 
+def analysisStatus(analysisfolder):
+    """Status of the load case directory from its .frd file"""
+    try:
+        with os.scandir(analysisfolder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".frd"):
+                    # an empty result file is left by a failed analysis
+                    return "Analysed" if entry.stat().st_size else "Failed"
+    except FileNotFoundError:
+        pass
+    return "Not analysed"
+
+
+def scanAnalysed(workingDir, numGenerations, lc):
+    """Statuses of load case directories of all generations, directories are checked in parallel"""
+    folders = [os.path.join(workingDir, f"Gen{i}", f"loadCase_{j}")
+               for i in range(1, numGenerations+1) for j in range(1, lc+1)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        found = list(executor.map(analysisStatus, folders))
+    return [found[k:k+lc] for k in range(0, len(found), lc)] if lc else [[] for i in range(numGenerations)]
+
+
+def readStatusIndex(workingDir, lc):
+    """Statuses from the status index, None if it is missing or doesn't match generations and load cases"""
+    try:
+        with open(os.path.join(workingDir, STATUS_FILE), "r") as f:
+            statuses = json.load(f)["statuses"]
+    except (OSError, ValueError, KeyError):
+        return None
+    numGenerations = len(statuses)
+    # generations are numbered without gaps, the last one has to be the last directory
+    if os.path.isdir(os.path.join(workingDir, f"Gen{numGenerations+1}")) or \
+            (numGenerations and not os.path.isdir(os.path.join(workingDir, f"Gen{numGenerations}"))):
+        return None
+    if any(len(row) != lc for row in statuses):
+        return None
+    return statuses
+
+
+def writeStatusIndex(workingDir, statuses):
+    """Write statuses to the status index atomically, load cases being solved are stored as not analysed"""
+    statuses = [[status if status in ("Analysed", "Failed") else "Not analysed" for status in row]
+                for row in statuses]
+    fileName = os.path.join(workingDir, STATUS_FILE)
+    try:
+        with open(fileName + ".tmp", "w") as f:
+            json.dump({"statuses": statuses}, f)
+        os.replace(fileName + ".tmp", fileName)
+    except OSError:
+        FreeCAD.Console.PrintWarning(f"Analysis status index {fileName} couldn't be written\n")
+
+
+def removeStatusIndex(workingDir):
+    try:
+        os.remove(os.path.join(workingDir, STATUS_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def inpHash(fileName):
+    """Hash of an input file, comment lines (e.g. the date written by FreeCAD) are not included"""
+    sha = hashlib.sha1()
+    with open(fileName, "rb") as f:
+        for line in f:
+            if not line.startswith(b"**"):
+                sha.update(line)
+    return sha.hexdigest()
+
+
+def solvedHash(directory):
+    """Hash of the input file solved successfully in the load case directory, None if there are no results
+    it has to be read before the input file is written again"""
+    frd = glob.glob(os.path.join(directory, "*.frd"))
+    dat = glob.glob(os.path.join(directory, "*.dat"))
+    if not frd or not dat or not os.path.getsize(frd[0]):
+        return None
+    try:
+        with open(os.path.join(directory, HASH_FILE), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    # results solved before hashes were recorded, the input file is the solved one if it is older than the results
+    inp = frd[0][:-4] + ".inp"
+    if os.path.isfile(inp) and os.path.getmtime(inp) <= os.path.getmtime(frd[0]):
+        solved = inpHash(inp)
+        saveSolvedHash(directory, solved)
+        return solved
+    return None
+
+
+def saveSolvedHash(directory, inpHash):
+    with open(os.path.join(directory, HASH_FILE + ".tmp"), "w") as f:
+        f.write(inpHash)
+    os.replace(os.path.join(directory, HASH_FILE + ".tmp"), os.path.join(directory, HASH_FILE))
+
+
 def checkAnalyses(master):
     statuses = master.FEA.Status
     numAnalysed = master.FEA.NumberOfAnalysis
+    if not statuses:
+        # statuses of a file saved before the analyses were run
+        workingDir = '/'.join(master.FileName.split('/')[0:-1])
+        lc = len([obj for obj in master.Objects if obj.TypeId == "Fem::FemAnalysis"])
+        statuses = readStatusIndex(workingDir, lc) or statuses
+        numAnalysed = sum(row.count("Analysed") for row in statuses)
     return (statuses, numAnalysed)
 
 
@@ -228,50 +347,63 @@ def get_results_fc(doc, case):
         state2.Visibility = False
 
 class GenTableModel(QtCore.QAbstractTableModel):
-    def __init__(self, parent, itemList, header, colours=None, score=None, *args):
+    """Table of generations kept in NumPy arrays, texts and colours of cells are created only when the view asks
+    for them, so that only visible rows cost anything
 
-        QtCore.QAbstractTableModel.__init__(self, parent, *args)
-        self.itemList = []
-        for i in itemList:
-            self.itemList.append(list(i))
+    cell colours are given by one of
+    colours: matrix of QColor
+    colourMap: {cell value: QColor}, other cells are white
+    colourScale: matrix of values normalized to 0~1 shown from white to green, NaN cells are pink"""
 
-        self.header = header[:]
-        height = len(itemList)
-        width = len(header)
-        defaultColour = QtGui.QColor("white")
+    def __init__(self, parent, itemList, header, colours=None, score=None, *args, colourMap=None, colourScale=None):
 
-        if colours == None:
-            self.colours = [
-                [defaultColour for x in range(width)] for y in range(height)]
-        else:
-            self.colours = colours[:]
+        QtCore.QAbstractTableModel.__init__(self, parent, *args)
+        self.header = header[:]
+        self.items = np.array(itemList, dtype=np.dtype("object")).reshape(len(itemList), len(header))
+        self.order = np.arange(len(self.items))  # rows of items in the order of the view
+        self.colours = None if colours is None else np.array(colours, dtype=np.dtype("object")).reshape(
+            len(itemList), len(header))
+        self.colourMap = {} if colourMap is None else colourMap
+        self.colourScale = None if colourScale is None else np.asarray(colourScale, dtype=float)
         self.score = score
+        self.white = QtGui.QColor("white")
 
     def updateColours(self, colours):
-        for i, row in enumerate(colours):
-            self.colours[i][1:] = row
+        self.colours[:, 1:] = np.array(colours, dtype=np.dtype("object"))
 
     def updateData(self, table):
-        for i, row in enumerate(table):
-            self.itemList[i][1:] = row
+        self.items[:, 1:] = np.array(table, dtype=np.dtype("object"))
 
     def updateHeader(self, header):
         self.header[1:] = header
 
-    def rowCount(self, parent):
-        return len(self.itemList)
+    def rowCount(self, parent=None):
+        return len(self.items)
 
-    def columnCount(self, parent):
+    def columnCount(self, parent=None):
         return len(self.header)
 
     def data(self, index, role):
         if not index.isValid():
             return None
-        elif role == QtCore.Qt.BackgroundRole:
+        row, col = self.order[index.row()], index.column()
+        if role == QtCore.Qt.BackgroundRole:
             # Return colour
-            return self.colours[index.row()][index.column()]
+            return self.colour(row, col)
         elif role == QtCore.Qt.DisplayRole:
-            return str(self.itemList[index.row()][index.column()])
+            return str(self.items[row, col])
+
+    def colour(self, row, col):
+        if self.colours is not None:
+            return self.colours[row, col]
+        if self.colourScale is not None and col > 0:
+            normVal = self.colourScale[row, col-1]
+            if np.isnan(normVal):
+                # Item was not a number, likely an error occurred for analysis in this row
+                return QtGui.QColor(230, 184, 184, 255)
+            mult = 1-normVal
+            return QtGui.QColor(int(mult*200), 255, int(mult*200), 255)
+        return self.colourMap.get(self.items[row, col], self.white)
 
     def headerData(self, col, orientation, role):
         if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
@@ -279,20 +411,19 @@ class GenTableModel(QtCore.QAbstractTableModel):
         return None
 
     def sort(self, col, order):
-        """sort table by given column number col"""
+        """sort table by given column number col, or by score if it is given"""
         self.layoutAboutToBeChanged.emit()
         if isinstance(self.score, np.ndarray):
-            self.itemList = [c for _, c in sorted(
-                zip(self.score, self.itemList))]
-            self.colours = [c for _, c in sorted(
-                zip(self.score, self.colours))]
+            keys = self.score
         else:
-            self.itemList = sorted(self.itemList, key=operator.itemgetter(col))
-            self.colours = [c for _, c in sorted(
-                zip(self.itemList, self.colours))]
-
-        if order != QtCore.Qt.DescendingOrder:
-            self.itemList.reverse()
+            keys = self.items[:, col]
+            try:
+                keys = keys.astype(float)
+            except (TypeError, ValueError):
+                keys = keys.astype(str)
+        self.order = np.argsort(keys, kind="stable")
+        if order == QtCore.Qt.DescendingOrder:
+            self.order = self.order[::-1]
         self.layoutChanged.emit()
 
 
@@ -2,7 +2,8 @@ import FreeCAD
 import FreeCADGui
 import FemGui
 import os
-from fembygen import Common
+from fembygen import Common, ResultsStore
+from fembygen.topology import beso_solver
 import shutil
 import os
 import PySide
@@ -10,6 +11,14 @@ import glob
 from femtools import ccxtools
 import numpy as np
 import functools
+import time
+
+# colours of analysis statuses in the table
+STATUS_COLOURS = {"Analysed": PySide.QtGui.QColor(114, 242, 73, 255),  # green
+                  "Not analysed": PySide.QtGui.QColor(207, 184, 12, 255),  # yellow
+                  "Failed": PySide.QtGui.QColor(250, 100, 100, 255),  # red/pink
+                  "Queued": PySide.QtGui.QColor(200, 200, 200, 255),  # grey
+                  "Running": PySide.QtGui.QColor(100, 180, 250, 255)}  # blue
 
 
 def makeFEA():
@@ -47,6 +56,14 @@ class FEA:
                             "Number of Load Cases")
         except:
             pass
+        try:
+            obj.addProperty("App::PropertyInteger", "ConcurrentJobs", "Solver",
+                            "Number of CalculiX analyses running at once, 0 for cpu count / threads per job")
+            obj.addProperty("App::PropertyInteger", "ThreadsPerJob", "Solver",
+                            "Number of OpenMP threads of each CalculiX analysis")
+            obj.ThreadsPerJob = 1
+        except:
+            pass
 
 
 class FEACommand():
@@ -95,6 +112,8 @@ class FEAPanel:
         self.form.analysedCountLabel.setText(
             str(numAnalysed) + " successful analyses")
         self.updateAnalysisTable()
+        self.form.tableView.clicked.connect(functools.partial(
+            Common.showGen, self.form.tableView, self.doc))
 
         # Link callback procedures
         self.form.startFEAButton.clicked.connect(self.FEAGenerations)
@@ -115,6 +134,8 @@ class FEAPanel:
                         f"INFO: Generation {j} analysis data not found\n")
                 # Delete if earlier generative objects exist
 
+        Common.removeStatusIndex(self.workingDir)
+        ResultsStore.remove(self.workingDir)
         try:  # If already results imported, try to delete those
             Common.purge_results(self.doc)
         except:
@@ -126,6 +147,20 @@ class FEAPanel:
 
     def FEAGenerations(self):
         FreeCAD.Console.PrintMessage("Analysis starting\n")
+        threads = max(1, getattr(self.doc.FEA, "ThreadsPerJob", 1))
+        jobs = getattr(self.doc.FEA, "ConcurrentJobs", 0)
+        self.pool = None
+        self.pending = {}  # generation: load cases not solved yet
+        self.solved = {}  # generation: {load case: input file name} of successful analyses
+        self.hashes = {}  # (generation, load case): hash of the input file being solved
+        numSkipped = 0
+        self.liveStatus, _, _ = Common.searchAnalysed(self.doc)
+        self.numJobs = 0
+        self.numFinished = 0
+        self.running = []
+
+        # write input files of all generations, analyses are solved concurrently while next files are written
+        # analyses whose input file is the same as the one of their existing results are not solved again
         for i in range(self.numGenerations):
             # Open generated part
             partName = f"Gen{i+1}"
@@ -142,19 +177,54 @@ class FEAPanel:
                         FemGui.setActiveAnalysis(obj)
                         analysisfolder = os.path.join(
                             self.workingDir + f"/Gen{i+1}/loadCase_{lc}")
-                        os.mkdir(analysisfolder)
-                    # Run FEA solver on generation
-                        self.performFEA(Gen_Doc, obj, analysisfolder)
+                        os.makedirs(analysisfolder, exist_ok=True)
+                        solvedHash = Common.solvedHash(analysisfolder)  # read before the input file is replaced
+                    # Write the input file of the generation, it is solved in the background
+                        fea = self.writeFEA(Gen_Doc, obj, analysisfolder)
+                        if fea is not None:
+                            inpHash = Common.inpHash(fea.inp_file_name)
+                            if inpHash == solvedHash:
+                                numSkipped += 1
+                                self.setLiveStatus(i, lc, "Analysed")
+                                continue
+                            try:
+                                os.remove(os.path.join(analysisfolder, Common.HASH_FILE))
+                            except FileNotFoundError:
+                                pass
+                            fea.purge_results()
+                            # results of an earlier run must not be taken for the ones of a failed run
+                            for extension in (".frd", ".dat"):
+                                try:
+                                    os.remove(fea.inp_file_name[:-4] + extension)
+                                except FileNotFoundError:
+                                    pass
+                            self.hashes[(i, lc)] = inpHash
+                            if self.pool is None:
+                                self.pool = beso_solver.SolverPool(fea.ccx_binary, jobs, threads)
+                            self.pending.setdefault(i, set()).add(lc)
+                            self.solved.setdefault(i, {})
+                            self.pool.submit((i, lc), fea.inp_file_name[:-4], fea.inp_file_name[:-4] + ".out")
+                            self.numJobs += 1
+                            self.setLiveStatus(i, lc, "Queued")
                 except:
                     # It counts for deleted objects and gives error.
                     pass
 
             # Close generated part
+            if i in self.pending:
+                Gen_Doc.save()
             FreeCAD.closeDocument(partName)
-
-            # Update progress bar
-            progress = ((i+1)/self.numGenerations) * 100
-            self.form.progressBar.setValue(progress)
+            self.gatherResults()
+
+        # wait for the analyses and load their results to generation files as generations are finished
+        while self.pool is not None and not self.pool.done():
+            self.gatherResults()
+            PySide.QtGui.QApplication.processEvents()
+            time.sleep(0.05)
+        self.gatherResults()
+        FreeCAD.Console.PrintMessage(
+            f"{self.numJobs} analyses run, {numSkipped} unchanged analyses skipped\n")
+        Common.writeStatusIndex(self.workingDir, self.liveStatus)
 
         (statuses, numAnalysed, numLoadCase) = Common.searchAnalysed(self.doc)
         self.doc.FEA.Status = statuses
@@ -163,6 +233,70 @@ class FEAPanel:
         FreeCAD.setActiveDocument(self.doc.Name)
         self.doc.save()
         self.updateAnalysisTable()
+        self.form.progressBar.setValue(100)
+
+    def gatherResults(self):
+        """Update statuses of finished analyses and load results of finished generations"""
+        if self.pool is None:
+            return
+        finished = self.pool.poll()
+        for (i, lc), returncode, run in finished:
+            self.numFinished += 1
+            self.pending[i].discard(lc)
+            if returncode or not os.path.isfile(run.file_nameW + ".frd"):
+                FreeCAD.Console.PrintError(f"Gen{i+1} load case {lc} failed:\n" + "\n".join(run.tail) + "\n")
+                self.setLiveStatus(i, lc, "Failed")
+                self.hashes.pop((i, lc))
+            else:
+                self.setLiveStatus(i, lc, "Analysed")
+                self.solved[i][lc] = run.file_nameW + ".inp"
+                Common.saveSolvedHash(os.path.dirname(run.file_nameW), self.hashes.pop((i, lc)))
+            if not self.pending[i]:
+                del self.pending[i]
+                self.loadGeneration(i, self.solved.pop(i))
+        running = self.pool.running()
+        for i, lc in running:
+            self.setLiveStatus(i, lc, "Running")
+        if finished:
+            Common.writeStatusIndex(self.workingDir, self.liveStatus)
+        if finished or running != self.running:
+            self.running = running
+            if self.numJobs:
+                self.form.progressBar.setValue(100 * self.numFinished / self.numJobs)
+            self.doc.FEA.Status = self.liveStatus
+            self.updateAnalysisTable()
+
+    def setLiveStatus(self, i, lc, status):
+        try:
+            self.liveStatus[i][lc-1] = status
+        except IndexError:
+            pass
+
+    def loadGeneration(self, i, inputs):
+        """Load results of analyses {load case: input file name} to the generation file"""
+        if not inputs:
+            return
+        partName = f"Gen{i+1}"
+        Gen_Doc = FreeCAD.open(self.workingDir + f"/Gen{i+1}/Gen{i+1}.FCStd", hidden=True)
+        FreeCAD.setActiveDocument(partName)
+        lc = 0
+        for obj in Gen_Doc.Objects:
+            try:
+                if obj.TypeId == "Fem::FemAnalysis":
+                    lc += 1
+                    if lc in inputs:
+                        FemGui.setActiveAnalysis(obj)
+                        fea = ccxtools.FemToolsCcx(obj)
+                        fea.update_objects()
+                        fea.setup_working_dir(os.path.dirname(inputs[lc]))
+                        fea.set_inp_file_name(inputs[lc])
+                        fea.load_results()
+            except:
+                FreeCAD.Console.PrintError(f"Results of Gen{i+1} load case {lc} could not be loaded\n")
+        # save FEA results
+        Gen_Doc.save()
+        FreeCAD.closeDocument(partName)
+        FreeCAD.setActiveDocument(self.doc.Name)
 
     def updateAnalysisTable(self):
         # Make a header and table with one more column, because otherwise the table object will split each character
@@ -176,41 +310,15 @@ class FEAPanel:
 
             index = np.array(range(1, gen+1))[..., None]
             table = np.hstack((index, stats))
-
-            colours = np.empty((gen, lc+1), dtype=np.dtype("object"))
-
-            for i, row in enumerate(stats):
-                for j, value in enumerate(row):
-                    white = PySide.QtGui.QColor("white")
-                    colours[i, 0] = white
-                    if value == "Analysed":
-                        # green
-                        colours[i, j +
-                                1] = PySide.QtGui.QColor(114, 242, 73, 255)
-                    elif value == "Not analysed":
-                        # yellow
-                        colours[i, j +
-                                1] = PySide.QtGui.QColor(207, 184, 12, 255)
-                    elif value == "Failed":
-                        # red/pink
-                        colours[i, j +
-                                1] = PySide.QtGui.QColor(250, 100, 100, 255)
             table = table.tolist()
-            colours = colours.tolist()
         except:
             table = []
-            colours = []
-            gen = 0
         tableModel = Common.GenTableModel(
-            self.form, table, header, colours=colours)
+            self.form, table, header, colourMap=STATUS_COLOURS)
         tableModel.layoutChanged.emit()
         self.form.tableView.setModel(tableModel)
-        self.form.tableView.clicked.connect(functools.partial(
-            Common.showGen, self.form.tableView, self.doc))
         self.form.tableView.horizontalHeader().setResizeMode(
             PySide.QtGui.QHeaderView.ResizeToContents)
-        self.form.tableView.setMinimumHeight(22+gen*30)
-        self.form.tableView.setMaximumHeight(22+gen*30)
 
     def outputs(self, directory):
         """ It modifies the inp file to get extra outputs
@@ -227,9 +335,10 @@ class FEAPanel:
         with open(name[0], "w") as new:
             new.write(newText)
 
-    def performFEA(self, doc, Analysis, Directory):
+    def writeFEA(self, doc, Analysis, Directory):
+        """Write the input file of the analysis, returns FemToolsCcx object to solve it or None
+        existing results are not purged, that is left to the caller solving the analysis"""
         doc.recompute()
-        # run the analysis step by step
 
         # , solver=doc.SolverCcxTools)
         try:
@@ -245,14 +354,21 @@ class FEAPanel:
         fea.setup_ccx()
         message = fea.check_prerequisites()
         if not message:
-            fea.purge_results()
             fea.write_inp_file()
             self.outputs(Directory)  # to get extra information at result file
-            fea.ccx_run()
-            fea.load_results()
+            return fea
         else:
             FreeCAD.Console.PrintError(
                 "Houston, we have a problem! {}\n".format(message))  # in report view
+            return None
+
+    def performFEA(self, doc, Analysis, Directory):
+        # run the analysis step by step
+        fea = self.writeFEA(doc, Analysis, Directory)
+        if fea is not None:
+            fea.purge_results()
+            fea.ccx_run()
+            fea.load_results()
 
         # save FEA results
         doc.save()
@@ -1,17 +1,51 @@
 import FreeCAD
 import FreeCADGui
-import Fem
 import os.path
 import shutil
-from fembygen import Common
+import tempfile
+from fembygen import Common, GenerateWorker, ResultsStore
 import numpy as np
 from PySide import QtCore, QtGui    # FreeCAD's PySide!
-import multiprocessing.dummy as mp
+import multiprocessing
 from multiprocessing import cpu_count
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 LOCATION = os.path.normpath('Mod/FEMbyGEN/fembygen')
 
+# worker processes kept alive between generation runs, (number of workers, executor)
+_workerPool = None
+
+
+def workerPool(processes):
+    """Persistent pool of worker processes with FreeCAD already imported, None if workers can't be started"""
+    global _workerPool
+    processes = max(1, processes)
+    if _workerPool is not None and _workerPool[0] == processes:
+        return _workerPool[1]
+    shutdownWorkers()
+    python = Common.workerPython()
+    if python is None:
+        return None
+    # spawned workers don't inherit the state of the GUI process, which is not safe to fork
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python)
+    paths = [os.path.dirname(getattr(FreeCAD, "__file__", "")), os.path.join(FreeCAD.getHomePath(), "lib")]
+    executor = ProcessPoolExecutor(processes, mp_context=context, initializer=GenerateWorker.initWorker,
+                                   initargs=(paths,))
+    # start the workers now, so that they are ready when generation starts
+    for _ in range(processes):
+        executor.submit(len, ())
+    _workerPool = (processes, executor)
+    return executor
+
+
+def shutdownWorkers():
+    global _workerPool
+    if _workerPool is not None:
+        _workerPool[1].shutdown(wait=False)
+        _workerPool = None
+
+
 class Generate:
     """Part generations"""
 
@@ -81,6 +115,10 @@ class GeneratePanel():
         # Check if any generations have been made already, and up to what number
         self.resetViewControls()
         self.updateParametersTable()
+        try:
+            workerPool(self.doc.Generate.NumberOfCPU)
+        except Exception as e:
+            FreeCAD.Console.PrintWarning(f"Worker processes could not be started: {e}\n")
 
         self.form.more.setIcon(QtGui.QIcon(':/icons/Std_DlgParameter.svg'))
         self.form.deleteGensButton.setIcon(QtGui.QIcon(':/icons/edit-delete.svg'))
@@ -199,81 +237,61 @@ class GeneratePanel():
             settings.show()
             settings.save.clicked.connect(save)
 
-    def meshing(self, mesh, type):
-        # Remeshing new generation
-        if type == "Netgen":
-            mesh.FemMesh = Fem.FemMesh()  # cleaning old meshes
-            mesh.recompute()
-        elif type == "Gmsh":
-            from femmesh.gmshtools import GmshTools as gt
-            mesh.FemMesh = Fem.FemMesh()  # cleaning old meshes
-            gmsh_mesh = gt(mesh)
-            gmsh_mesh.create_mesh()
-
-    def copy_mesh(self, numgenerations, i):
-        docPath = os.path.normpath(self.doc.FileName)
-        name = f"Gen{i+1}"
-        directory = os.path.join(self.workingDir, name)
-        filePath = os.path.join(directory, name+".FCStd")
-        
-        # Regenerate the part and save generation as FreeCAD doc
+    def runGenerations(self, templatePath, numgenerations, progress_bar):
+        """Generate parts in worker processes (in FreeCAD if workers can't be started), returns results of
+        generations as reported by GenerateWorker.generate"""
+        jobs = {i: (templatePath, self.workingDir, i, list(numgenerations[i][:self.inumber[0]]))
+                for i in range(len(numgenerations))}
+        results = []
         try:
-            os.mkdir(directory)
-        except:
-            FreeCAD.Console.PrintWarning(f"Keeping existing {name}\n")
-            return
-        shutil.copy(docPath, filePath)
-        shutil.copy(filePath, filePath+".backup")
-
-        doc = FreeCAD.open(filePath, hidden=True)
-
-        # Produce parameters sheet for new geometry
-        doc.Parameters.set('C1', 'Value')
-        for k in range(self.inumber[0]):
-            doc.Parameters.set(
-                f'C{k+2}', f'{numgenerations[i][k]}')
-            doc.Parameters.clear(f'D1:D{k+2}')
-            doc.Parameters.clear(f'E1:E{k+2}')
-
-        # Removing generative design container in the file
-        for l in doc.GenerativeDesign.Group:
-            if l.Name == "Parameters":
-                pass
-            else:
-                doc.removeObject(l.Name)
-        doc.removeObject(doc.GenerativeDesign.Name)
-        doc.recompute()
-
-        # getting first analysis meshing object and copy it other loadcases
-        for mesh in doc.Objects:
-            if mesh.TypeId == 'Fem::FemMeshObjectPython':
-                self.meshing(mesh, "Gmsh")
-                break
-            elif mesh.TypeId == 'Fem::FemMeshShapeNetgenObject':
-                self.meshing(mesh, "Netgen")
-                break
-
-        lc = 0
-        for obj in doc.Objects:
+            executor = workerPool(self.doc.Generate.NumberOfCPU)
+        except Exception as e:
+            FreeCAD.Console.PrintWarning(f"Worker processes could not be started: {e}\n")
+            executor = None
+        else:
+            if executor is None:
+                FreeCAD.Console.PrintWarning("No Python interpreter found to start worker processes with, "
+                                             "parts are generated one by one in FreeCAD ignoring NumberOfCPU\n")
+        if executor is not None:
             try:
-                if obj.TypeId == "Fem::FemAnalysis":  # to choose analysis objects
-                    lc += 1
-                    # copying first loadcase mesh to other loadcases
-                    if lc > 1:
-                        for femobj in obj.Group:
-                            # delete old mesh of second or later analysis
-                            if femobj.TypeId in ['Fem::FemMeshObjectPython', 'Fem::FemMeshShapeNetgenObject']:
-                                doc.removeObject(femobj.Name)
-
-                        # copying same mesh to other loadcases
-                        obj.addObject(doc.copyObject(mesh, False))
-            except:
-                # after deleting mesh elements, for loop counts it again and it is not exist as object anymore
-                pass
-
-        doc.recompute()
-        doc.save()
-        FreeCAD.closeDocument(name)
+                futures = {executor.submit(GenerateWorker.generate, *job): i for i, job in jobs.items()}
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.append(future.result())
+                        del jobs[futures[future]]
+                        self.reportGeneration(results, len(numgenerations), progress_bar)
+                    QtGui.QApplication.processEvents()
+            except Exception as e:
+                shutdownWorkers()
+                FreeCAD.Console.PrintWarning(f"Worker processes failed ({e}), generating in FreeCAD\n")
+
+        # remaining generations in this process
+        if jobs:
+            GenerateWorker.initWorker()
+            try:
+                for job in jobs.values():
+                    results.append(GenerateWorker.generate(*job))
+                    self.reportGeneration(results, len(numgenerations), progress_bar)
+                    QtGui.QApplication.processEvents()
+            finally:
+                GenerateWorker.release()
+        return results
+
+    def reportGeneration(self, results, iterationnumber, progress_bar):
+        result = results[-1]
+        if result["status"] == "Generated":
+            reused = " (mesh reused)" if result["meshReused"] else ""
+            FreeCAD.Console.PrintMessage(f"Gen{result['gen']} generated in {result['time']:.1f} s{reused}\n")
+        elif result["status"] == "Kept":
+            FreeCAD.Console.PrintWarning(f"Keeping existing Gen{result['gen']}\n")
+        else:
+            FreeCAD.Console.PrintError(f"Gen{result['gen']} failed:\n{result['error']}\n")
+        # Update progress bar
+        progress_bar.next()
+        progress = (len(results)/iterationnumber) * 100
+        self.form.progressBar.setValue(progress)
 
     def generateParts(self):
         master = self.doc
@@ -318,15 +336,22 @@ class GeneratePanel():
         progress_bar.start('Generate parts ...', iterationnumber)
         self.form.progressBar.setValue(1)
 
-        func = partial(self.copy_mesh, numgenerations)
-        p = mp.Pool(self.doc.Generate.NumberOfCPU)
-        for i, _ in enumerate(p.imap_unordered(func, range(iterationnumber))):
-            # Update progress bar
-            progress_bar.next()
-            progress = ((i+1)/iterationnumber) * 100
-            self.form.progressBar.setValue(progress)
-        p.close()
-        p.join()
+        # workers load the copy of the master file once and get only parameters of each generation
+        handle, templatePath = tempfile.mkstemp(suffix=".FCStd")
+        os.close(handle)
+        shutil.copy(os.path.normpath(master.FileName), templatePath)
+        try:
+            results = self.runGenerations(templatePath, numgenerations, progress_bar)
+        finally:
+            os.remove(templatePath)
+        times = [result["time"] for result in results if result["status"] == "Generated"]
+        failed = sorted(result["gen"] for result in results if result["status"] == "Failed")
+        if times:
+            reused = sum(result["meshReused"] for result in results)
+            FreeCAD.Console.PrintMessage(f"{len(times)} generations in {sum(times):.1f} s of worker time, "
+                                         f"{np.mean(times):.1f} s per generation, {reused} meshes reused\n")
+        if failed:
+            FreeCAD.Console.PrintError(f"Failed generations: {failed}\n")
 
         # ReActivate document again once finished
         FreeCAD.setActiveDocument(master.Name)
@@ -339,7 +364,8 @@ class GeneratePanel():
         progress_bar.stop()
 
         master.save()  # too store generated values in generate object
-        FreeCAD.Console.PrintMessage("Generation done successfully!\n")
+        if not failed:
+            FreeCAD.Console.PrintMessage("Generation done successfully!\n")
         
 
     def deleteGenerations(self):
@@ -365,6 +391,9 @@ class GeneratePanel():
                         f"Error while trying to delete analysis folder for generation {i}\n")
                 else:
                     FreeCAD.Console.PrintMessage(directory + " deleted\n")
+            shutil.rmtree(os.path.join(self.workingDir, GenerateWorker.MESH_CACHE), ignore_errors=True)
+            Common.removeStatusIndex(self.workingDir)
+            ResultsStore.remove(self.workingDir)
 
             # Delete if earlier generative objects exist
             for l in self.doc.GenerativeDesign.Group:
@@ -0,0 +1,200 @@
+"""Generation of parts in worker processes.
+
+Workers import FreeCAD and the FEM modules once, load the master document once per
+generation run and receive only the parameter vector of each generation. The module
+doesn't import FreeCADGui, so that it can run in a headless interpreter.
+
+Gmsh meshes are cached in the MeshCache directory by a fingerprint of the meshed shape and the
+mesh settings, generations whose parameters don't change the meshed geometry reuse them."""
+import hashlib
+import os.path
+import shutil
+import sys
+import time
+import traceback
+
+FreeCAD = None
+Fem = None
+gmshtools = None
+_template = None    # (template file, loaded document)
+MESH_CACHE = "MeshCache"
+# properties not affecting the mesh
+IGNORED_PROPERTIES = {"FemMesh", "Label", "Label2", "ExpressionEngine", "Proxy", "Visibility"}
+
+
+def initWorker(paths=()):
+    """Import FreeCAD and the FEM modules once for the lifetime of the worker"""
+    global FreeCAD, Fem, gmshtools
+    for path in paths:
+        if path and path not in sys.path:
+            sys.path.append(path)
+    import FreeCAD
+    import Fem
+    try:
+        from femmesh import gmshtools    # imported once instead of at every meshing
+    except ImportError:
+        gmshtools = None
+
+
+def loadTemplate(templatePath, numParameters):
+    """Open the master document copy once, it is reused by all generations of the run"""
+    global _template
+    if _template is not None and _template[0] == templatePath:
+        return _template[1]
+    if _template is not None:
+        FreeCAD.closeDocument(_template[1].Name)
+        _template = None
+    doc = FreeCAD.open(templatePath, hidden=True)
+
+    # Produce parameters sheet for new geometry
+    doc.Parameters.set('C1', 'Value')
+    for k in range(numParameters):
+        doc.Parameters.clear(f'D1:D{k+2}')
+        doc.Parameters.clear(f'E1:E{k+2}')
+
+    # Removing generative design container in the file
+    for l in doc.GenerativeDesign.Group:
+        if l.Name == "Parameters":
+            pass
+        else:
+            doc.removeObject(l.Name)
+    doc.removeObject(doc.GenerativeDesign.Name)
+    _template = (templatePath, doc)
+    return doc
+
+
+def meshing(mesh, type):
+    # Remeshing new generation
+    if type == "Netgen":
+        mesh.FemMesh = Fem.FemMesh()  # cleaning old meshes
+        mesh.recompute()
+    elif type == "Gmsh":
+        mesh.FemMesh = Fem.FemMesh()  # cleaning old meshes
+        gmsh_mesh = gmshtools.GmshTools(mesh)
+        gmsh_mesh.create_mesh()
+
+
+def meshFingerprint(mesh):
+    """Hash of the BREP of the shape to mesh and the settings of the mesh object and its regions, None if the
+    shape can't be exported"""
+    shapeObj = getattr(mesh, "Part", None) or getattr(mesh, "Shape", None)
+    try:
+        sha = hashlib.sha1(shapeObj.Shape.exportBrepToString().encode())
+    except Exception:
+        return None
+    for obj in [mesh] + [o for o in mesh.OutList if o is not shapeObj]:    # mesh regions, boundary layers etc.
+        for prop in sorted(obj.PropertiesList):
+            if prop not in IGNORED_PROPERTIES:
+                value = getattr(obj, prop)
+                sha.update(f"{obj.TypeId}.{prop}={getattr(value, 'Name', value)!r}".encode())
+    return sha.hexdigest()
+
+
+def cachedMesh(workingDir, key):
+    path = os.path.join(workingDir, MESH_CACHE, key + ".unv")
+    if not os.path.isfile(path):
+        return None
+    femmesh = Fem.FemMesh()
+    femmesh.read(path)
+    return femmesh
+
+
+def cacheMesh(workingDir, key, femmesh):
+    directory = os.path.join(workingDir, MESH_CACHE)
+    os.makedirs(directory, exist_ok=True)
+    # written under a temporary name, other workers see only complete files
+    temporary = os.path.join(directory, f"{key}_{os.getpid()}.unv")
+    femmesh.write(temporary)
+    os.replace(temporary, os.path.join(directory, key + ".unv"))
+
+
+def remesh(mesh, type, workingDir):
+    """Mesh the generation or reuse the mesh of the same geometry, returns True if a mesh is reused"""
+    if type != "Gmsh":
+        # Netgen objects remesh themselves when the document is recomputed
+        meshing(mesh, type)
+        return False
+    key = meshFingerprint(mesh)
+    femmesh = cachedMesh(workingDir, key) if key else None
+    if femmesh is not None:
+        mesh.FemMesh = femmesh
+        return True
+    meshing(mesh, type)
+    if key and mesh.FemMesh.NodeCount:
+        cacheMesh(workingDir, key, mesh.FemMesh)
+    return False
+
+
+def generate(templatePath, workingDir, i, parameters):
+    """Regenerate the part with parameters and save it as generation i+1
+
+    returns {"gen", "status" (Generated, Kept or Failed), "meshReused", "time", "error"}"""
+    start = time.time()
+    name = f"Gen{i+1}"
+    result = {"gen": i+1, "status": "Generated", "meshReused": False, "time": 0.0, "error": ""}
+    directory = os.path.join(workingDir, name)
+    filePath = os.path.join(directory, name+".FCStd")
+    try:
+        os.mkdir(directory)
+    except FileExistsError:
+        result["status"] = "Kept"
+        return result
+    except OSError:
+        result["status"] = "Failed"
+        result["error"] = traceback.format_exc()
+        return result
+    try:
+        doc = loadTemplate(templatePath, len(parameters))
+        shutil.copy(templatePath, filePath+".backup")
+        for k, value in enumerate(parameters):
+            doc.Parameters.set(f'C{k+2}', f'{value}')
+        doc.recompute()
+
+        # getting first analysis meshing object and copy it other loadcases
+        for mesh in doc.Objects:
+            if mesh.TypeId == 'Fem::FemMeshObjectPython':
+                result["meshReused"] = remesh(mesh, "Gmsh", workingDir)
+                break
+            elif mesh.TypeId == 'Fem::FemMeshShapeNetgenObject':
+                result["meshReused"] = remesh(mesh, "Netgen", workingDir)
+                break
+
+        lc = 0
+        for obj in doc.Objects:
+            try:
+                if obj.TypeId == "Fem::FemAnalysis":  # to choose analysis objects
+                    lc += 1
+                    # copying first loadcase mesh to other loadcases
+                    if lc > 1:
+                        for femobj in obj.Group:
+                            # delete old mesh of second or later analysis
+                            if femobj.TypeId in ['Fem::FemMeshObjectPython', 'Fem::FemMeshShapeNetgenObject']:
+                                doc.removeObject(femobj.Name)
+
+                        # copying same mesh to other loadcases
+                        obj.addObject(doc.copyObject(mesh, False))
+            except:
+                # after deleting mesh elements, for loop counts it again and it is not exist as object anymore
+                pass
+
+        doc.recompute()
+        doc.saveAs(filePath)
+    except Exception:
+        result["status"] = "Failed"
+        result["error"] = traceback.format_exc()
+        # the template may be left half modified, the next generation opens it again
+        release()
+    result["time"] = time.time() - start
+    return result
+
+
+def release():
+    """Close the master document copy of the finished run"""
+    global _template
+    if _template is not None:
+        doc = _template[1]
+        _template = None
+        try:
+            FreeCAD.closeDocument(doc.Name)
+        except Exception:
+            pass
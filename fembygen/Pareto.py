@@ -0,0 +1,204 @@
+# Multi-objective ranking of generations without FreeCAD, all objectives are minimized.
+# Designs are sorted into successive non-dominated fronts: two and three objectives are swept in O(N log N) keeping a
+# staircase of the non-dominated points of each front, more objectives are compared in blocks of rows so memory stays
+# bounded. Designs of a front are ordered by their crowding distance. ParetoRanking keeps the fronts of designs which
+# are added in batches and sorts again only the fronts that the new designs can change.
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+BLOCK_ELEMENTS = 2**22  # size of dominance comparison blocks of many objectives
+
+
+def nonDominatedFronts(objectives):
+    """Front of each row of the (n_designs, n_objectives) array, 0 is the Pareto front
+    rows with missing (NaN) values form the last front"""
+    points = np.asarray(objectives, dtype=float).reshape(len(objectives), -1)
+    fronts = np.zeros(len(points), dtype=int)
+    valid = ~np.isnan(points).any(axis=1)
+    if valid.any() and points.shape[1]:
+        # equal designs share their front, rows are sorted by the first objective then the next ones
+        unique, inverse = np.unique(points[valid], axis=0, return_inverse=True)
+        if unique.shape[1] == 1:
+            ranks = np.arange(len(unique))
+        elif unique.shape[1] == 2:
+            ranks = sweep2(unique)
+        elif unique.shape[1] == 3:
+            ranks = sweep3(unique)
+        else:
+            ranks = blockFronts(unique)
+        fronts[valid] = ranks[inverse.ravel()]
+        fronts[~valid] = ranks.max() + 1
+    return fronts
+
+
+def sweep2(points):
+    """Fronts of distinct points sorted by rows, a point belongs to the first front whose smallest second objective
+    is larger than its own"""
+    ranks = np.empty(len(points), dtype=int)
+    minimum = []  # smallest second objective of each front, it increases with the front
+    for i, value in enumerate(points[:, 1].tolist()):
+        k = bisect_right(minimum, value)
+        if k == len(minimum):
+            minimum.append(value)
+        else:
+            minimum[k] = value
+        ranks[i] = k
+    return ranks
+
+
+def sweep3(points):
+    """Fronts of distinct points sorted by rows, every front keeps the staircase of its points non-dominated in the
+    second and third objectives, the first front not dominating a point is found by bisection"""
+    ranks = np.empty(len(points), dtype=int)
+    stairs = []  # [second objectives increasing, third objectives decreasing] of each front
+
+    def dominated(stair, a, b):
+        i = bisect_right(stair[0], a) - 1
+        return i >= 0 and stair[1][i] <= b
+
+    for i, (a, b) in enumerate(points[:, 1:].tolist()):
+        # a front dominating the point is always preceded by fronts dominating it
+        lo, hi = 0, len(stairs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if dominated(stairs[mid], a, b):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(stairs):
+            stairs.append([[], []])
+        xs, ys = stairs[lo]
+        start = end = bisect_left(xs, a)
+        while end < len(ys) and ys[end] >= b:
+            end += 1
+        xs[start:end] = [a]
+        ys[start:end] = [b]
+        ranks[i] = lo
+    return ranks
+
+
+def blockFronts(points):
+    """Fronts of distinct points by dominance checks, a point can only be dominated by points with a smaller sum of
+    objectives, so points are ranked in that order block by block"""
+    n, m = points.shape
+    order = np.argsort(points.sum(axis=1), kind="stable")
+    sortedPoints = points[order]
+    ranks = np.empty(n, dtype=int)
+    block = max(1, BLOCK_ELEMENTS // n)
+    for start in range(0, n, block):
+        rows = sortedPoints[start:start+block]
+        earlier = sortedPoints[:start+len(rows)]
+        # dominance[i, j]: point j dominates point start+i, points are distinct so no better objective is needed
+        dominance = earlier[:, 0] <= rows[:, 0, None]
+        for k in range(1, m):
+            dominance &= earlier[:, k] <= rows[:, k, None]
+        if start:
+            ranks[start:start+len(rows)] = np.max(np.where(dominance[:, :start], ranks[:start], -1), axis=1) + 1
+        else:
+            ranks[:len(rows)] = 0
+        for i in range(len(rows)):
+            within = dominance[i, start:start+i]
+            if within.any():
+                ranks[start+i] = max(ranks[start+i], ranks[start:start+i][within].max() + 1)
+    fronts = np.empty(n, dtype=int)
+    fronts[order] = ranks
+    return fronts
+
+
+def crowdingDistance(objectives, fronts):
+    """Crowding distance of each design within its front, infinite for the extreme designs of the front, 0 for
+    designs with missing values"""
+    points = np.asarray(objectives, dtype=float).reshape(len(fronts), -1)
+    fronts = np.asarray(fronts)
+    n = len(points)
+    distance = np.zeros(n)
+    if not n:
+        return distance
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for k in range(points.shape[1]):
+            order = np.lexsort((points[:, k], fronts))
+            values = points[order, k]
+            front = fronts[order]
+            first = np.r_[True, front[1:] != front[:-1]]
+            last = np.r_[front[1:] != front[:-1], True]
+            starts = np.flatnonzero(first)
+            span = np.repeat(np.maximum.reduceat(values, starts) - np.minimum.reduceat(values, starts),
+                             np.diff(np.r_[starts, n]))
+            gap = np.zeros(n)
+            gap[1:-1] = values[2:] - values[:-2]
+            gap = np.where(span > 0, gap / np.where(span > 0, span, 1), 0)
+            gap[first | last] = np.inf
+            distance[order] += gap
+    distance[np.isnan(points).any(axis=1)] = 0
+    return distance
+
+
+def paretoOrder(fronts, crowding):
+    """Indices of designs from the best one, by front and then by decreasing crowding distance"""
+    return np.lexsort((-np.asarray(crowding), np.asarray(fronts)))
+
+
+def dominates(points, point):
+    """True if any of the points dominates point"""
+    return bool(np.any(np.all(points <= point, axis=1) & np.any(points < point, axis=1)))
+
+
+class ParetoRanking:
+    """Fronts and crowding distances of designs added in batches, e.g. while generations are analysed
+
+    Designs of the fronts before the best front a new design reaches can't be dominated by new designs, only the
+    remaining fronts are sorted again together with the new designs."""
+
+    def __init__(self, objectives=None):
+        self.objectives = None
+        self.fronts = np.zeros(0, dtype=int)
+        self.crowding = np.zeros(0)
+        if objectives is not None:
+            self.add(objectives)
+
+    def firstFront(self, point, members):
+        """Front a new design reaches among the existing fronts (members is the list of their rows)"""
+        lo, hi = 0, len(members)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if dominates(members[mid], point):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def add(self, objectives):
+        """Add designs, returns their indices"""
+        new = np.asarray(objectives, dtype=float)
+        new = new.reshape(len(new), -1)
+        old = 0 if self.objectives is None else len(self.objectives)
+        if not old:
+            self.objectives = new
+            self.fronts = nonDominatedFronts(new)
+        else:
+            valid = ~np.isnan(self.objectives).any(axis=1)
+            numFronts = self.fronts[valid].max() + 1 if valid.any() else 0
+            order = np.argsort(self.fronts[valid], kind="stable")
+            points = self.objectives[valid][order]
+            members = np.split(points, np.flatnonzero(np.diff(self.fronts[valid][order])) + 1)[:numFronts]
+            first = numFronts
+            for point in new[~np.isnan(new).any(axis=1)]:
+                first = min(first, self.firstFront(point, members))
+                if not first:
+                    break
+            self.objectives = np.vstack((self.objectives, new))
+            self.fronts = np.r_[self.fronts, np.zeros(len(new), dtype=int)]
+            tail = np.flatnonzero(self.fronts[:old] >= first)
+            tail = np.r_[tail, np.arange(old, len(self.objectives))]
+            self.fronts[tail] = nonDominatedFronts(self.objectives[tail]) + first
+        self.crowding = crowdingDistance(self.objectives, self.fronts)
+        return np.arange(old, len(self.objectives))
+
+    def order(self):
+        return paretoOrder(self.fronts, self.crowding)
+
+
+def rank(objectives):
+    """Fronts and crowding distances of the (n_designs, n_objectives) array"""
+    fronts = nonDominatedFronts(objectives)
+    return fronts, crowdingDistance(objectives, fronts)
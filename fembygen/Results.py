@@ -5,14 +5,22 @@ from PySide.QtGui import QTableWidgetItem
 import matplotlib.pyplot as plt
 import os.path
 import numpy as np
-from fembygen import Common
-import glob
+from fembygen import Common, CcxResults, ResultsStore, Pareto
 import functools
-from scipy.stats import pearsonr , f_oneway
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from femresult.resulttools import fill_femresult_stats
 from FreeCAD.Plot import Plot
 
+# nodal result fields combined for load cases besides DisplacementVectors
+RESULT_FIELDS = ["DisplacementLengths", "MaxShear", "NodeStrainXX", "NodeStrainXY", "NodeStrainXZ", "NodeStrainYY",
+                 "NodeStrainYZ", "NodeStrainZZ", "NodeStressXX", "NodeStressXY", "NodeStressXZ", "NodeStressYY",
+                 "NodeStressYZ", "NodeStressZZ", "PrincipalMax", "PrincipalMed", "PrincipalMin", "vonMises"]
+METRIC_NAMES = ["Volume[mm^3]", "Max Stress[MPa]", "Max Disp[mm]", "Mean Stress[MPa]", "Internal Energy[Joule]",
+                "Standard Dev. of En. Den"]
+
 def makeResult():
     try:
         obj = FreeCAD.ActiveDocument.Results
@@ -48,6 +56,14 @@ class Result:
                             "Summary Result lists")
         except:
             pass
+        try:
+            obj.addProperty("App::PropertyEnumeration", "CombinationMode", "Base",
+                            "Combination of load case results of a generation")
+            obj.CombinationMode = CcxResults.COMBINATION_MODES
+            obj.addProperty("App::PropertyFloatList", "LoadCaseWeights", "Base",
+                            "Weights of load cases for the weighted sum")
+        except:
+            pass
 
 
 class ResultsCommand():
@@ -92,12 +108,17 @@ class ResultsPanel:
             FreeCAD.Console.PrintMessage("Calculating metrics...\n")
             self.calcAndSaveFEAMetrics()
         self.form.arrange.clicked.connect(self.ranking)
+        self.form.paretoRanking.clicked.connect(self.paretoRanking)
         self.form.comboBox_3.currentIndexChanged.connect(self.update_anova_table)
         self.form.comboBox_2.currentIndexChanged.connect(self.plotParetoGraph)
         self.form.comboBox.currentIndexChanged.connect(self.update_table)   
 
         self.updateResultsTableAll()
         self.updateResultsTableSum()
+        self.form.resultsTable_all.clicked.connect(functools.partial(
+            self.showGen, self.form.resultsTable_all))
+        self.form.resultsTable_sum.clicked.connect(functools.partial(
+            self.showGen, self.form.resultsTable_sum))
         self.doc.save()
           
     def updateResultsTableAll(self):
@@ -113,19 +134,14 @@ class ResultsPanel:
         table = table.tolist()
         header = ["Gen"]+header
 
-        colours = self.generateColourScalesFromMetrics(
+        colourScale = self.generateColourScalesFromMetrics(
             self.doc.Results.FEAMetricsAll)
         self.tableModel = Common.GenTableModel(
-            self.form, table, header, colours)
+            self.form, table, header, colourScale=colourScale)
         self.form.resultsTable_all.setModel(self.tableModel)
         self.form.resultsTable_all.resizeColumnsToContents()
         self.form.resultsTable_all.horizontalHeader().setResizeMode(
             PySide.QtGui.QHeaderView.ResizeToContents)
-
-        self.form.resultsTable_all.clicked.connect(functools.partial(
-            Common.showGen, self.form.resultsTable_all, self.doc))
-        self.form.resultsTable_all.setMinimumHeight(30+len(index)*31)
-        self.form.resultsTable_all.setMaximumHeight(30+len(index)*31)
         self.form.resultsTable_all.setSortingEnabled(True)
 
     def updateResultsTableSum(self, score=None):
@@ -140,119 +156,101 @@ class ResultsPanel:
         table = table.tolist()
         header = ["Gen"]+header
 
-        colours = self.generateColourScalesFromMetrics(
+        colourScale = self.generateColourScalesFromMetrics(
             self.doc.Results.FEAMetricsSum)
         self.tableModel = Common.GenTableModel(
-            self.form, table, header, colours, score)
+            self.form, table, header, score=score, colourScale=colourScale)
         self.form.resultsTable_sum.setModel(self.tableModel)
         self.form.resultsTable_sum.resizeColumnsToContents()
         self.form.resultsTable_sum.horizontalHeader().setResizeMode(
             PySide.QtGui.QHeaderView.ResizeToContents)
-
-        self.form.resultsTable_sum.clicked.connect(functools.partial(
-            Common.showGen, self.form.resultsTable_sum, self.doc))
-        self.form.resultsTable_sum.setMinimumHeight(30+gen*31)
-        self.form.resultsTable_sum.setMaximumHeight(30+gen*31)
         self.form.resultsTable_sum.setSortingEnabled(True)
 
     def generateColourScalesFromMetrics(self, table):
-        items = np.array(table[1:], dtype=np.dtype("float"))
-        width = len(table[0])
-        height = len(items)
-        colours = [[PySide.QtGui.QColor("white")
-                    for x in range(width+1)] for y in range(height)]
+        """Values of metrics normalized to 0~1 in each column for the colour scale, NaN for items which are not
+        numbers (likely because an error occurred for analysis in this row)"""
+        items = np.array(table[1:], dtype=np.dtype("float")).reshape(len(table)-1, len(table[0]))
 
-        for i in range(width):
-            try:
-                vals = items[:, i]
-            except ValueError:
-                FreeCAD.Console.PrintError("Results couldn't converted to the number.\n")
-
-            # Calculate value range to calibrate colour scale
-            minVal = min(vals)
-            maxVal = max(vals)
-            valRange = maxVal - minVal
-            for j, value in enumerate(vals):
-                try:
-                    if value > maxVal:
-                        # If value is greater than maximum, set it to full intensity
-                        normVal = 1.0
-                    else:
-                        if valRange != 0:
-                            normVal = (value - minVal) / valRange
-                        else:
-                            normVal = 0
-
-                    col = self.rgb(normVal)
-                    colours[j][i+1] = PySide.QtGui.QColor(
-                        col[0], col[1], col[2], 255)
-                except ValueError:
-                    # Item was not a number. Likely a string because an error occurred for analysis in this row
-                    # so colour it pink
-                    colours[j][i+1] = PySide.QtGui.QColor(230, 184, 184, 255)
-                    pass
-
-        return colours
-
-    def rgb(self, normVal):
-        mult = 1-normVal
-        return int(mult*200), 255, int(mult*200)
+        # Calculate value range to calibrate colour scale
+        with np.errstate(invalid="ignore"):
+            minVal = np.nanmin(items, axis=0) if len(items) else 0
+            valRange = (np.nanmax(items, axis=0) - minVal) if len(items) else 0
+            return np.where(valRange != 0, (items - minVal) / np.where(valRange != 0, valRange, 1), 0*items)
 
     def calcAndSaveFEAMetrics(self):
         master = self.doc
         numGenerations = Common.checkGenerations(self.workingDir)
         if numGenerations > 0:
-            header = [["Volume[mm^3]", "Max Stress[MPa]", "Max Disp[mm]", "Mean Stress[MPa]", "Internal Energy[Joule]", "Standard Dev. of En. Den"
-                       ]]
+            header = [list(METRIC_NAMES)]
 
-            resultAll, resultSum = self.calculateFEAMetric()
-            tableAll = header + resultAll
-            tableSum = header+resultSum
+            metricsAll, metricsSum, numLoadCases = self.calculateFEAMetric()
+            # full precision values are kept in the results store, the tables show formatted ones
+            self.saveResultsStore(metricsAll, metricsSum, numLoadCases)
+            tableAll = header + self.formatMetrics(metricsAll)
+            tableSum = header + self.formatMetrics(metricsSum)
             master.Results.FEAMetricsAll = tableAll
             master.Results.FEAMetricsSum = tableSum
         FreeCAD.open(master.FileName)
 
+    def formatMetrics(self, metrics):
+        return [[None if np.isnan(x) else f"{x:.2e}" for x in row] for row in metrics.tolist()]
+
+    def saveResultsStore(self, metricsAll, metricsSum, numLoadCases):
+        master = self.doc
+        try:
+            parameters = np.array(master.Generate.GeneratedParameters, dtype=np.dtype("float"))
+            parameterNames = master.Generate.ParametersName
+        except Exception:
+            parameters, parameterNames = None, []
+        if parameters is None or parameters.ndim != 2 or len(parameters) != len(metricsSum):
+            parameters, parameterNames = None, []
+        ResultsStore.save(self.workingDir, METRIC_NAMES, metricsAll, metricsSum, numLoadCases,
+                          parameterNames, parameters)
+
+    def resultsStore(self):
+        """Results store of the working directory, it is written from the metrics tables if it is missing or doesn't
+        match them (e.g. master files saved before the store existed)"""
+        store = ResultsStore.load(self.workingDir)
+        items = self.doc.Results.FEAMetricsSum[1:]
+        if store is None or len(store.sum) != len(items):
+            metricsAll = np.array(self.doc.Results.FEAMetricsAll[1:], dtype=np.dtype("float"))
+            metricsSum = np.array(items, dtype=np.dtype("float"))
+            self.saveResultsStore(metricsAll, metricsSum, len(metricsAll) // max(len(metricsSum), 1))
+            store = ResultsStore.load(self.workingDir)
+        return store
+
     def calculateFEAMetric(self):
+        """FEA metrics of load cases (rows gen1.lc1, gen1.lc2, ...) and generations, NaN for missing results,
+        and the number of load cases"""
         master = self.doc
         statuses, numgAnly, lc = Common.searchAnalysed(master)
         result = []
         deviation = []
 
-        # Getting the analysis table to read results
+        # Getting the analysis table to read results, generation files are not opened
+        resultPaths = [self.workingDir + f"/Gen{i+1}/loadCase_{j+1}/"
+                       for i, row in enumerate(statuses) for j, value in enumerate(row) if value == "Analysed"]
+        metrics = self.readMetrics(resultPaths)
         for i, row in enumerate(statuses):
-            # open the generation file
-            filename = f"Gen{i+1}"
-            filePath = self.workingDir + f"/Gen{i+1}/{filename}.FCStd"
-            doc = FreeCAD.open(filePath, hidden=True)
-
             # for each loadcases it's read the results
-            results = doc.findObjects('Fem::FemResultObjectPython')
             for j, value in enumerate(row):
                 if value == "Analysed":
-                    try:
-                        resultPath = self.workingDir + f"/Gen{i+1}/loadCase_{j+1}/"
-                        mean = np.mean(results[j].vonMises)
-                        max = np.max(results[j].vonMises)
-                        maxDisp = np.max(results[j].DisplacementLengths)
-
-                        intData, totalInt, volData, totalVol, denData = self.IntEnergyandVolume(
-                            resultPath)
-                        energyDenStd = np.std(denData)
+                    resultPath = self.workingDir + f"/Gen{i+1}/loadCase_{j+1}/"
+                    if not isinstance(metrics[resultPath], Exception):
+                        values, denData = metrics[resultPath]
                         deviation.append(denData)
-                        result.append([f"{totalVol:.2e}", f"{max:.2e}", f"{maxDisp:.2e}",
-                                       f"{mean:.2e}", f"{totalInt:.2e}", f"{energyDenStd:.2e}"])
+                        result.append(values)
                         FreeCAD.Console.PrintMessage(f"Generation {i+1} Analysis {j+1} result values imported\n")
-                    except:
+                    else:
                         FreeCAD.Console.PrintError(
                             f"During getting result values of Generation {i+1} Analysis {j+1} problem occurred. Please check the generation results by opening Gen{i+1} folder in master file directory.\n")
-                        result.append([None]*6)
+                        deviation.append(None)
+                        result.append([np.nan]*6)
                 else:
                     FreeCAD.Console.PrintError(f"Generation {i+1} Loadcase {j+1} couldn't imported\n")
-                    result.append([None]*6)
+                    deviation.append(None)
+                    result.append([np.nan]*6)
 
-            self.getResultsToMaster(doc, results[0])
-            
-            FreeCAD.closeDocument(filename)
         result_sum = []
         res = np.array(result, dtype=np.dtype("float"))
 
@@ -266,12 +264,75 @@ class ResultsPanel:
                 meanStr = np.mean(res[k:k+lc, 3])
                 maxStr = np.max(res[k:k+lc, 4])
                 maxdisp = np.max(res[k:k+lc, 5])
-                result_sum.append([f"{volume:.2e}", f"{internal:.2e}", f"{std:.2e}",
-                                   f"{meanStr:.2e}", f"{maxStr:.2e}", f"{maxdisp:.2e}"])
+                result_sum.append([volume, internal, std, meanStr, maxStr, maxdisp])
             except:
-                result_sum.append([None]*6)
-
-        return result, result_sum
+                result_sum.append([np.nan]*6)
+
+        return res.reshape(-1, 6), np.array(result_sum, dtype=np.dtype("float")).reshape(-1, 6), lc
+
+    def readMetrics(self, resultPaths):
+        """FEA metrics of load case directories read from CalculiX result files in worker processes,
+        returns {path: CcxResults.loadCaseMetrics or the exception raised while reading}
+        metrics are cached in this process, load cases whose result files haven't changed are not read again"""
+        metrics = {}
+        stamps = {path: CcxResults.resultStamp(path) for path in resultPaths}
+        for path in resultPaths:
+            cached = CcxResults.cachedMetrics(path, stamps[path])
+            if cached is not None:
+                metrics[path] = cached
+        unread = [path for path in resultPaths if path not in metrics]
+        python = Common.workerPython()
+        if python is not None and len(unread) > 1:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(python)
+            try:
+                with ProcessPoolExecutor(min(len(unread), os.cpu_count() or 1), mp_context=context) as executor:
+                    futures = [executor.submit(CcxResults.loadCaseMetrics, path) for path in unread]
+                    for path, future in zip(unread, futures):
+                        try:
+                            metrics[path] = future.result()
+                        except BrokenProcessPool:
+                            break
+                        except Exception as e:
+                            metrics[path] = e
+                        PySide.QtGui.QApplication.processEvents()
+            except Exception as e:
+                FreeCAD.Console.PrintWarning(f"Worker processes failed ({e}), reading results in FreeCAD\n")
+
+        # remaining results in this process
+        for path in resultPaths:
+            if path not in metrics:
+                try:
+                    metrics[path] = CcxResults.loadCaseMetrics(path)
+                except Exception as e:
+                    metrics[path] = e
+        for path in unread:
+            if not isinstance(metrics[path], Exception):
+                CcxResults.cacheMetrics(path, stamps[path], metrics[path])
+        return metrics
+
+    def showGen(self, table, item):
+        """Open the generation of the clicked row, its load case results are summed to the master file first time
+        and combined again if the combination mode or weights have changed since"""
+        Common.showGen(table, self.doc, item)
+        doc = FreeCAD.ActiveDocument
+        if doc.Name == self.doc.Name:
+            return
+        combined = self.doc.getObjectsByLabel(f"{doc.Name}_Results")
+        if not combined:
+            results = doc.findObjects('Fem::FemResultObjectPython')
+            if results:
+                self.getResultsToMaster(doc, results[0])
+                FreeCAD.setActiveDocument(doc.Name)
+        elif getattr(combined[0], "Combination", None) != self.combination():
+            self.sumResults(combined[0], doc)
+            FreeCAD.setActiveDocument(doc.Name)
+
+    def combination(self):
+        """Combination mode and weights of load cases as recorded on combined results"""
+        mode = getattr(self.doc.Results, "CombinationMode", "Sum")
+        weights = list(getattr(self.doc.Results, "LoadCaseWeights", None) or [])
+        return f"{mode} {weights}" if mode == "Weighted sum" else mode
 
     def sumResults(self, total, doc):
         """The function is for sum the results objects of Loadcases. By the way optimum model can be selected in a better way.
@@ -280,72 +341,30 @@ class ResultsPanel:
         https://us.v-cdn.net/6032193/uploads/JE71WKGYSLZ2/image.png
 
         For this function work, meshes of all Loadcases needs to be same.
+        Results are summed, weighted or enveloped according to CombinationMode of the Results object.
         """
-        DisplacementLengths = np.zeros(len(total.DisplacementLengths))
-        DisplacementVectors = np.zeros((len(total.DisplacementVectors), 3))
-        MaxShear = np.zeros(len(total.MaxShear))
-        NodeStrainXX = np.zeros(len(total.NodeStrainXX))
-        NodeStrainXY = np.zeros(len(total.NodeStrainXY))
-        NodeStrainXZ = np.zeros(len(total.NodeStrainXZ))
-        NodeStrainYY = np.zeros(len(total.NodeStrainYY))
-        NodeStrainYZ = np.zeros(len(total.NodeStrainYZ))
-        NodeStrainZZ = np.zeros(len(total.NodeStrainZZ))
-        NodeStressXX = np.zeros(len(total.NodeStressXX))
-        NodeStressXY = np.zeros(len(total.NodeStressXY))
-        NodeStressXZ = np.zeros(len(total.NodeStressXZ))
-        NodeStressYY = np.zeros(len(total.NodeStressYY))
-        NodeStressYZ = np.zeros(len(total.NodeStressYZ))
-        NodeStressZZ = np.zeros(len(total.NodeStressZZ))
-        PrincipalMax = np.zeros(len(total.PrincipalMax))
-        PrincipalMed = np.zeros(len(total.PrincipalMed))
-        PrincipalMin = np.zeros(len(total.PrincipalMin))
-        vonMises = np.zeros(len(total.vonMises))
-        for obj in doc.Objects:
-            if obj.TypeId == 'Fem::FemResultObjectPython':
-                DisplacementLengths += np.array(obj.DisplacementLengths)
-                DisplacementVectors += np.array(obj.DisplacementVectors)
-                MaxShear += np.array(obj.MaxShear)
-                NodeStrainXX += np.array(obj.NodeStrainXX)
-                NodeStrainXY += np.array(obj.NodeStrainXY)
-                NodeStrainXZ += np.array(obj.NodeStrainXZ)
-                NodeStrainYY += np.array(obj.NodeStrainYY)
-                NodeStrainYZ += np.array(obj.NodeStrainYZ)
-                NodeStrainZZ += np.array(obj.NodeStrainZZ)
-                NodeStressXX += np.array(obj.NodeStressXX)
-                NodeStressXY += np.array(obj.NodeStressXY)
-                NodeStressXZ += np.array(obj.NodeStressXZ)
-                NodeStressYY += np.array(obj.NodeStressYY)
-                NodeStressYZ += np.array(obj.NodeStressYZ)
-                NodeStressZZ += np.array(obj.NodeStressZZ)
-                PrincipalMax += np.array(obj.PrincipalMax)
-                PrincipalMed += np.array(obj.PrincipalMed)
-                PrincipalMin += np.array(obj.PrincipalMin)
-                vonMises += np.array(obj.vonMises)
-
-        # Assigning summed results to the an object
-        total.DisplacementLengths = DisplacementLengths.tolist()  # it includes Vector object, therefore it converted to the list
-        vectorized = []
-        for i in DisplacementVectors.tolist():
-            vectorized.append(FreeCAD.Vector(i))
-        total.DisplacementVectors = vectorized
-        total.MaxShear = MaxShear.tolist()
-        total.NodeStrainXX = NodeStrainXX.tolist()
-        total.NodeStrainXY = NodeStrainXY.tolist()
-        total.NodeStrainXZ = NodeStrainXZ.tolist()
-        total.NodeStrainYY = NodeStrainYY.tolist()
-        total.NodeStrainYZ = NodeStrainYZ.tolist()
-        total.NodeStrainZZ = NodeStrainZZ.tolist()
-        total.NodeStressXX = NodeStressXX.tolist()
-        total.NodeStressXY = NodeStressXY.tolist()
-        total.NodeStressXZ = NodeStressXZ.tolist()
-        total.NodeStressYY = NodeStressYY.tolist()
-        total.NodeStressYZ = NodeStressYZ.tolist()
-        total.NodeStressZZ = NodeStressZZ.tolist()
-        total.PrincipalMax = PrincipalMax.tolist()
-        total.PrincipalMed = PrincipalMed.tolist()
-        total.PrincipalMin = PrincipalMin.tolist()
-        total.vonMises = vonMises.tolist()
+        cases = [obj for obj in doc.Objects if obj.TypeId == 'Fem::FemResultObjectPython']
+        numNodes = len(total.DisplacementVectors)
+        fields = [field for field in RESULT_FIELDS if len(getattr(total, field))]  # empty ones are not computed
+        # all fields of all load cases in one array, displacement vectors are the first three fields
+        values = np.empty((len(cases), 3+len(fields), numNodes))
+        for k, obj in enumerate(cases):
+            values[k, :3] = np.array(obj.DisplacementVectors).reshape(numNodes, 3).T
+            for f, field in enumerate(fields):
+                values[k, 3+f] = getattr(obj, field)
+        mode = getattr(self.doc.Results, "CombinationMode", "Sum")
+        weights = getattr(self.doc.Results, "LoadCaseWeights", None)
+        combined = CcxResults.combineLoadCases(values, mode, weights)
+
+        # Assigning combined results to the an object
+        total.DisplacementVectors = list(map(FreeCAD.Vector, combined[:3].T.tolist()))
+        for f, field in enumerate(fields):
+            setattr(total, field, combined[3+f].tolist())
         fill_femresult_stats(total)
+        if not hasattr(total, "Combination"):
+            total.addProperty("App::PropertyString", "Combination", "Base",
+                              "Combination of load cases the results are made of")
+        total.Combination = self.combination()
 
     def getResultsToMaster(self, doc, object):
         master = self.doc
@@ -374,161 +393,59 @@ class ResultsPanel:
 
     def IntEnergyandVolume(self, resultPath):
         """to get volume information and internal energy information from dat file"""
-        name = glob.glob(resultPath + "*.dat")
-        with open(name[0], "r") as datfile:
-            text = datfile.read()
-
-        # getting elemental internal energy results
-        internal = text.find(" internal energy")
-        internalStart = text.find("\n", internal)+2
-        internalEnd = text.find(" total internal", internalStart)-1
-        intData = np.fromstring(text[internalStart:internalEnd], sep="\n")
-        intData = intData.reshape(len(intData)//2, 2)
-
-        # getting total internal energy
-        totalIntStart = text.find("\n", internalEnd+1)+1
-        totalIntEnd = text.find("volume", totalIntStart)-1
-        totalInt = float(text[totalIntStart:totalIntEnd])
-
-        # getting elements volume
-        volStart = text.find("\n", totalIntEnd+1)+1
-        volEnd = text.find("total volume", totalIntStart)-1
-        volData = np.fromstring(text[volStart:volEnd], sep="\n")
-        volData = volData.reshape(len(volData)//2, 2)
-
-        # getting total volume
-        totalVolStart = text.find("\n", volEnd+1)+1
-        totalVolEnd = text.find("internal energy density", totalVolStart)-1
-        totalVol = float(text[totalVolStart:totalVolEnd])
-
-        # getting density from file
-        denStart = text.find("\n", totalVolEnd+1)+1
-        denEnd = -1  # text.find("total volume", totalVolStart)
-        denData = np.fromstring(text[denStart:denEnd], sep="\n")
-        denData = denData.reshape(len(denData)//3, 3)
-
-        # Joule , Joule, mm^3, mm^3, Joule
-        return intData[:, 1]*1000, totalInt*1000, volData[:, 1], totalVol, denData[:, 2]*1000
+        return CcxResults.intEnergyAndVolume(resultPath)
+
+    def rankingWeights(self):
+        """Weights of the metric columns from the ranking fields scaled to a total of 100, None if they are not valid"""
+        fields = [self.form.volume, self.form.maxstress, self.form.maxdisplacement, self.form.meanstress,
+                  self.form.internalenergy, self.form.standarddeviation]
+        try:
+            weights = np.array([float(field.toPlainText()) for field in fields])
+        except ValueError:
+            FreeCAD.Console.PrintError('Weights need to be numbers\n')
+            return None
+        if np.any(weights < 0) or weights.sum() <= 0:
+            FreeCAD.Console.PrintError('Weights need to be positive or zero with a positive total\n')
+            return None
+        return weights * 100 / weights.sum()
 
     def ranking(self):
         """ By using weight of the result, it arranges the results.
         """
-        table = np.array(
-            self.doc.Results.FEAMetricsSum[1:], dtype=np.dtype("float"))
-        volume = float(self.form.volume.toPlainText())
-        maxs = float(self.form.maxstress.toPlainText())
-        maxd = float(self.form.maxdisplacement.toPlainText())
-        means = float(self.form.meanstress.toPlainText())
-        intEn = float(self.form.internalenergy.toPlainText())
-        std = float(self.form.standarddeviation.toPlainText())
-        try:
-            assert volume+intEn+std+means+maxs+maxd == 100
-            # calculating normalized value of results
-            # max result will be 0, min result will be 1
-            row, column = table.shape
-            normTable = np.zeros((row, column))
-            for i in range(column):
-                normTable[:, i] = 1-self.normalize(table[:, i])
-                
-            # Calculating score by using weight and normalized results
-            score = volume*normTable[:, 0] + maxs*normTable[:, 1] + maxd*normTable[:, 2] + \
-                means*normTable[:, 3] + intEn * \
-                normTable[:, 4] + std*normTable[:, 5]
-            self.updateResultsTableSum(score)
-        except:
-            FreeCAD.Console.PrintError('Total weignt needs to be 100\n')
-        
-    def corelation(self):
-        master = self.doc
-        results = np.array(
-            master.Results.FEAMetricsSum[1:], dtype=np.dtype("float"))
-        parameters1 =   np.array(
-            master.Generate.GeneratedParameters, dtype=np.dtype("float"))
-        parameterValues = np.transpose(parameters1)
-        parameters = master.Generate.ParametersName
-
-        cor_table = [] 
-        for index, param in enumerate(parameters):
-            row = [param]    
-            for j in range(len(results[0])):
-                corr, _ = pearsonr(parameterValues[index], [item[j] for item in results])
-                row.append(round(corr, 4))
-            cor_table.append(row)
-
-        return cor_table
-
-    def update_table(self, index):
-        cor_table = self.corelation()
-        self.form.tableWidget.setColumnCount(2)
-        self.form.tableWidget.setRowCount(len(cor_table))
-        self.form.tableWidget.setHorizontalHeaderLabels(["Parameters", "Correlation Coef."])
-        
-        for i, row in enumerate(cor_table):
-            item_param = QTableWidgetItem(row[0]) 
-            item_coef = QTableWidgetItem(str(row[index + 1]))  
-            self.form.tableWidget.setItem(i, 0, item_param)
-            self.form.tableWidget.setItem(i, 1, item_coef)
-            item_coef.setToolTip("As this value approaches -1 or 1, the strength of the effect increases - negative effect, + means positive effect.")
-
-    def calculate_pareto_data(self):
-        cor_table = self.corelation()
-        Responses_names = ["Volume", "Max Stress", "Max Displacement", "Mean Stress", "Internal Energy", "Standard Dev. of En. Den."]
-        Responses = {}
-        parameters = [row[0] for row in cor_table]
-    
-        for i, response_name in enumerate(Responses_names):
-            response_values = [abs(row[i + 1]) for row in cor_table]
-            Responses[response_name] = np.abs(response_values)
-
-        return Responses, parameters 
-
-
-    def plotParetoGraph(self, index):
-        Responses, parameters = self.calculate_pareto_data()
-        response_name = self.form.comboBox_2.itemText(index) if index != 0 else self.form.comboBox_2.currentText()
-
-        response_matrix = Responses[response_name]
-        tot_cor = np.sum(response_matrix)
-        percentage_effects= [(miktar / tot_cor) * 100 for miktar in response_matrix.flatten()]
-        effects_of_parameters= zip(parameters, percentage_effects)
-        percentage_rank= sorted(effects_of_parameters, key=lambda x: x[1], reverse=True)
-        cumulative_percentage= [sum([x[1] for x in percentage_rank[:i + 1]]) for i in range(len(percentage_rank))]
-
-        fig = Plot.figure(winTitle=f'Pareto Graph - {response_name}')
-        ax1 = Plot.axesList()[0]
-
-        ax1.bar([x[0] for x in percentage_rank], [x[1] for x in percentage_rank], color='skyblue')
-        ax2 = ax1.twinx()
-        ax2.plot([x[0] for x in percentage_rank], cumulative_percentage, color='r', marker='o')
-
-        ax1.set_xlabel('Parameters')
-        ax1.set_ylabel('Percentage Effect')
-        ax2.set_ylabel('Cumulative Percentage')
-        ax2.set_ylim(0, 100)
-        ax1.set_ylim(0, 100)
-        Plot.plt.show()
-        fig.canvas.flush_events()
-
+        table = self.resultsStore().sum
+        weights = self.rankingWeights()
+        if weights is None:
+            return
+        # calculating normalized value of results
+        # max result will be 0, min result will be 1
+        row, column = table.shape
+        normTable = np.zeros((row, column))
+        for i in range(column):
+            normTable[:, i] = 1-self.normalize(table[:, i])
+
+        # Calculating score by using weight and normalized results
+        score = normTable @ weights
+        self.updateResultsTableSum(score)
+
+    def paretoRanking(self):
+        """Arranges the results by Pareto fronts of the metrics with a non-zero weight (all metrics are minimized),
+        generations of a front are arranged by crowding distance"""
+        weights = self.rankingWeights()
+        if weights is None:
+            return
+        fronts, crowding = self.resultsStore().pareto(np.flatnonzero(weights).tolist())
+        # the best generation gets the highest score like in the weighted ranking
+        score = np.empty(len(fronts))
+        score[Pareto.paretoOrder(fronts, crowding)] = np.arange(len(fronts), 0, -1)
+        self.updateResultsTableSum(score)
+        FreeCAD.Console.PrintMessage(f"{np.count_nonzero(fronts == 0)} generations on the Pareto front\n")
 
 
     def corelation(self):
-        master = self.doc
-        results = np.array(
-            master.Results.FEAMetricsSum[1:], dtype=np.dtype("float"))
-        parameters1 =   np.array(
-            master.Generate.GeneratedParameters, dtype=np.dtype("float"))
-        parameterValues = np.transpose(parameters1)
-        parameters = master.Generate.ParametersName
-
-        cor_table = [] 
-        for index, param in enumerate(parameters):
-            row = [param]    
-            for j in range(len(results[0])):
-                corr, _ = pearsonr(parameterValues[index], [item[j] for item in results])
-                row.append(round(corr, 4))
-            cor_table.append(row)
-
-        return cor_table
+        """Correlation coefficients of parameters and metrics, computed once until the results change"""
+        store = self.resultsStore()
+        coefficients = np.round(store.correlation(), 4)
+        return [[param] + coefficients[index].tolist() for index, param in enumerate(store.parameterNames)]
 
     def update_table(self, index):
         cor_table = self.corelation()
@@ -544,36 +461,10 @@ class ResultsPanel:
             item_coef.setToolTip("As this value approaches -1 or 1, the strength of the effect increases - negative effect, + means positive effect.")
 
     def anova(self):
-        master = self.doc
-        results = np.array(
-            master.Results.FEAMetricsSum[1:], dtype=np.dtype("float"))
-        parameters1 = np.array(
-            master.Generate.GeneratedParameters, dtype=np.dtype("float"))
-        parameterValues = np.transpose(parameters1)
-        parameters = master.Generate.ParametersName
-
-        anova_table = []
-        for index, param in enumerate(parameters):
-            row = [param]    
-            unique_values = np.unique(parameterValues[index])
-            
-            for j in range(len(results[0])):
-                # Create groups for ANOVA test
-                groups = [results[:, j][parameterValues[index] == value] for value in unique_values]
-                FreeCAD.Console.PrintMessage(f"Parameter: {param}, Unique Values: {unique_values}, Groups: {groups}\n")
-
-                # Check if any group is empty
-                if any(len(group) == 0 for group in groups):
-                    row.append(None)  # Append None or any placeholder for invalid ANOVA result
-                
-                else:
-                    # Perform ANOVA test
-                    f_val, _ = f_oneway(*groups)
-                    row.append(round(f_val, 4))  # Round the F-value for consistency
-
-            anova_table.append(row)
-        
-        return anova_table
+        """F values of one-way ANOVA of metrics grouped by parameter values, computed once until the results change"""
+        store = self.resultsStore()
+        fValues = np.round(store.anova(), 4)  # Round the F-value for consistency
+        return [[param] + fValues[index].tolist() for index, param in enumerate(store.parameterNames)]
 
 
     def update_anova_table(self, index):
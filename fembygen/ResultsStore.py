@@ -0,0 +1,152 @@
+# Columnar store of the results of all generations in the working directory.
+# Scalar metrics of load cases and generations are kept at full precision in .npy files which are memory mapped when
+# read, so that ranking and statistics of the results panel don't parse the formatted table strings. Nodal fields of
+# load cases can be stored next to them. meta.json is written last, a store without it is incomplete.
+import json
+import os.path
+import shutil
+import time
+import numpy as np
+from fembygen import Pareto
+
+STORE_DIR = "ResultsStore"
+
+_statistics = {}  # store directory: (revision, {name: statistic of parameters and generation metrics})
+
+
+class Store:
+    """Results store of a study, arrays are memory mapped
+
+    all: metrics of load cases, rows gen1.lc1, gen1.lc2, ..., NaN for load cases without results
+    sum: metrics of generations
+    parameters: generated parameters of generations"""
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.metricNames = meta["metricNames"]
+        self.parameterNames = meta["parameterNames"]
+        self.numLoadCases = meta["numLoadCases"]
+        self.revision = meta["revision"]  # changes whenever the store is written
+        self.all = loadArray(os.path.join(directory, "metrics_all.npy"))
+        self.sum = loadArray(os.path.join(directory, "metrics_sum.npy"))
+        self.parameters = loadArray(os.path.join(directory, "parameters.npy"))
+
+    def field(self, gen, lc, name):
+        """nodal field stored by saveField, None if it is not stored"""
+        path = fieldPath(self.directory, gen, lc, name)
+        return loadArray(path) if os.path.isfile(path) else None
+
+    def statistic(self, name, function):
+        """function(parameters, sum) computed once for each revision of the store"""
+        cached = _statistics.get(self.directory)
+        if cached is None or cached[0] != self.revision:
+            cached = _statistics[self.directory] = (self.revision, {})
+        if name not in cached[1]:
+            cached[1][name] = function(self.parameters, self.sum)
+        return cached[1][name]
+
+    def correlation(self):
+        return self.statistic("correlation", correlation)
+
+    def anova(self):
+        return self.statistic("anova", anova)
+
+    def pareto(self, columns=None):
+        """Pareto fronts and crowding distances of generations for the metric columns, all of them by default"""
+        columns = list(range(self.sum.shape[1])) if columns is None else list(columns)
+        return self.statistic(f"pareto{columns}", lambda parameters, metrics: Pareto.rank(metrics[:, columns]))
+
+
+def loadArray(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:  # empty arrays can't be mapped
+        return np.load(path)
+
+
+def saveArray(path, values):
+    # written under a temporary name, readers see only complete files
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, values)
+    os.replace(path + ".tmp", path)
+
+
+def fieldPath(directory, gen, lc, name):
+    return os.path.join(directory, "fields", f"Gen{gen}_loadCase{lc}_{name}.npy")
+
+
+def save(workingDir, metricNames, metricsAll, metricsSum, numLoadCases, parameterNames=(), parameters=None):
+    """Write metrics of load cases and generations and generated parameters to the store"""
+    directory = os.path.join(workingDir, STORE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    metricsSum = np.asarray(metricsSum, dtype=float).reshape(-1, len(metricNames))
+    if parameters is None:
+        parameters = np.zeros((len(metricsSum), 0))
+    saveArray(os.path.join(directory, "metrics_all.npy"),
+              np.asarray(metricsAll, dtype=float).reshape(-1, len(metricNames)))
+    saveArray(os.path.join(directory, "metrics_sum.npy"), metricsSum)
+    saveArray(os.path.join(directory, "parameters.npy"), np.asarray(parameters, dtype=float))
+    meta = {"metricNames": list(metricNames), "parameterNames": list(parameterNames),
+            "numLoadCases": int(numLoadCases), "revision": time.time_ns()}
+    with open(os.path.join(directory, "meta.json.tmp"), "w") as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(directory, "meta.json.tmp"), os.path.join(directory, "meta.json"))
+
+
+def saveField(workingDir, gen, lc, name, values):
+    """Store a nodal field (e.g. vonMises) of load case lc of generation gen"""
+    path = fieldPath(os.path.join(workingDir, STORE_DIR), gen, lc, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    saveArray(path, np.asarray(values))
+
+
+def load(workingDir):
+    """Store of the working directory, None if it is missing or incomplete"""
+    directory = os.path.join(workingDir, STORE_DIR)
+    try:
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            return Store(directory, json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def correlation(parameters, metrics):
+    """Pearson correlation coefficients of parameter columns and metric columns as an (n_parameters, n_metrics)
+    array, NaN for constant columns and columns with missing values"""
+    x = np.asarray(parameters, dtype=float)
+    y = np.asarray(metrics, dtype=float)
+    if len(x) < 2:
+        return np.full((x.shape[1], y.shape[1]), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # standardized columns, correlations are their products
+        xStd, yStd = x.std(axis=0), y.std(axis=0)
+        zx = (x - x.mean(axis=0)) / np.where(xStd > 0, xStd, np.nan)
+        zy = (y - y.mean(axis=0)) / np.where(yStd > 0, yStd, np.nan)
+        return np.clip(zx.T @ zy / len(x), -1, 1)
+
+
+def anova(parameters, metrics):
+    """F values of one-way ANOVA of metric columns grouped by the values of each parameter column as an
+    (n_parameters, n_metrics) array, NaN if a parameter has one value only or every value is a group of one"""
+    x = np.asarray(parameters, dtype=float)
+    y = np.asarray(metrics, dtype=float)
+    n, m = y.shape
+    centered = y - y.mean(axis=0)  # sums of squares are taken around the grand mean
+    total = np.sum(centered**2, axis=0)
+    fValues = np.full((x.shape[1], m), np.nan)
+    for p in range(x.shape[1]):
+        groups, index = np.unique(x[:, p], return_inverse=True)
+        k = len(groups)
+        if k < 2 or k >= n:
+            continue
+        # group sums of all metrics in one bincount, metric columns have their own block of group indices
+        counts = np.bincount(index, minlength=k)
+        sums = np.bincount((index[:, None] + k*np.arange(m)).ravel(), weights=centered.ravel(), minlength=k*m)
+        between = np.sum(sums.reshape(m, k)**2 / counts, axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fValues[p] = (between / (k - 1)) / ((total - between) / (n - k))
+    return fValues
+
+
+def remove(workingDir):
+    shutil.rmtree(os.path.join(workingDir, STORE_DIR), ignore_errors=True)
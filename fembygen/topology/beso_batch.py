@@ -0,0 +1,210 @@
+# Headless topology optimization of several input files (e.g. Gen*/loadCase* directories) in parallel processes.
+# The optimization settings are taken from a JSON file with the properties of the Topology object, it can be written
+# from FreeCAD by save_config(FreeCAD.ActiveDocument.Topology, "config.json").
+#
+# usage: python -m fembygen.topology.beso_batch config.json Gen*/loadCase* [--analysis NAME] [--jobs N]
+#                                               [--summary summary.json]
+import argparse
+import contextlib
+import glob
+import json
+import os
+import re
+import time
+import traceback
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from fembygen.topology import beso_lib
+
+# properties of the Topology object used by BesoMain with their default values
+DEFAULT_CONFIG = {"path_calculix": "ccx", "domain_optimized": {}, "domain_density": {}, "domain_material": {},
+                  "domain_thickness": {}, "domain_offset": {}, "domain_orientation": {}, "domain_FI": {},
+                  "domain_same_state": {}, "mass_goal_ratio": 0.75, "continue_from": "", "filter_list": [],
+                  "optimization_base": "stiffness", "cpu_cores": 1, "FI_violated_tolerance": 1.0,
+                  "decay_coefficient": -0.2, "shells_as_composite": False, "reference_points": "integration points",
+                  "reference_value": "max", "mass_addition_ratio": 0.015, "mass_removal_ratio": 0.03,
+                  "ratio_type": "relative", "compensate_state_filter": False, "sensitivity_averaging": False,
+                  "steps_superposition": [], "iterations_limit": "auto", "tolerance": 1e-3, "displacement_graph": [],
+                  "save_iteration_results": 1, "save_solver_files": "", "save_resulting_format": ["inp"]}
+# input files written by the optimization itself
+GENERATED_INP = re.compile(r"(_separated|_state\d+)\.inp$|^static_[0-9a-f]+_")
+# directories searched in a directory without input files
+CASE_DIRECTORIES = ("Gen*/loadCase*", "TopologyCase*", "loadCase*")
+
+
+def json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, tuple, np.ndarray)):
+        return list(value)
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+# function writing the optimization settings of the Topology object to a JSON file
+def save_config(topology, file_name):
+    config = {key: getattr(topology, key, default) for key, default in DEFAULT_CONFIG.items()}
+    with open(file_name, "w") as f:
+        json.dump(config, f, indent=2, default=json_default)
+
+
+# function reading the optimization settings, missing values are set to defaults
+def load_config(file_name):
+    with open(file_name, "r") as f:
+        config = dict(DEFAULT_CONFIG, **json.load(f))
+    # failure criteria are (name, value) tuples, JSON stores them as lists
+    for analysis, domain_FI in config["domain_FI"].items():
+        for dn in domain_FI:
+            domain_FI[dn] = [[tuple(criterion) for criterion in state] for state in domain_FI[dn]]
+    return config
+
+
+# function returning the analysis name of the domain settings, the only one if name is not given
+def config_analysis(config, analysis=None):
+    analyses = list(config["domain_optimized"])
+    if analysis is None:
+        if len(analyses) != 1:
+            raise ValueError("config contains domains of analyses {}, choose one of them".format(analyses))
+        analysis = analyses[0]
+    elif analysis not in analyses:
+        raise ValueError("analysis {} not found in config, available analyses are {}".format(analysis, analyses))
+    return analysis
+
+
+# function returning input files of the given .inp files and directories, directories without input files are
+# searched for Gen*/loadCase* (or TopologyCase*) subdirectories, files included by other input files of a directory
+# (e.g. mesh files of FreeCAD's split input writer) are not inputs
+def batch_inputs(paths):
+    inputs = []
+    for path in paths:
+        if os.path.isfile(path):
+            inputs.append(os.path.abspath(path))
+            continue
+        found = [os.path.abspath(f) for f in sorted(glob.glob(os.path.join(path, "*.inp")))
+                 if not GENERATED_INP.search(os.path.basename(f))]
+        included = {source for f in found for source in included_files(f)}
+        found = [f for f in found if f not in included]
+        if not found:
+            for pattern in CASE_DIRECTORIES:
+                directories = sorted(glob.glob(os.path.join(path, pattern)), key=natural_key)
+                if directories:
+                    found = batch_inputs(directories)
+                    break
+        inputs += [os.path.abspath(f) for f in found]
+    return list(dict.fromkeys(inputs))
+
+
+# function returning files included by the input file, a missing one is reported by the optimization of the file
+def included_files(file_name):
+    try:
+        return beso_lib.input_sources(file_name)[1:]
+    except OSError:
+        return []
+
+
+def natural_key(text):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", text)]
+
+
+# function running the optimization of one input file without FreeCAD, returns its summary
+# output of the optimization is written to the .batch.txt file next to the input file
+def run_optimization(file_name, config, analysis=None):
+    from fembygen.topology import beso_main
+
+    analysis = config_analysis(config, analysis)
+    path, name = os.path.split(os.path.abspath(file_name))
+    settings = types.SimpleNamespace(**dict(config, path=path, file_name=name))
+    summary = {"file_name": os.path.abspath(file_name), "analysis": analysis}
+    start = time.time()
+    try:
+        with open(file_name[:-4] + ".batch.txt", "w") as out, contextlib.redirect_stdout(out):
+            results = beso_main.BesoMain(analysis, settings).main(plots=False)
+        elm_states = results.pop("elm_states")
+        summary["status"] = "finished"
+        summary["states_count"] = np.bincount(np.fromiter(elm_states.values(), dtype=int,
+                                                          count=len(elm_states))).tolist()
+        summary.update(results)
+    except Exception:
+        summary["status"] = "failed"
+        summary["error"] = traceback.format_exc()
+    summary["time"] = time.time() - start
+    return summary
+
+
+# function raising ValueError if several input files are in one directory, their optimizations would delete
+# topology_iterations and overwrite resulting_states of each other
+def check_directories(file_names):
+    directories = {}
+    for file_name in dict.fromkeys(os.path.abspath(f) for f in file_names):
+        directories.setdefault(os.path.dirname(file_name), []).append(os.path.basename(file_name))
+    shared = ["{}: {}".format(directory, ", ".join(names)) for directory, names in directories.items()
+              if len(names) > 1]
+    if shared:
+        raise ValueError("input files share a directory, optimization results of one would be deleted by the other; "
+                         "move them to separate directories\n" + "\n".join(shared))
+
+
+# function running optimizations of input files in parallel processes
+# by default jobs run concurrently so that jobs * cpu_cores (CalculiX threads of each job) fit the cpu count
+# returns summaries in the order of input files, progress(summary) is called when an optimization is finished
+def run_batch(file_names, config, analysis=None, jobs=None, progress=None):
+    # checks before starting processes
+    config_analysis(config, analysis)
+    check_directories(file_names)
+    if jobs is None:
+        jobs = max(1, (os.cpu_count() or 1) // max(1, int(config["cpu_cores"])))
+    jobs = max(1, min(jobs, len(file_names)))
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_optimization, file_name, config, analysis) for file_name in file_names]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[summary["file_name"]] = summary
+            if progress:
+                progress(summary)
+    return [summaries[os.path.abspath(file_name)] for file_name in file_names]
+
+
+def summary_line(summary):
+    line = summary["status"].ljust(9) + " " + str(round(summary["time"], 1)).rjust(8) + " s"
+    if summary["status"] == "finished":
+        mass = summary["mass"]
+        line += "  iterations " + str(summary["iterations"]).rjust(4) + "  mass " + \
+            str(round(100.0 * mass[-1] / mass[0], 2) if mass[0] else mass[-1]).rjust(7) + " %"
+    else:
+        line += "  " + summary["error"].strip().splitlines()[-1]
+    return line + "  " + summary["file_name"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m fembygen.topology.beso_batch",
+                                     description="Headless topology optimization of several input files.")
+    parser.add_argument("config", help="JSON file with the properties of the Topology object")
+    parser.add_argument("inputs", nargs="+", help=".inp files or directories (e.g. Gen*/loadCase*)")
+    parser.add_argument("--analysis", help="analysis name of the domain settings in config")
+    parser.add_argument("--jobs", type=int, help="number of concurrent optimizations (default cpu count / cpu_cores)")
+    parser.add_argument("--summary", default="topology_batch_summary.json", help="JSON file for the results summary")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    file_names = batch_inputs(args.inputs)
+    if not file_names:
+        parser.error("no input files found")
+    try:
+        config_analysis(config, args.analysis)
+        check_directories(file_names)
+    except ValueError as e:
+        parser.error(str(e))
+    print("optimizing {} input files".format(len(file_names)))
+    summaries = run_batch(file_names, config, args.analysis, args.jobs, lambda s: print(summary_line(s), flush=True))
+    with open(args.summary, "w") as f:
+        json.dump(summaries, f, indent=1, default=json_default)
+    failed = sum(summary["status"] != "finished" for summary in summaries)
+    print("{} finished, {} failed, summary written to {}".format(len(summaries) - failed, failed, args.summary))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
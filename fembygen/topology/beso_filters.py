@@ -1,100 +1,30 @@
+import hashlib
+import itertools
+import os
 import numpy as np
-from fembygen.topology import beso_lib
+import scipy.sparse
+from scipy.spatial import cKDTree
+from fembygen.topology import beso_lib, beso_mesh
+
+# element edges given by positions in the element node list, used to get the element size
+EDGES = {"tria": [(0, 1), (0, 2), (1, 2)],
+         "quad": [(0, 1), (0, 3), (1, 2), (2, 3)],
+         "tetra": [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)],
+         "penta": [(0, 1), (0, 2), (0, 3), (1, 2), (1, 4), (2, 5), (3, 4), (3, 5), (4, 5)],
+         "hexa": [(0, 1), (0, 3), (0, 4), (1, 2), (1, 5), (2, 3), (2, 6), (3, 7), (4, 5), (4, 7), (5, 6), (6, 7)]}
+
 
 def find_size_elm(Elements, nodes):
     """calculate size of elements used for automatic filter range"""
     size_elm = {}  # output of this function
-
-    def size_tria(elm_category):
-        for en in elm_category:
-            x1, y1, z1 = nodes[elm_category[en][0]]
-            x2, y2, z2 = nodes[elm_category[en][1]]
-            x3, y3, z3 = nodes[elm_category[en][2]]
-            size_elm[en] = (((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5 +
-                            ((x1 - x3) ** 2 + (y1 - y3) ** 2 + (z1 - z3) ** 2) ** 0.5 +
-                            ((x2 - x3) ** 2 + (y2 - y3) ** 2 + (z2 - z3) ** 2) ** 0.5
-                            ) / 3
-# noktalar arası uzakıkların  hesaplanması 
-            
-    def size_quad(elm_category):
-        for en in elm_category:
-            x1, y1, z1 = nodes[elm_category[en][0]]
-            x2, y2, z2 = nodes[elm_category[en][1]]
-            x3, y3, z3 = nodes[elm_category[en][2]]
-            x4, y4, z4 = nodes[elm_category[en][3]]
-            size_elm[en] = (((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5 +
-                            ((x1 - x4) ** 2 + (y1 - y4) ** 2 + (z1 - z4) ** 2) ** 0.5 +
-                            ((x2 - x3) ** 2 + (y2 - y3) ** 2 + (z2 - z3) ** 2) ** 0.5 +
-                            ((x3 - x4) ** 2 + (y3 - y4) ** 2 + (z3 - z4) ** 2) ** 0.5
-                            ) / 4
-
-    def size_tetra(elm_category):
-        for en in elm_category:
-            x1, y1, z1 = nodes[elm_category[en][0]]
-            x2, y2, z2 = nodes[elm_category[en][1]]
-            x3, y3, z3 = nodes[elm_category[en][2]]
-            x4, y4, z4 = nodes[elm_category[en][3]]
-            size_elm[en] = (((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5 +
-                            ((x1 - x3) ** 2 + (y1 - y3) ** 2 + (z1 - z3) ** 2) ** 0.5 +
-                            ((x1 - x4) ** 2 + (y1 - y4) ** 2 + (z1 - z4) ** 2) ** 0.5 +
-                            ((x2 - x3) ** 2 + (y2 - y3) ** 2 + (z2 - z3) ** 2) ** 0.5 +
-                            ((x2 - x4) ** 2 + (y2 - y4) ** 2 + (z2 - z4) ** 2) ** 0.5 +
-                            ((x3 - x4) ** 2 + (y3 - y4) ** 2 + (z3 - z4) ** 2) ** 0.5
-                            ) / 6
-
-    def size_penta(elm_category):
-        for en in elm_category:
-            x1, y1, z1 = nodes[elm_category[en][0]]
-            x2, y2, z2 = nodes[elm_category[en][1]]
-            x3, y3, z3 = nodes[elm_category[en][2]]
-            x4, y4, z4 = nodes[elm_category[en][3]]
-            x5, y5, z5 = nodes[elm_category[en][4]]
-            x6, y6, z6 = nodes[elm_category[en][5]]
-            size_elm[en] = (((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5 +
-                            ((x1 - x3) ** 2 + (y1 - y3) ** 2 + (z1 - z3) ** 2) ** 0.5 +
-                            ((x1 - x4) ** 2 + (y1 - y4) ** 2 + (z1 - z4) ** 2) ** 0.5 +
-                            ((x2 - x3) ** 2 + (y2 - y3) ** 2 + (z2 - z3) ** 2) ** 0.5 +
-                            ((x2 - x5) ** 2 + (y2 - y5) ** 2 + (z2 - z5) ** 2) ** 0.5 +
-                            ((x3 - x6) ** 2 + (y3 - y6) ** 2 + (z3 - z6) ** 2) ** 0.5 +
-                            ((x4 - x5) ** 2 + (y4 - y5) ** 2 + (z4 - z5) ** 2) ** 0.5 +
-                            ((x4 - x6) ** 2 + (y4 - y6) ** 2 + (z4 - z6) ** 2) ** 0.5 +
-                            ((x5 - x6) ** 2 + (y5 - y6) ** 2 + (z5 - z6) ** 2) ** 0.5
-                            ) / 9
-
-    def size_hexa(elm_category):
-        for en in elm_category:
-            x1, y1, z1 = nodes[elm_category[en][0]]
-            x2, y2, z2 = nodes[elm_category[en][1]]
-            x3, y3, z3 = nodes[elm_category[en][2]]
-            x4, y4, z4 = nodes[elm_category[en][3]]
-            x5, y5, z5 = nodes[elm_category[en][4]]
-            x6, y6, z6 = nodes[elm_category[en][5]]
-            x7, y7, z7 = nodes[elm_category[en][6]]
-            x8, y8, z8 = nodes[elm_category[en][7]]
-            size_elm[en] = (((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2) ** 0.5 +
-                            ((x1 - x4) ** 2 + (y1 - y4) ** 2 + (z1 - z4) ** 2) ** 0.5 +
-                            ((x1 - x5) ** 2 + (y1 - y5) ** 2 + (z1 - z5) ** 2) ** 0.5 +
-                            ((x2 - x3) ** 2 + (y2 - y3) ** 2 + (z2 - z3) ** 2) ** 0.5 +
-                            ((x2 - x6) ** 2 + (y2 - y6) ** 2 + (z2 - z6) ** 2) ** 0.5 +
-                            ((x3 - x4) ** 2 + (y3 - y4) ** 2 + (z3 - z4) ** 2) ** 0.5 +
-                            ((x3 - x7) ** 2 + (y3 - y7) ** 2 + (z3 - z7) ** 2) ** 0.5 +
-                            ((x4 - x8) ** 2 + (y4 - y8) ** 2 + (z4 - z8) ** 2) ** 0.5 +
-                            ((x5 - x6) ** 2 + (y5 - y6) ** 2 + (z5 - z6) ** 2) ** 0.5 +
-                            ((x5 - x8) ** 2 + (y5 - y8) ** 2 + (z5 - z8) ** 2) ** 0.5 +
-                            ((x6 - x7) ** 2 + (y6 - y7) ** 2 + (z6 - z7) ** 2) ** 0.5 +
-                            ((x7 - x8) ** 2 + (y7 - y8) ** 2 + (z7 - z8) ** 2) ** 0.5
-                            ) / 12
-
-    size_tria(Elements.tria3)
-    size_tria(Elements.tria6)
-    size_quad(Elements.quad4)
-    size_quad(Elements.quad8)
-    size_tetra(Elements.tetra4)
-    size_tetra(Elements.tetra10)
-    size_penta(Elements.penta6)
-    size_penta(Elements.penta15)
-    size_hexa(Elements.hexa8)
-    size_hexa(Elements.hexa20)
+    mesh = beso_mesh.as_mesh(nodes, Elements)
+    for category in mesh.categories():
+        edges = np.array(EDGES[category.rstrip("0123456789")])
+        connectivity = mesh.connectivity[category]
+        # average length of the element edges given by corner nodes
+        edge_vectors = mesh.coordinates[connectivity[:, edges[:, 0]]] - mesh.coordinates[connectivity[:, edges[:, 1]]]
+        size = np.linalg.norm(edge_vectors, axis=2).mean(axis=1)
+        size_elm.update(zip(mesh.element_ids[category].tolist(), size.tolist()))
     return size_elm
 
 
@@ -109,12 +39,6 @@ def get_filter_range(size_elm, domains, filtered_dn):
     return size_sum / len_filtered_dn
 # noktalar arası uzaklıklar toplamının eleman sayısınıa bölünmesi 
 
-def sround(x, s):
-    """round float number x to s significant digits
-    https://stackoverflow.com/a/58491045/9582881 fastest way"""
-    result=np.format_float_positional(x, precision=s, unique=False, fractional=False, trim='k')
-    return float(result)
-
 
 # function to check if filtering is to be used on domains with prescribed same state
 def check_same_state(domain_same_state, filtered_dn, file_name):
@@ -134,662 +58,369 @@ def check_same_state(domain_same_state, filtered_dn, file_name):
         print(msg)
 
 
+# function returning sorted element numbers without repetition and the array of their centres of gravity
+def cg_array(cg, en_list):
+    en_array = np.unique(np.fromiter(en_list, dtype=np.int64))
+    return en_array, np.array([cg[en] for en in en_array.tolist()], dtype=float).reshape(-1, 3)
+
+
+# function converting pairs (rows[k], columns[k]) with values to CSR form with number_of_rows rows
+# neighbours of row k are columns[indptr[k]:indptr[k + 1]] with values[indptr[k]:indptr[k + 1]], the order of pairs
+# within a row is kept
+def pairs_to_csr(number_of_rows, rows, columns, values):
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(number_of_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=number_of_rows), out=indptr[1:])
+    return indptr, columns[order], values[order]
+
+
+# function finding pairs of points nearer than r_min by the kd-tree, each pair (i, j) is returned once with i < j
+# strict=False includes also pairs in distance equal to r_min
+def near_pairs(points, r_min, strict=True):
+    pairs = cKDTree(points).query_pairs(r_min, output_type="ndarray").reshape(-1, 2)
+    distance = np.linalg.norm(points[pairs[:, 0]] - points[pairs[:, 1]], axis=1)
+    if strict:
+        pairs = pairs[distance < r_min]
+        distance = distance[distance < r_min]
+    return pairs[:, 0], pairs[:, 1], distance
+
+
+# function finding points nearer than r_min to each of query points by the kd-tree
+# returns CSR form indptr, indices, distance; indices of points near to query point k are indices[indptr[k]:indptr[k + 1]]
+def near_points_csr(points, query_points, r_min):
+    neighbours = cKDTree(points).query_ball_point(query_points, r_min)
+    lengths = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(neighbours))
+    indices = np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.int64, count=lengths.sum())
+    rows = np.repeat(np.arange(len(query_points)), lengths)
+    distance = np.linalg.norm(query_points[rows] - points[indices], axis=1)
+    keep = distance < r_min
+    return pairs_to_csr(len(query_points), rows[keep], indices[keep], distance[keep])
+
+
+# function finding near elements in CSR form, indices are positions in the array of element centres of gravity
+def near_elements_csr(points, r_min):
+    i, j, distance = near_pairs(points, r_min)
+    return pairs_to_csr(len(points), np.concatenate((i, j)), np.concatenate((j, i)), np.concatenate((distance, distance)))
+
+
+# function returning key of the filter cache file given by the mesh and filter settings
+# settings are e.g. filter type, filter range, filtered elements and casting vector
+def filter_cache_key(nodes, Elements, filter_type, r_min, en_list, casting_vector=()):
+    digest = hashlib.sha1()
+    digest.update(beso_mesh.as_mesh(nodes, Elements).fingerprint().encode())
+    digest.update(repr([filter_type, float(r_min), np.asarray(casting_vector, dtype=float).tolist()]).encode())
+    digest.update(np.unique(np.fromiter(en_list, dtype=np.int64)).tobytes())
+    return digest.hexdigest()
+
+
+# function returning filter values (arrays and sparse matrices) saved in the cache directory under the key
+# if they are not saved yet, they are computed by prepare(*args) and saved for the next runs
+def cached_prepare(cache_dir, key, prepare, *args):
+    cache_file = os.path.join(cache_dir, key + ".npz")
+    try:
+        with np.load(cache_file) as cache:
+            values = []
+            for k in range(int(cache["number_of_values"])):
+                if "value{}".format(k) in cache:
+                    values.append(cache["value{}".format(k)])
+                else:
+                    values.append(scipy.sparse.csr_matrix((cache["data{}".format(k)], cache["indices{}".format(k)],
+                                                           cache["indptr{}".format(k)]),
+                                                          shape=tuple(cache["shape{}".format(k)])))
+            return values
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+
+    values = prepare(*args)
+    arrays = {"number_of_values": len(values)}
+    for k, value in enumerate(values):
+        if scipy.sparse.issparse(value):
+            value = value.tocsr()
+            arrays["data{}".format(k)] = value.data
+            arrays["indices{}".format(k)] = value.indices
+            arrays["indptr{}".format(k)] = value.indptr
+            arrays["shape{}".format(k)] = np.array(value.shape)
+        else:
+            arrays["value{}".format(k)] = value
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(cache_file + ".tmp", cache_file)  # other runs never read a partially written file
+    except (IOError, OSError):
+        pass  # the cache is only an acceleration
+    return list(values)
+
+
+# function returning array of element values (e.g. sensitivity numbers) ordered by en_filter
+def values_array(values, en_filter):
+    return np.array([values[en] for en in en_filter.tolist()])
+
+
+# function returning copy of the values dictionary with filtered values of elements en_filter[rows]
+def values_update(values, en_filter, rows, filtered):
+    values_filtered = values.copy()
+    values_filtered.update(zip(en_filter[rows].tolist(), filtered[rows].tolist()))
+    return values_filtered
+
+
+# function returning mask of en_filter rows which are in opt_domains
+def rows_in_domains(en_filter, opt_domains):
+    return np.isin(en_filter, np.fromiter(opt_domains, dtype=np.int64))
+
+
+# function converting CSR arrays to the sparse matrix of shape (rows, columns)
+def csr_matrix(indptr, indices, values, shape):
+    return scipy.sparse.csr_matrix((values, indices, indptr), shape=shape)
+
+
+# function returning sparse matrix of near elements which includes also the element itself on its row
+def with_diagonal(near_elm):
+    return (near_elm + scipy.sparse.identity(near_elm.shape[0], format="csr")).tocsr()
+
+
 # function preparing values for filtering element sensitivity numbers to suppress checkerboard
+# near nodes are searched by the kd-tree, thus it gives the same values as prepare1s
 def prepare1(nodes, Elements, cg, r_min, opt_domains):
-    # searching for Elements neighbouring to every node
-    node_neighbours = {}
-
-    def fce():
-        if nn not in node_neighbours:
-            node_neighbours[nn] = [en]
-        elif en not in node_neighbours[nn]:
-            node_neighbours[nn].append(en)
-
-    for en in Elements.tria3:
-        for nn in Elements.tria3[en]:
-            fce()
-    for en in Elements.tria6:
-        for nn in Elements.tria6[en]:
-            fce()
-    for en in Elements.quad4:
-        for nn in Elements.quad4[en]:
-            fce()
-    for en in Elements.quad8:
-        for nn in Elements.quad8[en]:
-            fce()
-    for en in Elements.tetra4:
-        for nn in Elements.tetra4[en]:
-            fce()
-    for en in Elements.tetra10:
-        for nn in Elements.tetra10[en]:
-            fce()
-    for en in Elements.hexa8:
-        for nn in Elements.hexa8[en]:
-            fce()
-    for en in Elements.hexa20:
-        for nn in Elements.hexa20[en]:
-            fce()
-    for en in Elements.penta6:
-        for nn in Elements.penta6[en]:
-            fce()
-    for en in Elements.penta15:
-        for nn in Elements.penta15[en]:
-            fce()
-    # computing weight factors for sensitivity number of nodes according to distance to adjacent elements
-    distance = {}
-    M = {}  # element numbers en adjacent to each node nn
-    weight_factor_node = {}
-    for nn in node_neighbours:
-        distance_sum = 0
-        M[nn] = []
-        for en in node_neighbours[nn]:
-            dx = cg[en][0] - nodes[nn][0]
-            dy = cg[en][1] - nodes[nn][1]
-            dz = cg[en][2] - nodes[nn][2]
-            distance[(en, nn)] = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-            distance_sum += distance[(en, nn)]
-            M[nn].append(en)
-        weight_factor_node[nn] = {}
-        for en in M[nn]:
-            if len(M[nn]) != 1:
-                weight_factor_node[nn][en] = 1 / (len(M[nn]) - 1.0) * (1 - distance[(en, nn)] / distance_sum)
-            else:
-                weight_factor_node[nn][en] = 1.0
-    # print ("weight_factor_node have been computed")
-    # computing weight factors for distance of each element and node nearer than r_min
-    weight_factor_distance = {}
-    near_nodes = {}
-    for en in opt_domains:
-        near_nodes[en] = []
-        down_x = cg[en][0] - r_min
-        down_y = cg[en][1] - r_min
-        down_z = cg[en][2] - r_min
-        up_x = cg[en][0] + r_min
-        up_y = cg[en][1] + r_min
-        up_z = cg[en][2] + r_min
-        for nn in nodes:
-            condition_x = down_x < nodes[nn][0] < up_x
-            condition_y = down_y < nodes[nn][1] < up_y
-            condition_z = down_z < nodes[nn][2] < up_z
-            if condition_x and condition_y and condition_z:  # prevents computing distance >> r_min
-                dx = cg[en][0] - nodes[nn][0]
-                dy = cg[en][1] - nodes[nn][1]
-                dz = cg[en][2] - nodes[nn][2]
-                distance = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-                if distance < r_min:
-                    weight_factor_distance[(en, nn)] = r_min - distance
-                    near_nodes[en].append(nn)
-    # print ("weight_factor_distance have been computed")
-    return weight_factor_node, M, weight_factor_distance, near_nodes
+    return prepare1s(nodes, Elements, cg, r_min, opt_domains)
 
 
 # function preparing values for filtering element sensitivity numbers to suppress checkerboard
-# uses sectoring to prevent computing distance of far points
+# uses kd-tree to prevent computing distance of far points
+# returns en_mesh - numbers of all elements, weight_factor_node - sparse matrix (nodes, en_mesh) of weight factors for
+# sensitivity number of nodes, en_filter - numbers of filtered elements, weight_factor_distance - sparse matrix
+# (en_filter, nodes) of weight factors for distance of element and node nearer than r_min
 def prepare1s(nodes, Elements, cg, r_min, opt_domains):
     # searching for elements neighbouring to every node
-    node_neighbours = {}
-    for meshType in Elements:
-        for en in meshType:  # element cg computed also out of opt_domains due to neighbours counted also there
-            for nn in meshType[en]:
-                if nn not in node_neighbours:
-                    node_neighbours[nn] = [en]
-                elif en not in node_neighbours[nn]:
-                    node_neighbours[nn].append(en)
+    # element cg computed also out of opt_domains due to neighbours counted also there
+    mesh = beso_mesh.as_mesh(nodes, Elements)
+    en_mesh = mesh.all_element_ids()
+    indptr, adjacent = mesh.node_element_adjacency()
+    number_of_adjacent = np.diff(indptr)
 
     # computing weight factors for sensitivity number of nodes according to distance to adjacent elements
-    M = {}  # element numbers en adjacent to each node nn
-    weight_factor_node = {}
-    for nn in node_neighbours:
-        distance_sum = 0
-        M[nn] = []
-        distance = []
-        for en in node_neighbours[nn]:
-            dx = cg[en][0] - nodes[nn][0]
-            dy = cg[en][1] - nodes[nn][1]
-            dz = cg[en][2] - nodes[nn][2]
-            distance.append((dx ** 2 + dy ** 2 + dz ** 2) ** 0.5)
-            distance_sum += distance[-1]
-            M[nn].append(en)
-        weight_factor_node[nn] = {}
-        en_relative = 0
-        for en in node_neighbours[nn]:
-            if len(M[nn]) != 1:
-                weight_factor_node[nn][en] = 1 / (len(M[nn]) - 1.0) * (1 - distance[en_relative] / distance_sum)
-            else:
-                weight_factor_node[nn][en] = 1.0
-            en_relative += 1
+    cg_mesh = values_array(cg, en_mesh).astype(float).reshape(-1, 3)
+    node_rows = np.repeat(np.arange(len(mesh.node_ids)), number_of_adjacent)
+    distance = np.linalg.norm(cg_mesh[adjacent] - mesh.coordinates[node_rows], axis=1)
+    distance_sum = np.bincount(node_rows, weights=distance, minlength=len(mesh.node_ids))
+    count = number_of_adjacent[node_rows]
+    weight = np.ones(len(adjacent))
+    several = count != 1
+    weight[several] = 1 / (count[several] - 1.0) * (1 - distance[several] / distance_sum[node_rows[several]])
+    weight_factor_node = csr_matrix(indptr, adjacent, weight, (len(mesh.node_ids), len(en_mesh)))
     # print ("weight_factor_node have been computed")
+
     # computing weight factors for distance of each element and node nearer than r_min
-    weight_factor_distance = {}
-    near_nodes = {}
-    sector_nodes = {}
-    sector_elm = {}
-    nodes_min = nodes[list(nodes.keys())[0]]  # initial values
-    nodes_max = nodes[list(nodes.keys())[0]]
-    for nn in nodes:
-        nodes_min = [min(nodes[nn][0], nodes_min[0]), min(nodes[nn][1], nodes_min[1]), min(nodes[nn][2], nodes_min[2])]
-        nodes_max = [max(nodes[nn][0], nodes_max[0]), max(nodes[nn][1], nodes_max[1]), max(nodes[nn][2], nodes_max[2])]
-    # preparing empty sectors
-    x = nodes_min[0] + 0.5 * r_min
-    while x <= nodes_max[0] + 0.5 * r_min:
-        y = nodes_min[1] + 0.5 * r_min
-        while y <= nodes_max[1] + 0.5 * r_min:
-            z = nodes_min[2] + 0.5 * r_min
-            while z <= nodes_max[2] + 0.5 * r_min:
-                # 6 significant digit round because of small declination (6 must be used for all sround)
-                sector_nodes[(sround(x, 6), sround(y, 6), sround(z, 6))] = []
-                sector_elm[(sround(x, 6), sround(y, 6), sround(z, 6))] = []
-                z += r_min
-            y += r_min
-        x += r_min
-    # assigning nodes to the sectors
-    for nn in nodes:
-        sector_centre = []
-        for k in range(3):
-            position = nodes_min[k] + r_min * (0.5 + np.floor((nodes[nn][k] - nodes_min[k]) / r_min))
-            sector_centre.append(sround(position, 6))
-        sector_nodes[tuple(sector_centre)].append(nn)
-    # assigning elements to the sectors
-    for en in opt_domains:
-        sector_centre = []
-        for k in range(3):
-            position = nodes_min[k] + r_min * (0.5 + np.floor((cg[en][k] - nodes_min[k]) / r_min))
-            sector_centre.append(sround(position, 6))
-        sector_elm[tuple(sector_centre)].append(en)
-        near_nodes[en] = []
-    # finding near nodes in neighbouring sectors (even inside) by comparing distance with neighbouring sector elements
-    x = nodes_min[0] + 0.5 * r_min
-    while x <= nodes_max[0] + 0.5 * r_min:
-        y = nodes_min[1] + 0.5 * r_min
-        while y <= nodes_max[1] + 0.5 * r_min:
-            z = nodes_min[2] + 0.5 * r_min
-            while z <= nodes_max[2] + 0.5 * r_min:
-                position = (sround(x, 6), sround(y, 6), sround(z, 6))
-                for xx in [x + r_min, x, x - r_min]:
-                    for yy in [y + r_min, y, y - r_min]:
-                        for zz in [z + r_min, z, z - r_min]:
-                            position_neighbour = (sround(xx, 6), sround(yy, 6), sround(zz, 6))
-                            for en in sector_elm[position]:
-                                try:
-                                    for nn in sector_nodes[position_neighbour]:
-                                        dx = cg[en][0] - nodes[nn][0]
-                                        dy = cg[en][1] - nodes[nn][1]
-                                        dz = cg[en][2] - nodes[nn][2]
-                                        distance = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-                                        if distance < r_min:
-                                            weight_factor_distance[(en, nn)] = r_min - distance
-                                            near_nodes[en].append(nn)
-                                except KeyError:
-                                    pass
-                z += r_min
-            y += r_min
-        x += r_min
+    # nodes without adjacent elements have no sensitivity number, thus they are not used
+    en_filter, cg_filter = cg_array(cg, opt_domains)
+    used_nodes = np.flatnonzero(number_of_adjacent)
+    indptr, indices, distance = near_points_csr(mesh.coordinates[used_nodes], cg_filter, r_min)
+    weight_factor_distance = csr_matrix(indptr, used_nodes[indices], r_min - distance,
+                                        (len(en_filter), len(mesh.node_ids)))
     # print ("weight_factor_distance have been computed")
-    return weight_factor_node, M, weight_factor_distance, near_nodes
+    return en_mesh, weight_factor_node, en_filter, weight_factor_distance
 
 
 # function to filter sensitivity number to suppress checkerboard
-def run1(file_name, sensitivity_number, weight_factor_node, M, weight_factor_distance, near_nodes, nodes, opt_domains):
-    sensitivity_number_node = {}  # hypothetical sensitivity number of each node
-    for nn in nodes:
-        if nn in M:
-            sensitivity_number_node[nn] = 0
-            for en in M[nn]:
-                sensitivity_number_node[nn] += weight_factor_node[nn][en] * sensitivity_number[en]
-    sensitivity_number_filtered = sensitivity_number.copy()  # sensitivity number of each element after filtering
-    for en in opt_domains:
-        numerator = 0
-        denominator = 0
-        for nn in near_nodes[en]:
-            try:
-                numerator += weight_factor_distance[(en, nn)] * sensitivity_number_node[nn]
-                denominator += weight_factor_distance[(en, nn)]
-            except KeyError:
-                pass
-        if denominator != 0:
-            sensitivity_number_filtered[en] = numerator / denominator
-        else:
-            msg = "\nERROR: filter over nodes failed due to division by 0." \
-                  "Some element CG has not a node in distance <= r_min.\n"
-            print(msg)
-            beso_lib.write_to_log(file_name, msg)
-            filter_on_sensitivity = 0
-            return sensitivity_number
-    return sensitivity_number_filtered
+def run1(file_name, sensitivity_number, en_mesh, weight_factor_node, en_filter, weight_factor_distance, opt_domains):
+    # hypothetical sensitivity number of each node
+    sensitivity_number_node = weight_factor_node.dot(values_array(sensitivity_number, en_mesh))
+    # sensitivity number of each element after filtering
+    rows = rows_in_domains(en_filter, opt_domains)
+    numerator = weight_factor_distance.dot(sensitivity_number_node)
+    denominator = np.asarray(weight_factor_distance.sum(axis=1)).ravel()
+    if np.any(denominator[rows] == 0):
+        msg = "\nERROR: filter over nodes failed due to division by 0." \
+              "Some element CG has not a node in distance <= r_min.\n"
+        print(msg)
+        beso_lib.write_to_log(file_name, msg)
+        return sensitivity_number
+    return values_update(sensitivity_number, en_filter, rows, numerator / np.where(rows, denominator, 1))
 
 
 # function preparing values for filtering element rho to suppress checkerboard
-# uses sectoring to prevent computing distance of far points
-def prepare2s(cg, cg_min, cg_max, r_min, opt_domains, weight_factor2, near_elm):
-    sector_elm = {}
-    # preparing empty sectors
-    x = cg_min[0] + 0.5 * r_min
-    while x <= cg_max[0] + 0.5 * r_min:
-        y = cg_min[1] + 0.5 * r_min
-        while y <= cg_max[1] + 0.5 * r_min:
-            z = cg_min[2] + 0.5 * r_min
-            while z <= cg_max[2] + 0.5 * r_min:
-                # 6 significant digit round because of small declination (6 must be used for all sround below)
-                sector_elm[(sround(x, 6), sround(y, 6), sround(z, 6))] = []
-                z += r_min
-            y += r_min
-        x += r_min
-    # assigning elements to the sectors
-    for en in opt_domains:
-        sector_centre = []
-        for k in range(3):
-            position = cg_min[k] + r_min * (0.5 + np.floor((cg[en][k] - cg_min[k]) / r_min))
-            sector_centre.append(sround(position, 6))
-        sector_elm[tuple(sector_centre)].append(en)
-    # finding near elements inside each sector
-    for sector_centre in sector_elm:
-        for en in sector_elm[sector_centre]:
-            near_elm[en] = []
-        for en in sector_elm[sector_centre]:
-            for en2 in sector_elm[sector_centre]:
-                if en == en2:
-                    continue
-                ee = (min(en, en2), max(en, en2))
-                try:
-                    weight_factor2[ee]
-                except KeyError:
-                    dx = cg[en][0] - cg[en2][0]
-                    dy = cg[en][1] - cg[en2][1]
-                    dz = cg[en][2] - cg[en2][2]
-                    distance = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-                    if distance < r_min:
-                        weight_factor2[ee] = r_min - distance
-                        near_elm[en].append(en2)
-                        near_elm[en2].append(en)
-    # finding near elements in neighbouring sectors by comparing distance with neighbouring sector elements
-    x = cg_min[0] + 0.5 * r_min
-    while x <= cg_max[0] + 0.5 * r_min:
-        y = cg_min[1] + 0.5 * r_min
-        while y <= cg_max[1] + 0.5 * r_min:
-            z = cg_min[2] + 0.5 * r_min
-            while z <= cg_max[2] + 0.5 * r_min:
-                position = (sround(x, 6), sround(y, 6), sround(z, 6))
-                # down level neighbouring sectors:
-                # o  o  -
-                # o  -  -
-                # o  -  -
-                # middle level neighbouring sectors:
-                # o  o  -
-                # o self -
-                # o  -  -
-                # upper level neighbouring sectors:
-                # o  o  -
-                # o  o  -
-                # o  -  -
-                for position_neighbour in [(x + r_min, y - r_min, z - r_min),
-                                           (x + r_min, y, z - r_min),
-                                           (x + r_min, y + r_min, z - r_min),
-                                           (x, y + r_min, z - r_min),
-                                           (x + r_min, y - r_min, z),
-                                           (x + r_min, y, z),
-                                           (x + r_min, y + r_min, z),
-                                           (x, y + r_min, z),
-                                           (x + r_min, y - r_min, z + r_min),
-                                           (x + r_min, y, z + r_min),
-                                           (x + r_min, y + r_min, z + r_min),
-                                           (x, y + r_min, z + r_min),
-                                           (x, y, z + r_min)]:
-                    position_neighbour = (sround(position_neighbour[0], 6), sround(position_neighbour[1], 6),
-                                          sround(position_neighbour[2], 6))
-                    for en in sector_elm[position]:
-                        try:
-                            for en2 in sector_elm[position_neighbour]:
-                                dx = cg[en][0] - cg[en2][0]
-                                dy = cg[en][1] - cg[en2][1]
-                                dz = cg[en][2] - cg[en2][2]
-                                distance = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-                                if distance < r_min:
-                                    ee = (min(en, en2), max(en, en2))
-                                    weight_factor2[ee] = r_min - distance
-                                    near_elm[en].append(en2)
-                                    near_elm[en2].append(en)
-                        except KeyError:
-                            pass
-                z += r_min
-            y += r_min
-        x += r_min
+# uses kd-tree to prevent computing distance of far points
+# returns en_filter - numbers of filtered elements and weight_factor2 - sparse matrix (en_filter, en_filter) of weight
+# factors of near elements
+def prepare2s(cg, cg_min, cg_max, r_min, opt_domains):
+    en_filter, points = cg_array(cg, opt_domains)
+    indptr, indices, distance = near_elements_csr(points, r_min)
+    weight_factor2 = csr_matrix(indptr, indices, r_min - distance, (len(en_filter), len(en_filter)))
     # print ("near elements have been associated, weight factors computed")
-    return weight_factor2, near_elm
+    return en_filter, weight_factor2
 
 
 # function to filter sensitivity number to suppress checkerboard
 # simplified version: makes weighted average of sensitivity numbers from near elements
-def run2(file_name, sensitivity_number, weight_factor2, near_elm, opt_domains):
-    sensitivity_number_filtered = sensitivity_number.copy()  # sensitivity number of each element after filtering
-    for en in opt_domains:
-        numerator = 0
-        denominator = 0
-        for en2 in near_elm[en]:
-            ee = (min(en, en2), max(en, en2))
-            numerator += weight_factor2[ee] * sensitivity_number[en2]
-            denominator += weight_factor2[ee]
-        if denominator != 0:
-            sensitivity_number_filtered[en] = numerator / denominator
-        else:
-            msg = "\nERROR: simple filter failed due to division by 0." \
-                  "Some element has not a near element in distance <= r_min.\n"
-            print(msg)
-            beso_lib.write_to_log(file_name, msg)
-            filter_on_sensitivity = 0
-            return sensitivity_number
-    return sensitivity_number_filtered
+def run2(file_name, sensitivity_number, en_filter, weight_factor2, opt_domains):
+    rows = rows_in_domains(en_filter, opt_domains)
+    numerator = weight_factor2.dot(values_array(sensitivity_number, en_filter))
+    denominator = np.asarray(weight_factor2.sum(axis=1)).ravel()
+    if np.any(denominator[rows] == 0):
+        msg = "\nERROR: simple filter failed due to division by 0." \
+              "Some element has not a near element in distance <= r_min.\n"
+        print(msg)
+        beso_lib.write_to_log(file_name, msg)
+        return sensitivity_number
+    return values_update(sensitivity_number, en_filter, rows, numerator / np.where(rows, denominator, 1))
+
+
+# function returning histogram list of number of near points of elements for the log file
+def histogram(lengths, minimal_length):
+    return np.bincount(np.asarray(lengths, dtype=np.int64), minlength=minimal_length).astype(float).tolist()
+
+
+# function searching near points of a regular point grid for each element
+# cells are integer positions of grid cells, cell_points are point offsets inside a cell, points of the cell
+# (cx, cy, cz) are at cell_size * (cx, cy, cz) + cell_points[p], near cells are given by cell_offsets
+# returns element positions, point integer keys (cx, cy, cz, p) and distance
+def near_grid_points(cg_elm, cell_size, cell_points, cells, cell_offsets, r_min):
+    candidates = (cell_offsets[:, None, :] * np.ones((1, len(cell_points), 1), dtype=np.int64)).reshape(-1, 3)
+    candidate_points = np.tile(np.arange(len(cell_points)), len(cell_offsets))
+    elm_rows = [np.zeros(0, dtype=np.int64)]
+    point_keys = [np.zeros((0, 4), dtype=np.int64)]
+    distances = [np.zeros(0)]
+    chunk = 10000  # elements processed at once to limit memory
+    for start in range(0, len(cg_elm), chunk):
+        cell_chunk = cells[start:start + chunk, None, :] + candidates[None, :, :]
+        coordinates = cell_chunk * cell_size + cell_points[candidate_points]
+        distance = np.linalg.norm(cg_elm[start:start + chunk, None, :] - coordinates, axis=2)
+        rows, columns = np.nonzero(distance < r_min)
+        elm_rows.append(rows + start)
+        point_keys.append(np.column_stack((cell_chunk[rows, columns], candidate_points[columns])))
+        distances.append(distance[rows, columns])
+    return np.concatenate(elm_rows), np.concatenate(point_keys), np.concatenate(distances)
+
+
+# function converting near grid points to the sparse matrix (elements, points) of weight factors
+# the same grid point found from different elements is given by the same integer key
+def grid_weight_factors(number_of_elements, elm_rows, point_keys, distance, r_min):
+    point_inverse = np.unique(point_keys, axis=0, return_inverse=True)[1].ravel()
+    number_of_points = point_inverse.max() + 1 if len(point_inverse) else 0
+    indptr, indices, distance = pairs_to_csr(number_of_elements, elm_rows, point_inverse, distance)
+    return csr_matrix(indptr, indices, r_min - distance, (number_of_elements, number_of_points))
 
 
 # function preparing values for filtering element sensitivity number using own point mesh
 # currently set to work only with elements in opt_domains
 # does not work?!
 def prepare3_ortho_grid(file_name, cg, cg_min, r_min, opt_domains):
-    weight_factor3 = {}
-    near_points = {}
-    near_elm = {}
     grid_size = 0.7 * r_min  # constant less than sqrt(6)/2 is chosen ensuring that each element has at least 3 near points
     # if codes below are done for situation where grid_size > 0.5 * r_min
 
-    # searching for near points of each element
-    for en in opt_domains:  # domain to take elements for filtering
-        x_elm, y_elm, z_elm = cg[en]
+    # searching for near points of each element, grid points are at cg_min + grid_size * integer
+    en_filter, cg_elm = cg_array(cg, opt_domains)
+    cg_elm = cg_elm - np.array(cg_min, dtype=float)
+    cells = np.floor(cg_elm / grid_size).astype(np.int64)
+    offsets = np.arange(-1, 3)  # grid points in distance < r_min in each direction
+    cell_offsets = np.array(np.meshgrid(offsets, offsets, offsets, indexing="ij")).reshape(3, -1).T
+    [elm_rows, point_keys, distance] = near_grid_points(cg_elm, grid_size, np.zeros((1, 3)), cells, cell_offsets,
+                                                        r_min)
+    weight_factor3 = grid_weight_factors(len(en_filter), elm_rows, point_keys, distance, r_min)
 
-        # set proper starting point coordinates
-        reminder = divmod(x_elm - cg_min[0], grid_size)[1]
-        if (grid_size + reminder) < r_min:
-            x = x_elm - grid_size - reminder
-        else:
-            x = x_elm - reminder
-        reminder = divmod(y_elm - cg_min[1], grid_size)[1]
-        if (grid_size + reminder) < r_min:
-            yy = y_elm - grid_size - reminder
-        else:
-            yy = y_elm - reminder
-        reminder = divmod(z_elm - cg_min[2], grid_size)[1]
-        if (grid_size + reminder) < r_min:
-            zz = z_elm - grid_size - reminder
-        else:
-            zz = z_elm - reminder
-        near_points[en] = []
-
-        # through points in the cube around element centre of gravity
-        while x < x_elm + r_min:
-            y = yy
-            while y < y_elm + r_min:
-                z = zz
-                while z < z_elm + r_min:
-                    distance = ((x_elm - x) ** 2 + (y_elm - y) ** 2 + (z_elm - z) ** 2) ** 0.5
-                    if distance < r_min:
-                        weight_factor3[(en, (x, y, z))] = r_min - distance
-                        near_points[en].append((x, y, z))
-                        try:
-                            near_elm[(x, y, z)].append(en)
-                        except KeyError:
-                            near_elm[(x, y, z)] = [en]
-                    z += grid_size
-                y += grid_size
-            x += grid_size
-    hist_near_elm = list(np.zeros(25))
-    hist_near_points = list(np.zeros(25))
-    for pn in near_elm:
-        if isinstance(near_elm[pn], int):
-            le = 1
-        else:
-            le = len(near_elm[pn])
-        if le >= len(hist_near_elm):
-            while len(hist_near_elm) <= le:
-                hist_near_elm.append(0)
-        hist_near_elm[le] += 1
-    for en in near_points:
-        if isinstance(near_points[en], int):
-            le = 1
-        else:
-            le = len(near_points[en])
-        if le >= len(hist_near_points):
-            while len(hist_near_points) <= le:
-                hist_near_points.append(0)
-        hist_near_points[le] += 1
     msg = "\nfilter3 statistics:\n"
     msg += "histogram - number of near elements (list index) vs. number of points (value)\n"
-    msg += str(hist_near_elm) + "\n"
+    msg += str(histogram(weight_factor3.getnnz(axis=0), 25)) + "\n"
     msg += "histogram - number of near points (list index) vs. number of elements (value)\n"
-    msg += str(hist_near_points) + "\n"
+    msg += str(histogram(weight_factor3.getnnz(axis=1), 25)) + "\n"
     beso_lib.write_to_log(file_name, msg)
-    return weight_factor3, near_elm, near_points
+    return en_filter, weight_factor3
 
 
 # function preparing values for filtering element sensitivity number using own point mesh of tetrahedrons
 # currently set to work only with elements in opt_domains
+# returns en_filter - numbers of filtered elements and weight_factor3 - sparse matrix (en_filter, points) of weight
+# factors of near points
 def prepare3_tetra_grid(file_name, cg, r_min, opt_domains):
-    weight_factor3 = {}
-    near_points = {}
-    near_elm = {}
     grid = 1.0 * r_min  # ranges of xyz cycles should be set according to preset coefficient
-
-    # searching for near points of each element
-    for en in opt_domains:  # domain to take elements for filtering
-        x_elm, y_elm, z_elm = cg[en]
-
-        # set starting point of the cell
-        # grid is the length of tetrahedral edge, which is also cell x size
-        x_en_cell = x_elm - x_elm % grid
-        # v = grid * np.sqrt(3) / 2 is the high of triangle, which is the half of cell y size
-        v = grid * 0.8660
-        y_en_cell = y_elm - y_elm % (2 * v)
-        # h = grid * np.sqrt(2 / 3.0)  is the high of tetrahedron, which is the half of cell z size
-        h = grid * 0.8165
-        z_en_cell = z_elm - z_elm % (2 * h)
-
-        near_points[en] = []
-        # comparing distance in cells around element en
-        for x_cell in [x_en_cell - grid, x_en_cell, x_en_cell + grid]:
-            for y_cell in [y_en_cell - 2 * v, y_en_cell, y_en_cell + 2 * v]:
-                for z_cell in [z_en_cell - 2 * h, z_en_cell, z_en_cell + 2 * h]:
-                    for [x, y, z] in [[x_cell, y_cell, z_cell],
-                                               [x_cell + grid / 2.0, y_cell + v, z_cell],
-                                               [x_cell + grid / 2.0, y_cell + v / 3.0, z_cell + h],
-                                               [x_cell, y_cell + 4 / 3.0 * v, z_cell + h]]:  # grid point coordinates
-                        distance = ((x_elm - x) ** 2 + (y_elm - y) ** 2 + (z_elm - z) ** 2) ** 0.5
-                        if distance < r_min:
-                            weight_factor3[(en, (x, y, z))] = r_min - distance
-                            near_points[en].append((x, y, z))
-                            try:
-                                near_elm[(x, y, z)].append(en)
-                            except KeyError:
-                                near_elm[(x, y, z)] = [en]
+    # grid is the length of tetrahedral edge, which is also cell x size
+    # v = grid * np.sqrt(3) / 2 is the high of triangle, which is the half of cell y size
+    v = grid * 0.8660
+    # h = grid * np.sqrt(2 / 3.0)  is the high of tetrahedron, which is the half of cell z size
+    h = grid * 0.8165
+    cell_size = np.array([grid, 2 * v, 2 * h])
+    cell_points = np.array([[0, 0, 0], [grid / 2.0, v, 0], [grid / 2.0, v / 3.0, h], [0, 4 / 3.0 * v, h]])
+
+    # searching for near points of each element in cells around the element cell
+    en_filter, cg_elm = cg_array(cg, opt_domains)
+    cells = np.floor(cg_elm / cell_size).astype(np.int64)
+    offsets = np.arange(-1, 2)
+    cell_offsets = np.array(np.meshgrid(offsets, offsets, offsets, indexing="ij")).reshape(3, -1).T
+    [elm_rows, point_keys, distance] = near_grid_points(cg_elm, cell_size, cell_points, cells, cell_offsets, r_min)
+    weight_factor3 = grid_weight_factors(len(en_filter), elm_rows, point_keys, distance, r_min)
 
     # summarize histogram of near elements
-    hist_near_points = list(np.zeros(10))
-    for en in near_points:
-        if isinstance(near_points[en], int):
-            le = 1
-        else:
-            le = len(near_points[en])
-        if le >= len(hist_near_points):
-            while len(hist_near_points) <= le:
-                hist_near_points.append(0)
-        hist_near_points[le] += 1
     msg = "\nfilter over points statistics:\n"
     msg += "histogram - number of near points (list index) vs. number of elements (value)\n"
-    msg += str(hist_near_points) + "\n"
+    msg += str(histogram(weight_factor3.getnnz(axis=1), 10)) + "\n"
     beso_lib.write_to_log(file_name, msg)
-    return weight_factor3, near_elm, near_points
+    return en_filter, weight_factor3
 
 
 # function for filtering element sensitivity number using own point mesh
 # currently works only with elements in opt_domains
-def run3(sensitivity_number, weight_factor3, near_elm, near_points):
-    sensitivity_number_filtered = sensitivity_number.copy()  # sensitivity number of each element after filtering
-    point_sensitivity = {}
-
+def run3(sensitivity_number, en_filter, weight_factor3):
     # weighted averaging of sensitivity number from elements to points
-    for pn in near_elm:
-        numerator = 0
-        denominator = 0
-        for en in near_elm[pn]:
-            numerator += weight_factor3[(en, pn)] * sensitivity_number[en]
-            denominator += weight_factor3[(en, pn)]
-        point_sensitivity[pn] = numerator / denominator
+    point_sensitivity = weight_factor3.T.dot(values_array(sensitivity_number, en_filter))
+    point_sensitivity /= np.asarray(weight_factor3.sum(axis=0)).ravel()
 
     # weighted averaging of sensitivity number from points back to elements
-    for en in near_points:
-        numerator = 0
-        denominator = 0
-        for pn in near_points[en]:
-            numerator += weight_factor3[(en, pn)] * point_sensitivity[pn]
-            denominator += weight_factor3[(en, pn)]
-        sensitivity_number_filtered[en] = numerator / denominator
-
-    return sensitivity_number_filtered
+    filtered = weight_factor3.dot(point_sensitivity) / np.asarray(weight_factor3.sum(axis=1)).ravel()
+    return values_update(sensitivity_number, en_filter, np.ones(len(en_filter), dtype=bool), filtered)
 
 
 # function preparing values for morphology based filtering
 # it is a copy of filter_prepare2s without saving distance of near elements
-# uses sectoring to prevent computing distance of far points
-def prepare_morphology(cg, cg_min, cg_max, r_min, opt_domains, near_elm):
-    sector_elm = {}
-    # preparing empty sectors
-    x = cg_min[0] + 0.5 * r_min
-    while x <= cg_max[0] + 0.5 * r_min:
-        y = cg_min[1] + 0.5 * r_min
-        while y <= cg_max[1] + 0.5 * r_min:
-            z = cg_min[2] + 0.5 * r_min
-            while z <= cg_max[2] + 0.5 * r_min:
-                # 6 significant digit round because of small declination (6 must be used for all sround below)
-                sector_elm[(sround(x, 6), sround(y, 6), sround(z, 6))] = []
-                z += r_min
-            y += r_min
-        x += r_min
-
-    # assigning elements to the sectors
-    for en in opt_domains:
-        sector_centre = []
-        for k in range(3):
-            position = cg_min[k] + r_min * (0.5 + np.floor((cg[en][k] - cg_min[k]) / r_min))
-            sector_centre.append(sround(position, 6))
-        sector_elm[tuple(sector_centre)].append(en)
-
-    # finding near elements inside each sector
-    for sector_centre in sector_elm:
-        for en in sector_elm[sector_centre]:
-            near_elm[en] = []
-        for en in sector_elm[sector_centre]:
-            for en2 in sector_elm[sector_centre]:
-                if en == en2:
-                    continue
-                dx = cg[en][0] - cg[en2][0]
-                dy = cg[en][1] - cg[en2][1]
-                dz = cg[en][2] - cg[en2][2]
-                distance = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-                if distance < r_min:
-                    near_elm[en].append(en2)
-                    near_elm[en2].append(en)
-
-    # finding near elements in neighbouring sectors by comparing distance with neighbouring sector elements
-    x = cg_min[0] + 0.5 * r_min
-    while x <= cg_max[0] + 0.5 * r_min:
-        y = cg_min[1] + 0.5 * r_min
-        while y <= cg_max[1] + 0.5 * r_min:
-            z = cg_min[2] + 0.5 * r_min
-            while z <= cg_max[2] + 0.5 * r_min:
-                position = (sround(x, 6), sround(y, 6), sround(z, 6))
-                # down level neighbouring sectors:
-                # o  o  -
-                # o  -  -
-                # o  -  -
-                # middle level neighbouring sectors:
-                # o  o  -
-                # o self -
-                # o  -  -
-                # upper level neighbouring sectors:
-                # o  o  -
-                # o  o  -
-                # o  -  -
-                for position_neighbour in [(x + r_min, y - r_min, z - r_min),
-                                           (x + r_min, y, z - r_min),
-                                           (x + r_min, y + r_min, z - r_min),
-                                           (x, y + r_min, z - r_min),
-                                           (x + r_min, y - r_min, z),
-                                           (x + r_min, y, z),
-                                           (x + r_min, y + r_min, z),
-                                           (x, y + r_min, z),
-                                           (x + r_min, y - r_min, z + r_min),
-                                           (x + r_min, y, z + r_min),
-                                           (x + r_min, y + r_min, z + r_min),
-                                           (x, y + r_min, z + r_min),
-                                           (x, y, z + r_min)]:
-                    position_neighbour = (sround(position_neighbour[0], 6), sround(position_neighbour[1], 6),
-                                          sround(position_neighbour[2], 6))
-                    for en in sector_elm[position]:
-                        try:
-                            for en2 in sector_elm[position_neighbour]:
-                                dx = cg[en][0] - cg[en2][0]
-                                dy = cg[en][1] - cg[en2][1]
-                                dz = cg[en][2] - cg[en2][2]
-                                distance = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5
-                                if distance < r_min:
-                                    near_elm[en].append(en2)
-                                    near_elm[en2].append(en)
-                        except KeyError:
-                            pass
-                z += r_min
-            y += r_min
-        x += r_min
+# uses kd-tree to prevent computing distance of far points
+# returns en_filter - numbers of filtered elements and near_elm - sparse matrix (en_filter, en_filter) marking near
+# elements including the element itself
+def prepare_morphology(cg, cg_min, cg_max, r_min, opt_domains):
+    en_filter, points = cg_array(cg, opt_domains)
+    indptr, indices, _ = near_elements_csr(points, r_min)
+    near_elm = with_diagonal(csr_matrix(indptr, indices, np.ones(len(indices)), (len(en_filter), len(en_filter))))
     # print ("near elements have been associated")
-    return near_elm
+    return en_filter, near_elm
 
 
 # morphology based filtering (erode, dilate, open, close, open-close, close-open, combine)
-def run_morphology(sensitivity_number, near_elm, opt_domains, filter_type, FI_step_max=None):
-
-    def filter(filter_type, sensitivity_number, near_elm, opt_domains):
-        sensitivity_number_subtype = sensitivity_number.copy()
-        for en in opt_domains:
-            sensitivity_number_near = [sensitivity_number[en]]
-            for en2 in near_elm[en]:
-                sensitivity_number_near.append(sensitivity_number[en2])
-            if filter_type == "erode":
-                if FI_step_max:
-                    if FI_step_max[en] >= 1:  # if failing, do not switch down
-                        pass
-                    else:
-                        sensitivity_number_subtype[en] = min(sensitivity_number_near)
-                else:
-                    sensitivity_number_subtype[en] = min(sensitivity_number_near)
-            elif filter_type == "dilate":
-                sensitivity_number_subtype[en] = max(sensitivity_number_near)
-        return sensitivity_number_subtype
-
-    sensitivity_number_filtered = sensitivity_number.copy()
+def run_morphology(sensitivity_number, en_filter, near_elm, opt_domains, filter_type, FI_step_max=None):
+    rows = rows_in_domains(en_filter, opt_domains)
+    if FI_step_max:  # if failing, do not switch down
+        erode_rows = rows & (values_array(FI_step_max, en_filter) < 1)
+    else:
+        erode_rows = rows
+
+    def filter(filter_type, values):
+        # every row contains at least the element itself
+        near_values = values[near_elm.indices]
+        if filter_type == "erode":
+            return np.where(erode_rows, np.minimum.reduceat(near_values, near_elm.indptr[:-1]), values)
+        elif filter_type == "dilate":
+            return np.where(rows, np.maximum.reduceat(near_values, near_elm.indptr[:-1]), values)
+
+    values = values_array(sensitivity_number, en_filter)
     if filter_type in ["erode", "dilate"]:
-        sensitivity_number_filtered = filter(filter_type, sensitivity_number, near_elm, opt_domains)
+        filtered = filter(filter_type, values)
     elif filter_type == "open":
-        sensitivity_number_1 = filter("erode", sensitivity_number, near_elm, opt_domains)
-        sensitivity_number_filtered = filter("dilate", sensitivity_number_1, near_elm, opt_domains)
+        filtered = filter("dilate", filter("erode", values))
     elif filter_type == "close":
-        sensitivity_number_1 = filter("dilate", sensitivity_number, near_elm, opt_domains)
-        sensitivity_number_filtered = filter("erode", sensitivity_number_1, near_elm, opt_domains)
+        filtered = filter("erode", filter("dilate", values))
     elif filter_type == "open-close":
-        sensitivity_number_1 = filter("erode", sensitivity_number, near_elm, opt_domains)
-        sensitivity_number_1 = filter("dilate", sensitivity_number_1, near_elm, opt_domains)
-        sensitivity_number_1 = filter("dilate", sensitivity_number_1, near_elm, opt_domains)
-        sensitivity_number_filtered = filter("erode", sensitivity_number_1, near_elm, opt_domains)
+        filtered = filter("erode", filter("dilate", filter("dilate", filter("erode", values))))
     elif filter_type == "close-open":
-        sensitivity_number_1 = filter("dilate", sensitivity_number, near_elm, opt_domains)
-        sensitivity_number_1 = filter("erode", sensitivity_number_1, near_elm, opt_domains)
-        sensitivity_number_1 = filter("erode", sensitivity_number_1, near_elm, opt_domains)
-        sensitivity_number_filtered = filter("dilate", sensitivity_number_1, near_elm, opt_domains)
+        filtered = filter("dilate", filter("erode", filter("erode", filter("dilate", values))))
     elif filter_type == "combine":
-        sensitivity_number_1 = filter("erode", sensitivity_number, near_elm, opt_domains)
-        sensitivity_number_2 = filter("dilate", sensitivity_number, near_elm, opt_domains)
-        for en in opt_domains:
-            sensitivity_number_filtered[en] = (sensitivity_number_1[en] + sensitivity_number_2[en]) / 2.0
-    return sensitivity_number_filtered
+        filtered = (filter("erode", values) + filter("dilate", values)) / 2.0
+    else:
+        return sensitivity_number.copy()
+    return values_update(sensitivity_number, en_filter, rows, filtered)
 
 
 # function preparing values for the casting filter
-# uses sectoring to prevent computing distance of far points
-def prepare2s_casting(cg, r_min, opt_domains, above_elm, below_elm, casting_vector):
+# uses kd-tree in the plane perpendicular to the casting vector to prevent computing distance of far points
+# returns en_filter - numbers of filtered elements, above_elm and below_elm - sparse matrices (en_filter, en_filter)
+# marking elements above and below including the element itself
+def prepare2s_casting(cg, r_min, opt_domains, casting_vector):
 
     # coordinate transformation
     exg = np.array([1., 0., 0.])  # unit vectors in global coordinate system
@@ -809,103 +440,32 @@ def prepare2s_casting(cg, r_min, opt_domains, above_elm, below_elm, casting_vect
     T[(2, 0)] = np.dot(casting_vector, exg)
     T[(2, 1)] = np.dot(casting_vector, eyg)
     T[(2, 2)] = np.dot(casting_vector, ezg)
-    cg_cast = {}  # element cg position in transformed coordinate system
-    x_cg_cast = []  # for minimum and maximum cg x and y position
-    y_cg_cast = []
-    for en in opt_domains:
-        cg_cast[en] = T.dot(cg[en])
-        x_cg_cast.append(cg_cast[en][0])
-        y_cg_cast.append(cg_cast[en][1])
-    cg_cast_min = [min(x_cg_cast), min(y_cg_cast)]
-    cg_cast_max = [max(x_cg_cast), max(y_cg_cast)]
-
-    # preparing empty sectors (columns in casting direction
-    sector_elm = {}
-    x = cg_cast_min[0] + 0.5 * r_min
-    while x <= cg_cast_max[0] + 0.5 * r_min:
-        y = cg_cast_min[1] + 0.5 * r_min
-        while y <= cg_cast_max[1] + 0.5 * r_min:
-            # 6 significant digit round because of small declination (6 must be used for all sround below)
-            sector_elm[(sround(x, 6), sround(y, 6))] = []
-            y += r_min
-        x += r_min
-    # assigning elements to the sectors
-    for en in opt_domains:
-        sector_centre = []
-        for k in range(2):
-            position = cg_cast_min[k] + r_min * (0.5 + np.floor((cg_cast[en][k] - cg_cast_min[k]) / r_min))
-            sector_centre.append(sround(position, 6))
-        sector_elm[tuple(sector_centre)].append(en)
-
-    # finding elements above inside each sector
-    for sector_centre in sector_elm:
-        # sorting elements in the sectors from the highest z_casting
-        en_z = []
-        for en in sector_elm[sector_centre]:
-            en_z.append(cg_cast[en][2])
-        sector_elm[sector_centre] = [x for _,x in sorted(zip(en_z, sector_elm[sector_centre]), reverse=True)]
-        # finding the above elements
-        for en in sector_elm[sector_centre]:
-            above_elm[en] = []
-            below_elm[en] = []
-            for en2 in sector_elm[sector_centre]:
-                if en == en2:
-                    break
-                dx = cg_cast[en][0] - cg_cast[en2][0]
-                dy = cg_cast[en][1] - cg_cast[en2][1]
-                distance = (dx ** 2 + dy ** 2) ** 0.5
-                if distance <= r_min:
-                    above_elm[en].append(en2)
-                    below_elm[en2].append(en)
-
-    # finding elements above in neighbouring sectors by comparing distance with neighbouring sector elements
-    x = cg_cast_min[0] + 0.5 * r_min
-    while x <= cg_cast_max[0] + 0.5 * r_min:
-        y = cg_cast_min[1] + 0.5 * r_min
-        while y <= cg_cast_max[1] + 0.5 * r_min:
-            position = (sround(x, 6), sround(y, 6))
-            for position_neighbour in [(x - r_min, y - r_min),
-                                       (x - r_min, y),
-                                       (x - r_min, y + r_min),
-                                       (x, y - r_min),
-                                       (x, y + r_min),
-                                       (x + r_min, y - r_min),
-                                       (x + r_min, y),
-                                       (x + r_min, y + r_min)]:
-                position_neighbour = (sround(position_neighbour[0], 6), sround(position_neighbour[1], 6))
-                for en in sector_elm[position]:
-                    try:
-                        for en2 in sector_elm[position_neighbour]:
-                            if cg_cast[en][2] <= cg_cast[en2][2]:
-                                break
-                            dx = cg_cast[en][0] - cg_cast[en2][0]
-                            dy = cg_cast[en][1] - cg_cast[en2][1]
-                            distance = (dx ** 2 + dy ** 2) ** 0.5
-                            if distance <= r_min:
-                                above_elm[en].append(en2)
-                                below_elm[en2].append(en)
-                    except KeyError:
-                        pass
-            y += r_min
-        x += r_min
-    return above_elm, below_elm
+    en_filter, cg_elm = cg_array(cg, opt_domains)
+    cg_cast = cg_elm.dot(T.T)  # element cg position in transformed coordinate system
+
+    # elements ordered from the highest z_casting, elements with the same z_casting by descending number
+    height_rank = np.empty(len(en_filter), dtype=np.int64)
+    height_rank[np.lexsort((en_filter, cg_cast[:, 2]))[::-1]] = np.arange(len(en_filter))
+
+    # finding elements in the column of radius r_min, the upper one of each pair is above the lower one
+    i, j, _ = near_pairs(cg_cast[:, :2], r_min, strict=False)
+    upper = np.where(height_rank[i] < height_rank[j], i, j)
+    lower = np.where(height_rank[i] < height_rank[j], j, i)
+    ones = np.ones(len(upper))
+    shape = (len(en_filter), len(en_filter))
+    above_elm = with_diagonal(csr_matrix(*pairs_to_csr(len(en_filter), lower, upper, ones), shape))
+    below_elm = with_diagonal(csr_matrix(*pairs_to_csr(len(en_filter), upper, lower, ones), shape))
+    return en_filter, above_elm, below_elm
 
 
 # function to filter sensitivity number to suppress checkerboard
 # simplified version: makes weighted average of sensitivity numbers from near elements
-def run2_casting(sensitivity_number, above_elm, below_elm, opt_domains):
-    sensitivity_number_averaged = sensitivity_number.copy()
-    sensitivity_number_filtered = sensitivity_number.copy()  # sensitivity number of each element after filtering
+def run2_casting(sensitivity_number, en_filter, above_elm, below_elm, opt_domains):
+    rows = rows_in_domains(en_filter, opt_domains)
+    values = values_array(sensitivity_number, en_filter)
     # use average of below sensitivities
-    for en in opt_domains:
-        sensitivities_below = [sensitivity_number[en]]
-        for en2 in below_elm[en]:
-            sensitivities_below.append(sensitivity_number[en2])
-            sensitivity_number_averaged[en] = np.average(sensitivities_below)
+    averaged = below_elm.dot(values) / below_elm.getnnz(axis=1)
+    averaged = np.where(rows, averaged, values)
     # use maximum of above (just averaged) sensitivities
-    for en in opt_domains:
-        sensitivities_above = [sensitivity_number_averaged[en]]
-        for en2 in above_elm[en]:
-            sensitivities_above.append(sensitivity_number_averaged[en2])
-        sensitivity_number_filtered[en] = max(sensitivities_above)
-    return sensitivity_number_filtered
+    filtered = np.maximum.reduceat(averaged[above_elm.indices], above_elm.indptr[:-1])
+    return values_update(sensitivity_number, en_filter, rows, filtered)
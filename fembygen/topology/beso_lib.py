@@ -1,7 +1,11 @@
+import ast
+import functools
 import numpy as np
-import operator
+import re
 from math import *
 import os
+import hashlib
+from fembygen.topology import beso_mesh
 
 
 class Elements:
@@ -112,129 +116,104 @@ def write_to_log(file_name, msg):
     f_log.close()
 
 
-# function importing a mesh consisting of nodes, volume and shell elements
-def import_inp(file_name, domains_from_config, domain_optimized, shells_as_composite):
-    nodes = {}  # dict with nodes position
-    all_elements = Elements()
-    model_definition = True
+# function yielding lines of the inp file, lines of *INCLUDE files are yielded in place of the *INCLUDE card
+def inp_lines(file_name, sources):
+    sources.append(file_name)
+    with open(file_name, "r") as f:
+        for line in f:
+            if line[:8].upper() == "*INCLUDE":
+                start = 1 + line.index("=")
+                include = line[start:].strip().strip('"')
+                yield from inp_lines(os.path.join(os.path.split(file_name)[0], include), sources)
+            else:
+                yield line
+
+
+# function returning numbers from the data lines of a block, lines are converted in bulk
+def block_values(lines, dtype, columns):
+    values = np.array(" ".join(lines).replace(",", " ").split(), dtype=dtype)
+    if len(values) % columns:  # not supported formatting, e.g. node with only 2 coordinates
+        raise ValueError("unexpected number of values in the block starting with: " + lines[0].strip())
+    return values.reshape(-1, columns)
+
+
+# function reading nodes, elements, element sets and special element types of the inp file
+# node and element blocks are collected and converted to arrays at once
+def read_inp_mesh(file_name):
+    sources = []  # read files, i.e. file_name and included files
+    node_blocks = []
+    element_blocks = {category: [] for category in beso_mesh.ELEMENT_CATEGORIES}
     domains = {}
-    read_domain = False
-    read_node = False
-    elm_category = []
-    elm_2nd_line = False
-    elset_generate = False
-    special_type = ""  # for plane strain, plane stress, or axisymmetry
-    plane_strain = set()
-    plane_stress = set()
-    axisymmetry = set()
+    special_types = {"plane strain": set(), "plane stress": set(), "axisymmetry": set()}
+    model_definition = True
+    block = ""  # "node", "element", "elset" or "generate"
+    data = []
+
+    def close_block():
+        if block == "node" and data:
+            node_blocks.append(block_values(data, float, 4))
+        elif block == "element" and data:
+            values = block_values(data, np.int64, number_of_nodes + 1)
+            if current_elset:  # save en to the domain
+                domains.setdefault(current_elset, set()).update(values[:, 0].tolist())
+            if elm_category in special_types:
+                special_types[elm_category].update(values[:, 0].tolist())
+            else:
+                element_blocks[elm_category].append(values)
 
-    try:
-        f = open(file_name, "r")
-    except IOError:
-        msg = ("CalculiX input file " + file_name + " not found. Check your inputs.")
-        write_to_log(file_name, "\nERROR: " + msg + "\n")
-        raise Exception(msg)
-    line = "\n"
-    include = ""
-    while line != "":
-        if include:
-            line = f_include.readline()
-            if line == "":
-                f_include.close()
-                include = ""
-                line = f.readline()
-        else:
-            line = f.readline()
+    for line in inp_lines(file_name, sources):
         if line.strip() == '':
             continue
         elif line[0] == '*':  # start/end of a reading set
             if line[0:2] == '**':  # comments
                 continue
-            if line[:8].upper() == "*INCLUDE":
-                start = 1 + line.index("=")
-                include = line[start:].strip().strip('"')
-                f_include = open(os.path.join(os.path.split(file_name)[0] + f"/{include}"), "r")
-                continue
-            read_node = False
-            elm_category = []
-            elm_2nd_line = False
-            read_domain = False
-            elset_generate = False
-
-        # reading nodes
-        if (line[:5].upper() == "*NODE") and (model_definition is True):
-            read_node = True
-        elif read_node is True:
-            line_list = line.split(',')
-            number = int(line_list[0])
-            x = float(line_list[1])
-            y = float(line_list[2])
-            z = float(line_list[3])
-            nodes[number] = [x, y, z]
-
-        # reading elements
-        elif line[:8].upper() == "*ELEMENT":
-            current_elset = ""
-            line_list = line[8:].split(',')
-            for line_part in line_list:
-                if line_part.split('=')[0].strip().upper() == "TYPE":
-                    elm_type = line_part.split('=')[1].strip().upper()
-                elif line_part.split('=')[0].strip().upper() == "ELSET":
-                    current_elset = line_part.split('=')[1].strip()
-            number_of_nodes, only_translations, elm_category = types(elm_type)
-
-        elif elm_category != []:
-            line_list = line.split(',')
-            if elm_2nd_line is False:
-                en = int(line_list[0])  # element number
-                if current_elset:  # save en to the domain
+            close_block()
+            block = ""
+            data = []
+
+            # reading nodes
+            if (line[:5].upper() == "*NODE") and (model_definition is True):
+                block = "node"
+            # reading elements
+            elif line[:8].upper() == "*ELEMENT":
+                current_elset = ""
+                for line_part in line[8:].split(','):
+                    if line_part.split('=')[0].strip().upper() == "TYPE":
+                        elm_type = line_part.split('=')[1].strip().upper()
+                    elif line_part.split('=')[0].strip().upper() == "ELSET":
+                        current_elset = line_part.split('=')[1].strip()
+                number_of_nodes, only_translations, elm_category = types(elm_type)
+                block = "element"
+            # reading domains from elset
+            elif line[:6].upper() == "*ELSET":
+                line_split_comma = line.split(",")
+                elset_generate = False
+                if "=" in line_split_comma[1]:
+                    name_member = 1
                     try:
-                        domains[current_elset].add(en)
-                    except KeyError:
-                        domains[current_elset] = {en}
-                if elm_category == "plane strain":
-                    plane_strain.add(en)
-                elif elm_category == "plane stress":
-                    plane_stress.add(en)
-                elif elm_category == "axisymmetry":
-                    axisymmetry.add(en)
-                getattr(all_elements, elm_category)[en] = [int(x) for x in line_list[1:]]
-                if len(getattr(all_elements, elm_category)[en]) != number_of_nodes:
-                    elm_2nd_line = True
-            else:
-                elm_2nd_line = False
-                getattr(all_elements, elm_category)[en] += [int(x) for x in line_list]
-
-        # reading domains from elset
-        elif line[:6].upper() == "*ELSET":
-            line_split_comma = line.split(",")
-            if "=" in line_split_comma[1]:
-                name_member = 1
-                try:
-                    if "GENERATE" in line_split_comma[2].upper():
+                        if "GENERATE" in line_split_comma[2].upper():
+                            elset_generate = True
+                    except IndexError:
+                        pass
+                else:
+                    name_member = 2
+                    if "GENERATE" in line_split_comma[1].upper():
                         elset_generate = True
-                except IndexError:
-                    pass
-            else:
-                name_member = 2
-                if "GENERATE" in line_split_comma[1].upper():
-                    elset_generate = True
-            member_split = line_split_comma[name_member].split("=")
-            current_elset = member_split[1].strip()
-            try:
-                domains[current_elset]
-            except KeyError:
-                domains[current_elset] = set()
-            if elset_generate is False:
-                read_domain = True
-        elif read_domain is True:
+                current_elset = line_split_comma[name_member].split("=")[1].strip()
+                domains.setdefault(current_elset, set())
+                block = "generate" if elset_generate else "elset"
+            elif line[:5].upper() == "*STEP":
+                model_definition = False
+        elif block in ["node", "element"]:
+            data.append(line)
+        elif block == "elset":
             for en in line.split(","):
                 en = en.strip()
                 if en.isdigit():
                     domains[current_elset].add(int(en))
                 elif en.isalpha():  # else: en is name of a previous elset
                     domains[current_elset].update(domains[en])
-        elif elset_generate is True:
+        elif block == "generate":
             line_split_comma = line.split(",")
             try:
                 if line_split_comma[3]:
@@ -243,10 +222,85 @@ def import_inp(file_name, domains_from_config, domain_optimized, shells_as_compo
             except IndexError:
                 en_generated = list(range(int(line_split_comma[0]), int(line_split_comma[1]) + 1))
             domains[current_elset].update(en_generated)
+    close_block()
+
+    nodes = np.concatenate(node_blocks) if node_blocks else np.zeros((0, 4))
+    element_ids = {}
+    element_nodes = {}
+    for category, blocks in element_blocks.items():
+        values = np.concatenate(blocks) if blocks else np.zeros((0, beso_mesh.NODES_PER_ELEMENT[category] + 1),
+                                                                dtype=np.int64)
+        element_ids[category] = values[:, 0]
+        element_nodes[category] = values[:, 1:]
+    mesh = beso_mesh.Mesh(nodes[:, 0].astype(np.int64), nodes[:, 1:], element_ids, element_nodes)
+    return mesh, domains, special_types, sources
+
+
+# function returning the key of the mesh cache computed from content and modification time of the read files
+def inp_cache_key(sources):
+    key = hashlib.sha1()
+    for source in sources:
+        key.update(("%s %d\n" % (source, os.stat(source).st_mtime_ns)).encode())
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                key.update(chunk)
+    return key.hexdigest()
+
+
+# function loading the mesh from the inp file or from its cache file saved next to it by the previous run
+def load_inp_mesh(file_name):
+    cache_file = file_name[:-4] + "_mesh_cache.npz"
+    try:
+        with np.load(cache_file) as cache:
+            sources = cache["sources"].tolist()
+            if str(cache["key"]) == inp_cache_key(sources):
+                mesh = beso_mesh.Mesh.__new__(beso_mesh.Mesh)
+                mesh.node_ids = cache["node_ids"]
+                mesh.coordinates = cache["coordinates"]
+                mesh.element_ids = {}
+                mesh.connectivity = {}
+                mesh._element_order = {}
+                for category in beso_mesh.ELEMENT_CATEGORIES:
+                    mesh._set_category(category, cache["ids_" + category], cache["connectivity_" + category])
+                domains = {}
+                for dn, elset in zip(cache["elset_names"].tolist(), np.split(cache["elset_members"],
+                                                                              cache["elset_offsets"])):
+                    domains[dn] = set(elset.tolist())
+                special_types = {special_type: set(cache["special_" + special_type.replace(" ", "_")].tolist())
+                                 for special_type in ["plane strain", "plane stress", "axisymmetry"]}
+                return mesh, domains, special_types
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+
+    mesh, domains, special_types, sources = read_inp_mesh(file_name)
+    arrays = {"key": inp_cache_key(sources), "sources": np.array(sources), "node_ids": mesh.node_ids,
+              "coordinates": mesh.coordinates,
+              "elset_names": np.array(list(domains.keys()), dtype=str),
+              "elset_members": np.array([en for elset in domains.values() for en in elset], dtype=np.int64),
+              "elset_offsets": np.cumsum([len(elset) for elset in domains.values()][:-1], dtype=np.int64)}
+    for category in beso_mesh.ELEMENT_CATEGORIES:
+        arrays["ids_" + category] = mesh.element_ids[category]
+        arrays["connectivity_" + category] = mesh.connectivity[category]
+    for special_type, en_set in special_types.items():
+        arrays["special_" + special_type.replace(" ", "_")] = np.array(sorted(en_set), dtype=np.int64)
+    try:
+        with open(cache_file, "wb") as f:
+            np.savez(f, **arrays)
+    except (IOError, OSError):
+        pass  # the cache is only an acceleration
+    return mesh, domains, special_types
 
-        elif line[:5].upper() == "*STEP":
-            model_definition = False
-    f.close()
+
+# function importing a mesh consisting of nodes, volume and shell elements
+def import_inp(file_name, domains_from_config, domain_optimized, shells_as_composite):
+    if not os.path.isfile(file_name):
+        msg = ("CalculiX input file " + file_name + " not found. Check your inputs.")
+        write_to_log(file_name, "\nERROR: " + msg + "\n")
+        raise Exception(msg)
+    mesh, domains, special_types = load_inp_mesh(file_name)
+    plane_strain = special_types["plane strain"]
+    plane_stress = special_types["plane stress"]
+    axisymmetry = special_types["axisymmetry"]
 
     for dn in domains:
         domains[dn] = list(domains[dn])
@@ -268,49 +322,19 @@ def import_inp(file_name, domains_from_config, domain_optimized, shells_as_compo
     msg = ("domains: %.f\n" % len(domains_from_config))
 
     if all_available:  # domain called all_available will contain rest of the elements
-        en_all2 = set()
-        en_all2 = en_all2.union(all_elements.tria3.keys(), all_elements.tria6.keys(), all_elements.quad4.keys(), all_elements.quad8.keys(),
-                                all_elements.tetra4.keys(), all_elements.tetra10.keys(), all_elements.hexa8.keys(), all_elements.hexa20.keys(),
-                                all_elements.penta6.keys(), all_elements.penta15.keys())
-
-        domain_elements = all_elements
+        en_all2 = set(mesh.all_element_ids().tolist())
         domains["all_available"] = en_all2 - set(en_all)
         opt_domains.extend(domains["all_available"])
         en_all = list(en_all2)
     else:
-        domain_elements = Elements()
         # only elements in domains_from_config are stored, the rest is discarded
-        keys = set(en_all).intersection(set(all_elements.tria3.keys()))
-        domain_elements.tria3 = {k: all_elements.tria3[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.tria6.keys()))
-        domain_elements.tria6 = {k: all_elements.tria6[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.quad4.keys()))
-        domain_elements.quad4 = {k: all_elements.quad4[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.quad8.keys()))
-        domain_elements.quad8 = {k: all_elements.quad8[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.tetra4.keys()))
-        domain_elements.tetra4 = {k: all_elements.tetra4[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.tetra10.keys()))
-        domain_elements.tetra10 = {k: all_elements.tetra10[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.hexa8.keys()))
-        domain_elements.hexa8 = {k: all_elements.hexa8[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.hexa20.keys()))
-        domain_elements.hexa20 = {k: all_elements.hexa20[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.penta6.keys()))
-        domain_elements.penta6 = {k: all_elements.penta6[k] for k in keys}
-        keys = set(en_all).intersection(set(all_elements.penta15.keys()))
-        domain_elements.penta15 = {k: all_elements.penta15[k] for k in keys}
-        en_all = list(domain_elements.tria3.keys()) + list(domain_elements.tria6.keys()) + list(domain_elements.quad4.keys()) + \
-            list(domain_elements.quad8.keys()) + list(domain_elements.tetra4.keys()) + list(domain_elements.tetra10.keys()) + \
-            list(domain_elements.hexa8.keys()) + list(domain_elements.hexa20.keys()) + list(domain_elements.penta6.keys()) + \
-            list(domain_elements.penta15.keys())
+        mesh = mesh.subset(en_all)
+        en_all = mesh.all_element_ids().tolist()
 
     msg += ("nodes  : %.f\nTRIA3  : %.f\nTRIA6  : %.f\nQUAD4  : %.f\nQUAD8  : %.f\nTETRA4 : %.f\nTETRA10: %.f\n"
             "HEXA8  : %.f\nHEXA20 : %.f\nPENTA6 : %.f\nPENTA15: %.f\n"
-            % (len(nodes), len(domain_elements.tria3), len(domain_elements.tria6), len(domain_elements.quad4), len(domain_elements.quad8),
-               len(domain_elements.tetra4), len(domain_elements.tetra10), len(
-                domain_elements.hexa8), len(domain_elements.hexa20),
-               len(domain_elements.penta6), len(domain_elements.penta15)))
+            % ((len(mesh.node_ids),) + tuple(len(mesh.element_ids[category])
+                                             for category in beso_mesh.ELEMENT_CATEGORIES)))
     print(msg)
     write_to_log(file_name, msg)
 
@@ -320,42 +344,22 @@ def import_inp(file_name, domains_from_config, domain_optimized, shells_as_compo
         write_to_log(file_name, msg)
         assert False, row
 
-    return nodes, domain_elements, domains, opt_domains, en_all, plane_strain, plane_stress, axisymmetry
+    return mesh.nodes, mesh.elements, domains, opt_domains, en_all, plane_strain, plane_stress, axisymmetry
+
+
+# decomposition of elements to triangles (shells) or tetrahedrons (volumes) given by positions in the element node
+# list, mid-nodes of 2nd order elements are not used
+ELEMENT_SUBDIVISION = {"tria": [[0, 1, 2]],
+                       "quad": [[0, 1, 2], [0, 2, 3]],
+                       "tetra": [[0, 1, 2, 3]],
+                       "hexa": [[0, 1, 2, 5], [0, 2, 4, 5], [2, 4, 5, 6], [0, 2, 3, 4], [3, 4, 6, 7], [2, 3, 4, 6]],
+                       "penta": [[0, 1, 2, 3], [1, 2, 3, 4], [2, 3, 4, 5]]}
 
 
 # function for computing volumes or area (shell elements) and centres of gravity
 # approximate for 2nd order elements!
 def elm_volume_cg(file_name, nodes, Elements):
-    u = [0.0, 0.0, 0.0]
-    v = [0.0, 0.0, 0.0]
-    w = [0.0, 0.0, 0.0]
-
-    def tria_area_cg(nod):
-        # compute volume
-        for i in [0, 1, 2]:  # denote x, y, z directions
-            u[i] = nodes[nod[2]][i] - nodes[nod[1]][i]
-            v[i] = nodes[nod[0]][i] - nodes[nod[1]][i]
-        area_tria = np.linalg.norm(np.cross(u, v)) / 2.0
-        # compute centre of gravity
-        x_cg = (nodes[nod[0]][0] + nodes[nod[1]][0] + nodes[nod[2]][0]) / 3.0
-        y_cg = (nodes[nod[0]][1] + nodes[nod[1]][1] + nodes[nod[2]][1]) / 3.0
-        z_cg = (nodes[nod[0]][2] + nodes[nod[1]][2] + nodes[nod[2]][2]) / 3.0
-        cg_tria = [x_cg, y_cg, z_cg]
-        return area_tria, cg_tria
-
-    def tetra_volume_cg(nod):
-        # compute volume
-        for i in [0, 1, 2]:  # denote x, y, z directions
-            u[i] = nodes[nod[2]][i] - nodes[nod[1]][i]
-            v[i] = nodes[nod[3]][i] - nodes[nod[1]][i]
-            w[i] = nodes[nod[0]][i] - nodes[nod[1]][i]
-            volume_tetra = abs(np.dot(np.cross(u, v), w)) / 6.0
-        # compute centre of gravity
-        x_cg = (nodes[nod[0]][0] + nodes[nod[1]][0] + nodes[nod[2]][0] + nodes[nod[3]][0]) / 4.0
-        y_cg = (nodes[nod[0]][1] + nodes[nod[1]][1] + nodes[nod[2]][1] + nodes[nod[3]][1]) / 4.0
-        z_cg = (nodes[nod[0]][2] + nodes[nod[1]][2] + nodes[nod[2]][2] + nodes[nod[3]][2]) / 4.0
-        cg_tetra = [x_cg, y_cg, z_cg]
-        return volume_tetra, cg_tetra
+    mesh = beso_mesh.as_mesh(nodes, Elements)
 
     def second_order_info(elm_type):
         msg = "\nINFO: areas and centres of gravity of " + elm_type.upper() + " elements ignore mid-nodes' positions\n"
@@ -366,288 +370,402 @@ def elm_volume_cg(file_name, nodes, Elements):
     volume_elm = {}
     area_elm = {}
     cg = {}
+    cg_min = np.full(3, np.inf)
+    cg_max = np.full(3, -np.inf)
+
+    for category in beso_mesh.ELEMENT_CATEGORIES:
+        if not len(mesh.element_ids[category]):
+            continue
+        if category in ["tria6", "quad8", "tetra10", "hexa20", "penta15"]:
+            second_order_info(category)
+        # coordinates of sub-elements, shape (number of elements, number of sub-elements, nodes of sub-element, 3)
+        position = mesh.coordinates[mesh.connectivity[category][:, ELEMENT_SUBDIVISION[category.rstrip("0123456789")]]]
+        u = position[:, :, 2] - position[:, :, 1]
+        if category in beso_mesh.SHELL_CATEGORIES:
+            v = position[:, :, 0] - position[:, :, 1]
+            size = np.linalg.norm(np.cross(u, v), axis=2) / 2.0
+        else:
+            v = position[:, :, 3] - position[:, :, 1]
+            w = position[:, :, 0] - position[:, :, 1]
+            size = abs(np.einsum("ijk,ijk->ij", np.cross(u, v), w)) / 6.0
+        size_sum = size.sum(axis=1)
+        if size.shape[1] == 1:
+            cg_category = position[:, 0].mean(axis=1)
+        else:  # cg of sub-elements weighted by their size
+            cg_category = (size[:, :, None] * position.mean(axis=2)).sum(axis=1) / size_sum[:, None]
+
+        en_category = mesh.element_ids[category].tolist()
+        if category in beso_mesh.SHELL_CATEGORIES:
+            area_elm.update(zip(en_category, size_sum.tolist()))
+        else:
+            volume_elm.update(zip(en_category, size_sum.tolist()))
+        cg.update(zip(en_category, cg_category.tolist()))
+        # finding the minimum and maximum cg position
+        cg_min = np.minimum(cg_min, cg_category.min(axis=0))
+        cg_max = np.maximum(cg_max, cg_category.max(axis=0))
+
+    return cg, cg_min.tolist(), cg_max.tolist(), volume_elm, area_elm
+
+
+# function returning the text of ELSET with 9 element numbers per line
+def elset_text(name, en_list):
+    en_list = [str(en) for en in en_list]
+    full = len(en_list) - len(en_list) % 9
+    lines = ["*ELSET,ELSET=" + name + "\n"]
+    lines += [", ".join(en_list[k:k + 9]) + ",\n" for k in range(0, full, 9)]
+    if full < len(en_list):
+        lines.append(", ".join(en_list[full:]) + ", ")
+    lines.append("\n")
+    return "".join(lines)
+
+
+# function returning output requests replacing the original ones (element stresses, energies etc. in .dat file)
+def output_requests(domains_from_config, reference_points, optimization_base, displacement_graph, domain_FI_filled):
+    text = [" \n"]
+    if optimization_base in ["stiffness", "buckling"]:
+        for dn in domains_from_config:
+            text.append("*EL PRINT, " + "ELSET=" + dn + "\n")
+            text.append("ENER\n")
+    if optimization_base == "heat":
+        for dn in domains_from_config:
+            text.append("*EL PRINT, " + "ELSET=" + dn + ", FREQUENCY=1000" + "\n")
+            text.append("HFL\n")
+    if (reference_points == "integration points") and (domain_FI_filled is True):
+        for dn in domains_from_config:
+            text.append("*EL PRINT, " + "ELSET=" + dn + "\n")
+            text.append("S\n")
+    elif reference_points == "nodes":
+        text.append("*EL FILE, GLOBAL=NO\n")
+        text.append("S\n")
+    if displacement_graph:
+        ns_written = []
+        for [ns, component] in displacement_graph:
+            if ns not in ns_written:
+                ns_written.append(ns)
+                text.append("*NODE PRINT, NSET=" + ns + "\n")
+                text.append("U\n")
+    text.append(" \n")
+    return "".join(text)
+
+
+# function splitting the input file to parts which are the same in all iterations
+# returns texts of lines before the added ELSETs, lines before the first *STEP and the rest, original output requests
+# are replaced by requests_text and commented out unless keep_outputs is True
+# *INCLUDE files are written in place of their cards, CalculiX runs in another directory than the input file
+def split_inp(file_name, requests_text, keep_outputs):
+    parts = [[], [], []]
+    part = parts[0]
+    elsets_done = False
+    sections_done = False
+    outputs_done = 1
+    commenting = False
+    for line in inp_lines(file_name, []):
+        if line[0] == "*":
+            commenting = False
+        if (line[:6].upper() == "*ELSET" or line[:5].upper() == "*STEP") and elsets_done is False:
+            elsets_done = True
+            part = parts[1]
+        if line[:5].upper() == "*STEP":
+            if sections_done is False:
+                sections_done = True
+                part = parts[2]
+            outputs_done -= 1
+        if line[0:10].upper() == "*NODE FILE" or line[0:8].upper() == "*EL FILE" or \
+                line[0:13].upper() == "*CONTACT FILE" or line[0:11].upper() == "*NODE PRINT" or \
+                line[0:9].upper() == "*EL PRINT" or line[0:14].upper() == "*CONTACT PRINT":
+            if outputs_done < 1:
+                part.append(requests_text)
+                outputs_done += 1
+            commenting = True
+            if not keep_outputs:
+                continue
+        elif commenting is True and not keep_outputs:
+            continue
+        part.append(line)
+    return ["".join(part) for part in parts], elsets_done, sections_done
+
+
+# parts of input files already written by this process {key: (file names, elsets_done, sections_done)}
+static_inp_parts = {}
+# files read for input files {(file name, size, modification time): file name and included files}
+inp_sources = {}
+
+
+# function returning the input file and its included files, included files are searched once for each file version
+def input_sources(file_name):
+    stat = os.stat(file_name)
+    version = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+    if version not in inp_sources:
+        sources = []
+        for _ in inp_lines(file_name, sources):
+            pass
+        inp_sources[version] = [os.path.abspath(source) for source in sources]
+    return inp_sources[version]
+
+
+# function writing parts of the input file, which do not change during the optimization, to include files in the
+# directory path, files are written once for the given input file and output settings
+def write_static_inp(file_name, path, requests_text, keep_outputs, all_available_text):
+    # changes of included files change the key too
+    versions = [(source, os.stat(source).st_size, os.stat(source).st_mtime_ns) for source in input_sources(file_name)]
+    key = hashlib.sha1(repr((versions, requests_text, keep_outputs, all_available_text)).encode()).hexdigest()[:16]
+    if key in static_inp_parts and all(os.path.isfile(os.path.join(path, f)) for f in static_inp_parts[key][0] if f):
+        return static_inp_parts[key]
+    texts, elsets_done, sections_done = split_inp(file_name, requests_text, keep_outputs)
+    # all available elements are added after the ELSETs of states
+    texts[1] = all_available_text + texts[1]
+    names = []
+    for part, text in zip(("mesh", "model", "steps"), texts):
+        if text:
+            name = "static_" + key + "_" + part + ".inp"
+            temporary = os.path.join(path, name + "." + str(os.getpid()) + ".tmp")
+            with open(temporary, "w", newline="\n") as f:
+                f.write(text)
+            os.replace(temporary, os.path.join(path, name))
+            names.append(name)
+        else:
+            names.append("")
+    static_inp_parts[key] = (names, elsets_done, sections_done)
+    return static_inp_parts[key]
 
-    for en, nod in Elements.tria3.items():
-        [area_elm[en], cg[en]] = tria_area_cg(nod)
-
-    if Elements.tria6:
-        second_order_info("tria6")
-    for en, nod in Elements.tria6.items():  # copy from tria3
-        [area_elm[en], cg[en]] = tria_area_cg(nod)
-
-    for en, nod in Elements.quad4.items():
-        [a1, cg1] = tria_area_cg(nod[0:3])
-        [a2, cg2] = tria_area_cg(nod[0:1] + nod[2:4])
-        area_elm[en] = float(a1 + a2)
-        cg[en] = [[], [], []]
-        for k in [0, 1, 2]:  # denote x, y, z dimensions
-            cg[en][k] = (a1 * cg1[k] + a2 * cg2[k]) / area_elm[en]
-
-    if Elements.quad8:
-        second_order_info("quad8")
-    for en, nod in Elements.quad8.items():  # copy from quad4
-        [a1, cg1] = tria_area_cg(nod[0:3])
-        [a2, cg2] = tria_area_cg(nod[0:1] + nod[2:4])
-        area_elm[en] = float(a1 + a2)
-        cg[en] = [[], [], []]
-        for k in [0, 1, 2]:  # denote x, y, z dimensions
-            cg[en][k] = (a1 * cg1[k] + a2 * cg2[k]) / area_elm[en]
-
-    for en, nod in Elements.tetra4.items():
-        [volume_elm[en], cg[en]] = tetra_volume_cg(nod)
-
-    if Elements.tetra10:
-        second_order_info("tetra10")
-    for en, nod in Elements.tetra10.items():  # copy from tetra4
-        [volume_elm[en], cg[en]] = tetra_volume_cg(nod)
-
-    for en, nod in Elements.hexa8.items():
-        [v1, cg1] = tetra_volume_cg(nod[0:3] + nod[5:6])
-        [v2, cg2] = tetra_volume_cg(nod[0:1] + nod[2:3] + nod[4:6])
-        [v3, cg3] = tetra_volume_cg(nod[2:3] + nod[4:7])
-        [v4, cg4] = tetra_volume_cg(nod[0:1] + nod[2:5])
-        [v5, cg5] = tetra_volume_cg(nod[3:5] + nod[6:8])
-        [v6, cg6] = tetra_volume_cg(nod[2:5] + nod[6:7])
-        volume_elm[en] = float(v1 + v2 + v3 + v4 + v5 + v6)
-        cg[en] = [[], [], []]
-        for k in [0, 1, 2]:  # denote x, y, z dimensions
-            cg[en][k] = (v1 * cg1[k] + v2 * cg2[k] + v3 * cg3[k] + v4 * cg4[k] + v5 * cg5[k] + v6 * cg6[k]
-                         ) / volume_elm[en]
-
-    if Elements.hexa20:
-        second_order_info("hexa20")
-    for en, nod in Elements.hexa20.items():  # copy from hexa8
-        [v1, cg1] = tetra_volume_cg(nod[0:3] + nod[5:6])
-        [v2, cg2] = tetra_volume_cg(nod[0:1] + nod[2:3] + nod[4:6])
-        [v3, cg3] = tetra_volume_cg(nod[2:3] + nod[4:7])
-        [v4, cg4] = tetra_volume_cg(nod[0:1] + nod[2:5])
-        [v5, cg5] = tetra_volume_cg(nod[3:5] + nod[6:8])
-        [v6, cg6] = tetra_volume_cg(nod[2:5] + nod[6:7])
-        volume_elm[en] = float(v1 + v2 + v3 + v4 + v5 + v6)
-        cg[en] = [[], [], []]
-        for k in [0, 1, 2]:  # denote x, y, z dimensions
-            cg[en][k] = (v1 * cg1[k] + v2 * cg2[k] + v3 * cg3[k] + v4 * cg4[k] + v5 * cg5[k] + v6 * cg6[k]
-                         ) / volume_elm[en]
-
-    for en, nod in Elements.penta6.items():
-        [v1, cg1] = tetra_volume_cg(nod[0:4])
-        [v2, cg2] = tetra_volume_cg(nod[1:5])
-        [v3, cg3] = tetra_volume_cg(nod[2:6])
-        volume_elm[en] = float(v1 + v2 + v3)
-        cg[en] = [[], [], []]
-        for k in [0, 1, 2]:  # denote x, y, z dimensions
-            cg[en][k] = (v1 * cg1[k] + v2 * cg2[k] + v3 * cg3[k]) / volume_elm[en]
-
-    if Elements.penta15:
-        second_order_info("penta15")  # copy from penta6
-    for en, nod in Elements.penta15.items():
-        [v1, cg1] = tetra_volume_cg(nod[0:4])
-        [v2, cg2] = tetra_volume_cg(nod[1:5])
-        [v3, cg3] = tetra_volume_cg(nod[2:6])
-        volume_elm[en] = float(v1 + v2 + v3)
-        cg[en] = [[], [], []]
-        for k in [0, 1, 2]:  # denote x, y, z dimensions
-            cg[en][k] = (v1 * cg1[k] + v2 * cg2[k] + v3 * cg3[k]) / volume_elm[en]
-
-    # finding the minimum and maximum cg position
-    x_cg = []
-    y_cg = []
-    z_cg = []
-    for xyz in cg.values():
-        x_cg.append(xyz[0])
-        y_cg.append(xyz[1])
-        z_cg.append(xyz[2])
-    cg_min = [min(x_cg), min(y_cg), min(z_cg)]
-    cg_max = [max(x_cg), max(y_cg), max(z_cg)]
-
-    return cg, cg_min, cg_max, volume_elm, area_elm
-
-
-# function for copying .inp file with additional elsets, materials, solid and shell sections, different output request
+
+# function for writing .inp file with additional elsets, materials, solid and shell sections, different output request
 # elm_states is a dict of the elements containing 0 for void element or 1 for full element
+# mesh, boundary conditions and steps are written only once to include files next to file_nameW, the written file
+# includes them and contains only ELSETs of states with their materials and sections, CalculiX has to be run with
+# the working directory of file_nameW to find the include files
 def write_inp(file_name, file_nameW, elm_states, number_of_states, domains, domains_from_config, domain_optimized,
               domain_thickness, domain_offset, domain_orientation, domain_material, domain_volumes, domain_shells,
               plane_strain, plane_stress, axisymmetry, save_iteration_results, i, reference_points, shells_as_composite,
               optimization_base, displacement_graph, domain_FI_filled):
     if reference_points == "nodes":
-        fR = open(file_name[:-4] + "_separated.inp", "r")
+        file_nameR = file_name[:-4] + "_separated.inp"
     else:
-        fR = open(file_name, "r")
-
-    fW = open(file_nameW + ".inp", "w", newline="\n")
+        file_nameR = file_name
+    keep_outputs = bool(save_iteration_results) and bool(np.mod(float(i - 1), save_iteration_results) == 0)
+    requests_text = output_requests(domains_from_config, reference_points, optimization_base, displacement_graph,
+                                    domain_FI_filled)
+    # all elsets together
+    if "all_available" in domains.keys():
+        all_available_text = " \n" + elset_text("all_available", domains["all_available"])
+    else:
+        all_available_text = ""
+    [[mesh_inp, model_inp, steps_inp], elsets_done, sections_done] = write_static_inp(
+        file_nameR, os.path.dirname(os.path.abspath(file_nameW)), requests_text, keep_outputs, all_available_text)
 
-    # function for writing ELSETs of each state
+    # function to add orientation to solid or shell section
+    def add_orientation():
+        try:
+            fW.append(", ORIENTATION=" + domain_orientation[dn][sn] + "\n")
+        except (KeyError, IndexError):
+            fW.append("\n")
 
-    def write_elset():
-        fW.write(" \n")
-        fW.write("** Added ELSETs by optimization:\n")
+    fW = []
+    if mesh_inp:
+        fW.append("*INCLUDE, INPUT=" + mesh_inp + "\n")
+    # writing ELSETs of each state
+    elsets_used = {}
+    if elsets_done:
+        fW.append(" \n")
+        fW.append("** Added ELSETs by optimization:\n")
         for dn in domains_from_config:
             if domain_optimized[dn] is True:
                 elsets_used[dn] = []
-                elset_new[dn] = {}
+                en_dn = np.array(domains[dn], dtype=np.int64)
+                states = np.fromiter(map(elm_states.__getitem__, en_dn.tolist()), dtype=np.int64, count=len(en_dn))
                 for sn in range(number_of_states):
-                    elset_new[dn][sn] = []
-                    for en in domains[dn]:
-                        if elm_states[en] == sn:
-                            elset_new[dn][elm_states[en]].append(en)
-                for sn, en_list in elset_new[dn].items():
+                    en_list = en_dn[states == sn].tolist()
                     if en_list:
                         elsets_used[dn].append(sn)
-                        fW.write("*ELSET,ELSET=" + dn + str(sn) + "\n")
-                        position = 0
-                        for en in en_list:
-                            if position < 8:
-                                fW.write(str(en) + ", ")
-                                position += 1
-                            else:
-                                fW.write(str(en) + ",\n")
-                                position = 0
-                        fW.write("\n")
-        fW.write(" \n")
-        # all available elsets together
-        if "all_available" in domains.keys():
-            fW.write(" \n")
-            fW.write("*ELSET,ELSET=all_available\n")
-            position = 0
-            for en in domains["all_available"]:
-                if position < 8:
-                    fW.write(str(en) + ", ")
-                    position += 1
-                else:
-                    fW.write(str(en) + ",\n")
-                    position = 0
-            fW.write("\n")
-
-    # function to add orientation to solid or shell section
-    def add_orientation():
-        try:
-            fW.write(", ORIENTATION=" + domain_orientation[dn][sn] + "\n")
-        except (KeyError, IndexError):
-            fW.write("\n")
+                        fW.append(elset_text(dn + str(sn), en_list))
+        fW.append(" \n")
+        if model_inp:
+            fW.append("*INCLUDE, INPUT=" + model_inp + "\n")
 
-    elsets_done = 0
-    sections_done = 0
-    outputs_done = 1
-    commenting = False
-    elset_new = {}
-    elsets_used = {}
+    # optimization materials, solid and shell sections
     msg_error = ""
-    for line in fR:
-        if line[0] == "*":
-            commenting = False
+    if sections_done:
+        fW.append(" \n")
+        fW.append("** Materials and sections in optimized domains\n")
+        fW.append("** (redefines elements properties defined above):\n")
+        for dn in domains_from_config:
+            if domain_optimized[dn]:
+                for sn in elsets_used[dn]:
+                    fW.append("*MATERIAL, NAME=" + dn + str(sn) + "\n")
+                    fW.append(
+                        f'*ELASTIC\n{domain_material[dn][0]:.6}, {domain_material[dn][1]:.6}\n*DENSITY\n{domain_material[dn][2]:.6}\n*CONDUCTIVITY')
+                    fW.append(
+                        f'\n{domain_material[dn][3]:.6}\n*EXPANSION\n{domain_material[dn][4]:.6}\n*SPECIFIC HEAT\\n{domain_material[dn][5]:.6}\n')
+
+                    if domain_volumes[dn]:
+                        fW.append("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
+                        add_orientation()
+                    elif len(plane_strain.intersection(domain_shells[dn])) == len(domain_shells[dn]):
+                        fW.append("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
+                        add_orientation()
+                        fW.append(str(domain_thickness[dn][sn]) + "\n")
+                    elif plane_strain.intersection(domain_shells[dn]):
+                        msg_error = dn + " domain does not contain only plane strain types for 2D elements"
+                    elif len(plane_stress.intersection(domain_shells[dn])) == len(domain_shells[dn]):
+                        fW.append("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
+                        add_orientation()
+                        fW.append(str(domain_thickness[dn][sn]) + "\n")
+                    elif plane_stress.intersection(domain_shells[dn]):
+                        msg_error = dn + " domain does not contain only plane stress types for 2D elements"
+                    elif len(axisymmetry.intersection(domain_shells[dn])) == len(domain_shells[dn]):
+                        fW.append("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
+                        add_orientation()
+                    elif axisymmetry.intersection(domain_shells[dn]):
+                        msg_error = dn + " domain does not contain only axisymmetry types for 2D elements"
+                    elif shells_as_composite is True:
+                        fW.append("*SHELL SECTION, ELSET=" + dn + str(sn) + ", OFFSET=" + str(domain_offset[dn]) +
+                                  ", COMPOSITE")
+                        add_orientation()
+                        # 0.1 + 0.8 + 0.1 of thickness, , material name
+                        fW.append(str(0.1 * domain_thickness[dn][sn]) + ",," + dn + str(sn) + "\n")
+                        fW.append(str(0.8 * domain_thickness[dn][sn]) + ",," + dn + str(sn) + "\n")
+                        fW.append(str(0.1 * domain_thickness[dn][sn]) + ",," + dn + str(sn) + "\n")
+                    else:
+                        fW.append("*SHELL SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn) +
+                                  ", OFFSET=" + str(domain_offset[dn]))
+                        add_orientation()
+                        fW.append(str(domain_thickness[dn][sn]) + "\n")
+                    fW.append(" \n")
+                    if msg_error:
+                        write_to_log(file_name, "\nERROR: " + msg_error + "\n")
+                        raise Exception(msg_error)
+        if steps_inp:
+            fW.append("*INCLUDE, INPUT=" + steps_inp + "\n")
+
+    with open(file_nameW + ".inp", "w", newline="\n") as f:
+        f.write("".join(fW))
+
+
+# variables of user defined failure criteria and displacement components
+STRESS_VARIABLES = ("sxx", "syy", "szz", "sxy", "sxz", "syz", "syx", "szx", "szy")
+DISPLACEMENT_VARIABLES = ("ux", "uy", "uz")
+# functions usable in user defined expressions with their number of arguments (None for any), they work element-wise
+# on arrays
+EXPRESSION_FUNCTIONS = {"sqrt": (np.sqrt, 1), "abs": (np.abs, 1), "fabs": (np.abs, 1), "exp": (np.exp, 1),
+                        "log": (np.log, 1), "log10": (np.log10, 1), "sin": (np.sin, 1), "cos": (np.cos, 1),
+                        "tan": (np.tan, 1), "asin": (np.arcsin, 1), "acos": (np.arccos, 1), "atan": (np.arctan, 1),
+                        "atan2": (np.arctan2, 2), "hypot": (np.hypot, 2), "pow": (np.power, 2),
+                        "max": (lambda *args: functools.reduce(np.maximum, args), None),
+                        "min": (lambda *args: functools.reduce(np.minimum, args), None)}
+EXPRESSION_CONSTANTS = {"pi": np.pi, "e": np.e}
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod,
+                    ast.FloorDiv, ast.UAdd, ast.USub, ast.Call, ast.Name, ast.Load, ast.Constant)
+
+
+# function compiling user defined expression (e.g. failure criterion) to a function of arrays of the given variables
+# expressions are parsed only once, unsupported syntax raises ValueError with the reason
+@functools.lru_cache(maxsize=None)
+def compile_expression(expression, variables):
+    msg = "user defined expression '{}' is not supported: ".format(expression)
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as err:
+        raise ValueError(msg + "syntax error, " + str(err.msg))
+    called = set()  # function names of calls, ast.walk visits calls before their function names
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError(msg + "{} is not allowed, use only numbers, arithmetic operators, variables {}, constants "
+                                   "{} and functions {}".format(type(node).__name__, ", ".join(variables),
+                                                                ", ".join(EXPRESSION_CONSTANTS),
+                                                                ", ".join(EXPRESSION_FUNCTIONS)))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(msg + "constant {!r} is not a number".format(node.value))
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in EXPRESSION_FUNCTIONS:
+                raise ValueError(msg + "only functions {} can be called".format(", ".join(EXPRESSION_FUNCTIONS)))
+            number_of_arguments = EXPRESSION_FUNCTIONS[node.func.id][1]
+            if node.keywords or (number_of_arguments or len(node.args)) != len(node.args) or not node.args:
+                raise ValueError(msg + "function {} takes {} argument(s)".format(node.func.id,
+                                                                                number_of_arguments or "1 or more"))
+            called.add(node.func)
+        elif isinstance(node, ast.Name) and node not in called and node.id not in variables and \
+                node.id not in EXPRESSION_CONSTANTS:
+            raise ValueError(msg + "unknown name '{}', available variables are {}".format(node.id, ", ".join(variables)))
+    code = compile(tree, "<user defined expression>", "eval")
+    names = dict(EXPRESSION_CONSTANTS, __builtins__={})
+    names.update((name, function) for name, (function, number_of_arguments) in EXPRESSION_FUNCTIONS.items())
+
+    def function(**values):
+        return eval(code, names, values)
+    return function
+
+
+# function evaluating compiled expression for arrays of variables, returns an array of the same length
+def evaluate_expression(expression, variables, values):
+    size = len(values[variables[0]])
+    return np.array(np.broadcast_to(np.asarray(compile_expression(expression, variables)(**values), dtype=float), size))
+
+
+# function returning failure indices of the criterion for stress array with columns sxx, syy, szz, sxy, sxz, syz
+# returns None for not recognised criterion
+def failure_index(criterion, stress, file_name):
+    [sxx, syy, szz, sxy, sxz, syz] = stress.T
+    if criterion[0] == "stress_von_Mises":
+        s_allowable = criterion[1]
+        return np.sqrt(0.5 * ((sxx - syy) ** 2 + (syy - szz) ** 2 + (szz - sxx) ** 2 +
+                              6 * (sxy ** 2 + syz ** 2 + sxz ** 2))) / s_allowable
+    elif criterion[0] == "user_def":
+        values = {"sxx": sxx, "syy": syy, "szz": szz, "sxy": sxy, "sxz": sxz, "syz": syz, "syx": sxy, "szx": sxz,
+                  "szy": syz}
+        return evaluate_expression(criterion[1], STRESS_VARIABLES, values)
+    else:
+        msg = "\nError: failure criterion " + str(criterion) + " not recognised.\n"
+        write_to_log(file_name, msg)
 
-        # writing ELSETs
-        if (line[:6].upper() == "*ELSET" and elsets_done == 0) or (line[:5].upper() == "*STEP" and elsets_done == 0):
-            write_elset()
-            elsets_done = 1
-
-        # optimization materials, solid and shell sections
-        if line[:5].upper() == "*STEP" and sections_done == 0:
-            if elsets_done == 0:
-                write_elset()
-                elsets_done = 1
-
-            fW.write(" \n")
-            fW.write("** Materials and sections in optimized domains\n")
-            fW.write("** (redefines elements properties defined above):\n")
-            for dn in domains_from_config:
-                if domain_optimized[dn]:
-                    print(elsets_used)
-                    for sn in elsets_used[dn]:
-                        print(sn)
-
-                        fW.write("*MATERIAL, NAME=" + dn + str(sn) + "\n")
-                        fW.write(
-                            f'*ELASTIC\n{domain_material[dn][0]:.6}, {domain_material[dn][1]:.6}\n*DENSITY\n{domain_material[dn][2]:.6}\n*CONDUCTIVITY')
-                        fW.write(
-                            f'\n{domain_material[dn][3]:.6}\n*EXPANSION\n{domain_material[dn][4]:.6}\n*SPECIFIC HEAT\\n{domain_material[dn][5]:.6}\n')
-
-                        if domain_volumes[dn]:
-                            fW.write("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
-                            add_orientation()
-                        elif len(plane_strain.intersection(domain_shells[dn])) == len(domain_shells[dn]):
-                            fW.write("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
-                            add_orientation()
-                            fW.write(str(domain_thickness[dn][sn]) + "\n")
-                        elif plane_strain.intersection(domain_shells[dn]):
-                            msg_error = dn + " domain does not contain only plane strain types for 2D elements"
-                        elif len(plane_stress.intersection(domain_shells[dn])) == len(domain_shells[dn]):
-                            fW.write("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
-                            add_orientation()
-                            fW.write(str(domain_thickness[dn][sn]) + "\n")
-                        elif plane_stress.intersection(domain_shells[dn]):
-                            msg_error = dn + " domain does not contain only plane stress types for 2D elements"
-                        elif len(axisymmetry.intersection(domain_shells[dn])) == len(domain_shells[dn]):
-                            fW.write("*SOLID SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn))
-                            add_orientation()
-                        elif axisymmetry.intersection(domain_shells[dn]):
-                            msg_error = dn + " domain does not contain only axisymmetry types for 2D elements"
-                        elif shells_as_composite is True:
-                            fW.write("*SHELL SECTION, ELSET=" + dn + str(sn) + ", OFFSET=" + str(domain_offset[dn]) +
-                                     ", COMPOSITE")
-                            add_orientation()
-                            # 0.1 + 0.8 + 0.1 of thickness, , material name
-                            fW.write(str(0.1 * domain_thickness[dn][sn]) + ",," + dn + str(sn) + "\n")
-                            fW.write(str(0.8 * domain_thickness[dn][sn]) + ",," + dn + str(sn) + "\n")
-                            fW.write(str(0.1 * domain_thickness[dn][sn]) + ",," + dn + str(sn) + "\n")
-                        else:
-                            fW.write("*SHELL SECTION, ELSET=" + dn + str(sn) + ", MATERIAL=" + dn + str(sn) +
-                                     ", OFFSET=" + str(domain_offset[dn]))
-                            add_orientation()
-                            fW.write(str(domain_thickness[dn][sn]) + "\n")
-                        fW.write(" \n")
-                        if msg_error:
-                            write_to_log(file_name, "\nERROR: " + msg_error + "\n")
-                            raise Exception(msg_error)
-            sections_done = 1
 
-        if line[:5].upper() == "*STEP":
-            outputs_done -= 1
+# function returning displacement values of the component for displacement array with columns ux, uy, uz
+def displacement_component(component, displacement):
+    [ux, uy, uz] = displacement.T
+    if component.upper() == "TOTAL":  # total displacement
+        return np.sqrt(ux ** 2 + uy ** 2 + uz ** 2)
+    return evaluate_expression(component, DISPLACEMENT_VARIABLES, {"ux": ux, "uy": uy, "uz": uz})
 
-        # output request only for element stresses in .dat file:
-        if line[0:10].upper() == "*NODE FILE" or line[0:8].upper() == "*EL FILE" or \
-                line[0:13].upper() == "*CONTACT FILE" or line[0:11].upper() == "*NODE PRINT" or \
-                line[0:9].upper() == "*EL PRINT" or line[0:14].upper() == "*CONTACT PRINT":
-            if outputs_done < 1:
-                fW.write(" \n")
-                if optimization_base in ["stiffness", "buckling"]:
-                    for dn in domains_from_config:
-                        fW.write("*EL PRINT, " + "ELSET=" + dn + "\n")
-                        fW.write("ENER\n")
-                if optimization_base == "heat":
-                    for dn in domains_from_config:
-                        fW.write("*EL PRINT, " + "ELSET=" + dn + ", FREQUENCY=1000" + "\n")
-                        fW.write("HFL\n")
-                if (reference_points == "integration points") and (domain_FI_filled is True):
-                    for dn in domains_from_config:
-                        fW.write("*EL PRINT, " + "ELSET=" + dn + "\n")
-                        fW.write("S\n")
-                elif reference_points == "nodes":
-                    fW.write("*EL FILE, GLOBAL=NO\n")
-                    fW.write("S\n")
-                if displacement_graph:
-                    ns_written = []
-                    for [ns, component] in displacement_graph:
-                        if ns not in ns_written:
-                            ns_written.append(ns)
-                            fW.write("*NODE PRINT, NSET=" + ns + "\n")
-                            fW.write("U\n")
-                fW.write(" \n")
-                outputs_done += 1
-            commenting = True
-            if not save_iteration_results or np.mod(float(i - 1), save_iteration_results) != 0:
-                continue
-        elif commenting is True:
-            if not save_iteration_results or np.mod(float(i - 1), save_iteration_results) != 0:
-                continue
 
-        fW.write(line)
-    fR.close()
-    fW.close()
+# function returning element numbers of consecutive rows with the same element and positions of their first rows
+def element_runs(en_rows):
+    starts = np.flatnonzero(np.r_[True, en_rows[1:] != en_rows[:-1]])
+    return en_rows[starts], starts
+
+
+# function reducing values of integration points (or nodes) to elements by maximum or average
+# element rows start at positions given by starts
+def reduce_to_elements(values, starts, reference_value):
+    if reference_value == "max":
+        return np.maximum.reduceat(values, starts)
+    elif reference_value == "average":
+        return np.add.reduceat(values, starts) / np.diff(np.append(starts, len(values)))
+
+
+# function computing failure indices of elements from stresses in their points
+# stress rows of element en_block[k] start at starts[k], criteria_elm are numbers of criteria applied to elements
+# returns {en: [FI for each criterion or None if not applied]}
+def element_FI(en_block, starts, stress, criteria, criteria_elm, reference_value, file_name):
+    en_list = en_block.tolist()
+    counts = np.diff(np.append(starts, len(stress)))
+    FI_elm = {en: [None] * len(criteria) for en in en_list}
+    for FIn in range(len(criteria)):
+        elm_mask = np.array([FIn in criteria_elm.get(en, ()) for en in en_list], dtype=bool)
+        if not elm_mask.any():
+            continue
+        # evaluate criterion only in points of elements where it is applied
+        FI_pt = failure_index(criteria[FIn], stress[np.repeat(elm_mask, counts)], file_name)
+        if FI_pt is None:
+            continue
+        elm_starts = np.append(0, np.cumsum(counts[elm_mask])[:-1])
+        FI_reduced = reduce_to_elements(FI_pt, elm_starts, reference_value)
+        for en, FI in zip(en_block[elm_mask].tolist(), FI_reduced.tolist()):
+            FI_elm[en][FIn] = FI
+    return FI_elm
 
 
 # function for importing results from .dat file
 # Failure Indices are computed at each integration point and maximum or average above each element is returned
+# result blocks are read at once to arrays, values are computed for all integration points of the block together
 def import_FI_int_pt(reference_value, file_nameW, domains, criteria, domain_FI, file_name, elm_states,
                      domains_from_config, steps_superposition, displacement_graph):
     try:
@@ -656,19 +774,23 @@ def import_FI_int_pt(reference_value, file_nameW, domains, criteria, domain_FI,
         msg = "CalculiX result file not found, check your inputs"
         write_to_log(file_name, "\nERROR: " + msg + "\n")
         assert False, msg
+    with f:
+        text = f.read()
+    block_end = re.compile(r"\n *(?:\n|\Z)")  # result block ends before the next blank line
+
     last_time = "initial"  # TODO solve how to read a new step which differs in time
     step_number = -1
     criteria_elm = {}  # {en1: numbers of applied criteria, en2: [], ...}
     FI_step = []  # list for steps - [{en1: list for criteria FI, en2: [], ...}, {en1: [], en2: [], ...}, next step]
     energy_density_step = []  # list for steps - [{en1: energy_density, en2: ..., ...}, {en1: ..., ...}, next step]
-    energy_density_eigen = {}  # energy_density_eigen[eigen_number][en_last] = np.average(ener_int_pt)
+    energy_density_eigen = {}  # energy_density_eigen[eigen_number][en] = average energy density of int. points
     heat_flux = {}  # only for the last step
 
     memorized_steps = set()  # steps to use in superposition
     if steps_superposition:
-        # {sn: {en: [sxx, syy, szz, sxy, sxz, syz], next element with int. pt. stresses}, next step, ...}
+        # {sn: {en: array of [sxx, syy, szz, sxy, sxz, syz] for int. pt., next element}, next step, ...}
         step_stress = {}
-        step_ener = {}  # energy density {sn: {en: ener, next element with int. pt. stresses}, next step, ...}
+        step_ener = {}  # energy density {sn: {en: array of int. pt. ener, next element}, next step, ...}
         for LCn in range(len(steps_superposition)):
             for (scale, sn) in steps_superposition[LCn]:
                 sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
@@ -685,28 +807,9 @@ def import_FI_int_pt(reference_value, file_nameW, domains, criteria, domain_FI,
                     cr.append(criteria.index(dn_crit))
                 criteria_elm[en] = cr
 
-    def compute_FI():  # for the actual integration point
-        if en in criteria_elm:
-            for FIn in criteria_elm[en]:
-                if criteria[FIn][0] == "stress_von_Mises":
-                    s_allowable = criteria[FIn][1]
-                    FI_int_pt[FIn].append(np.sqrt(0.5 * ((sxx - syy) ** 2 + (syy - szz) ** 2 + (szz - sxx) ** 2 +
-                                                         6 * (sxy ** 2 + syz ** 2 + sxz ** 2))) / s_allowable)
-                elif criteria[FIn][0] == "user_def":
-                    FI_int_pt[FIn].append(eval(criteria[FIn][1]))
-                else:
-                    msg = "\nError: failure criterion " + str(criteria[FIn]) + " not recognised.\n"
-                    write_to_log(file_name, msg)
-
-    def save_FI(sn, en):
-        FI_step[sn][en] = []
-        for FIn in range(len(criteria)):
-            FI_step[sn][en].append(None)
-            if FIn in criteria_elm[en]:
-                if reference_value == "max":
-                    FI_step[sn][en][FIn] = max(FI_int_pt[FIn])
-                elif reference_value == "average":
-                    FI_step[sn][en][FIn] = np.average(FI_int_pt[FIn])
+    def memorize(step_values, en_block, starts, values):
+        for en, en_values in zip(en_block.tolist(), np.split(values, starts[1:])):
+            step_values[en] = en_values
 
     read_stresses = 0
     read_energy_density = 0
@@ -718,33 +821,19 @@ def import_FI_int_pt(reference_value, file_nameW, domains, criteria, domain_FI,
     read_buckling_factors = 0
     buckling_factors = []
     read_eigenvalues = 0
-    for line in f:
+    pos = 0  # position of the line in the text
+    while pos < len(text):
+        line_end = text.find("\n", pos)
+        if line_end == -1:
+            line_end = len(text)
+        line = text[pos:line_end]
         line_split = line.split()
-        if line.replace(" ", "") == "\n":
-            if read_stresses == 1:
-                save_FI(step_number, en_last)
-            if read_energy_density == 1:
-                if read_eigenvalues:
-                    energy_density_eigen[eigen_number][en_last] = np.average(ener_int_pt)
-                else:
-                    energy_density_step[step_number][en_last] = np.average(ener_int_pt)
-            if read_heat_flux == 1:
-                heat_flux[en_last] = np.average(heat_int_pt)
-            if read_displacement == 1:
-                for cn in ns_reading:
-                    try:
-                        disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
-                    except TypeError:
-                        disp_i[cn] = max(disp_condition[cn])
+        if not line.replace(" ", ""):
             read_stresses -= 1
             read_energy_density -= 1
             read_heat_flux -= 1
             read_displacement -= 1
             read_buckling_factors -= 1
-            FI_int_pt = [[] for _ in range(len(criteria))]
-            ener_int_pt = []
-            heat_int_pt = []
-            en_last = None
 
         elif line[:9] == " stresses":
             if line.split()[-4] in map(lambda x: x.upper(), domains_from_config):  # TODO upper already on user input
@@ -799,179 +888,91 @@ def import_FI_int_pt(reference_value, file_nameW, domains, criteria, domain_FI,
                     energy_density_step.append({})
                     last_time = line_split[-1]
                 ns = line_split[4]
-                disp_components[-1][ns] = []  # appending ns
-
-        elif read_stresses == 1:
-            en = int(line_split[0])
-            if en_last != en:
-                if en_last:
-                    save_FI(step_number, en_last)
-                    FI_int_pt = [[] for _ in range(len(criteria))]
-                en_last = en
-            sxx = float(line_split[2])
-            syy = float(line_split[3])
-            szz = float(line_split[4])
-            sxy = float(line_split[5])
-            sxz = float(line_split[6])
-            syz = float(line_split[7])
-            syx = sxy
-            szx = sxz
-            szy = syz
-            compute_FI()
-            if step_number in memorized_steps:
-                try:
-                    step_stress[step_number][en]
-                except KeyError:
-                    step_stress[step_number][en] = []
-                step_stress[step_number][en].append([sxx, syy, szz, sxy, sxz, syz])
-
-        elif read_energy_density == 1:
-            en = int(line_split[0])
-            if en_last != en:
-                if en_last:
-                    if read_eigenvalues:
-                        energy_density_eigen[eigen_number][en_last] = np.average(ener_int_pt)
-                    else:
-                        energy_density_step[step_number][en_last] = np.average(ener_int_pt)
-                    ener_int_pt = []
-                en_last = en
-            energy_density = float(line_split[2])
-            ener_int_pt.append(energy_density)
-            if step_number in memorized_steps:
-                try:
-                    step_ener[step_number][en]
-                except KeyError:
-                    step_ener[step_number][en] = []
-                    step_ener[step_number][en].append(energy_density)
-
-        elif read_heat_flux == 1:
-            en = int(line_split[0])
-            if en_last != en:
-                if en_last:
-                    heat_flux[en_last] = np.average(heat_int_pt)
-                    heat_int_pt = []
-                en_last = en
-            heat_flux_total = np.sqrt(float(line_split[2]) ** 2 + float(line_split[3]) ** 2 + float(line_split[4]) ** 2)
-            heat_int_pt.append(heat_flux_total)
-
-        elif read_displacement == 1:
-            ux = float(line_split[1])
-            uy = float(line_split[2])
-            uz = float(line_split[3])
-            for cn in ns_reading:
-                component = displacement_graph[cn][1]
-                if component.upper() == "TOTAL":  # total displacement
-                    disp_condition[cn].append(sqrt(ux ** 2 + uy ** 2 + uz ** 2))
+                disp_components[-1][ns] = np.zeros((0, 3))  # appending ns
+
+        elif 1 in [read_stresses, read_energy_density, read_heat_flux, read_displacement]:
+            # data lines of the block up to the next blank line
+            match = block_end.search(text, pos)
+            block_lines = [text[pos:match.start() if match else len(text)]]
+            pos = match.start() + 1 if match else len(text)
+            if read_stresses == 1:
+                values = block_values(block_lines, float, 8)  # en, int. pt., sxx, syy, szz, sxy, sxz, syz
+                en_block, starts = element_runs(values[:, 0].astype(np.int64))
+                stress = values[:, 2:]
+                FI_step[step_number].update(element_FI(en_block, starts, stress, criteria, criteria_elm,
+                                                       reference_value, file_name))
+                if step_number in memorized_steps:
+                    memorize(step_stress[step_number], en_block, starts, stress)
+
+            elif read_energy_density == 1:
+                values = block_values(block_lines, float, 3)  # en, int. pt., energy density
+                en_block, starts = element_runs(values[:, 0].astype(np.int64))
+                energy_density = reduce_to_elements(values[:, 2], starts, "average")
+                if read_eigenvalues:
+                    energy_density_eigen[eigen_number].update(zip(en_block.tolist(), energy_density.tolist()))
                 else:
-                    disp_condition[cn].append(eval(component))
-            if steps_superposition:  # save ux, uy, uz for steps superposition
-                disp_components[step_number][ns].append((ux, uy, uz))
-
-    if read_stresses == 1:
-        save_FI(step_number, en_last)
-    if read_energy_density == 1:
-        if read_eigenvalues:
-            energy_density_eigen[eigen_number][en_last] = np.average(ener_int_pt)
-        else:
-            energy_density_step[step_number][en_last] = np.average(ener_int_pt)
-    if read_heat_flux == 1:
-        heat_flux[en_last] = np.average(heat_int_pt)
-    if read_displacement == 1:
-        for cn in ns_reading:
-            try:
-                disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
-            except TypeError:
-                disp_i[cn] = max(disp_condition[cn])
-    f.close()
+                    energy_density_step[step_number].update(zip(en_block.tolist(), energy_density.tolist()))
+                if step_number in memorized_steps:
+                    memorize(step_ener[step_number], en_block, starts, values[:, 2])
+
+            elif read_heat_flux == 1:
+                values = block_values(block_lines, float, 5)  # en, int. pt., qx, qy, qz
+                en_block, starts = element_runs(values[:, 0].astype(np.int64))
+                heat_flux_total = np.sqrt(values[:, 2] ** 2 + values[:, 3] ** 2 + values[:, 4] ** 2)
+                heat_flux_elm = reduce_to_elements(heat_flux_total, starts, "average")
+                heat_flux.update(zip(en_block.tolist(), heat_flux_elm.tolist()))
+
+            else:  # read_displacement == 1
+                displacement = block_values(block_lines, float, 4)[:, 1:]  # nn, ux, uy, uz
+                for cn in ns_reading:
+                    disp_condition[cn] = displacement_component(displacement_graph[cn][1], displacement).tolist()
+                    try:
+                        disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
+                    except TypeError:
+                        disp_i[cn] = max(disp_condition[cn])
+                if steps_superposition:  # save ux, uy, uz for steps superposition
+                    disp_components[step_number][ns] = displacement
+            continue
+        pos = line_end + 1
 
     # superposed steps
-    # step_stress = {sn: {en: [[sxx, syy, szz, sxy, sxz, syz], next integration point], next element with int. pt. stresses}, next step, ...}
+    # step_stress = {sn: {en: array of [sxx, syy, szz, sxy, sxz, syz] for int. pt., next element}, next step, ...}
     # steps_superposition = [[(sn, scale), next scaled step to add, ...], next superposed step]
     for LCn in range(len(steps_superposition)):
         FI_step.append({})
         energy_density_step.append({})
 
-        # sum scaled stress components at each integration point
+        # sum scaled stress components and energy density at each integration point
         superposition_stress = {}
         superposition_energy_density = {}
         for (scale, sn) in steps_superposition[LCn]:
             sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
-            # with stresses
-            for en in step_stress[sn]:
-                try:
-                    superposition_stress[en]
-                except KeyError:
-                    superposition_stress[en] = []  # list of integration points
-                for ip in range(len(step_stress[sn][en])):
-                    try:
-                        superposition_stress[en][ip]
-                    except IndexError:
-                        superposition_stress[en].append([0, 0, 0, 0, 0, 0])  # components of stress
-                    for component in range(6):
-                        superposition_stress[en][ip][component] += scale * step_stress[sn][en][ip][component]
-            # again with energy density
-            for en in step_ener[sn]:
-                try:
-                    superposition_energy_density[en]
-                except KeyError:
-                    superposition_energy_density[en] = []  # list of integration points
-                for ip in range(len(step_ener[sn][en])):
-                    try:
-                        superposition_energy_density[en][ip]
-                    except IndexError:
-                        superposition_energy_density[en].append(0)  # components of stress
-                    for component in range(6):
-                        superposition_energy_density[en][ip] += scale * step_ener[sn][en][ip]
+            for en, stress in step_stress[sn].items():
+                superposition_stress[en] = superposition_stress.get(en, 0) + scale * stress
+            for en, ener in step_ener[sn].items():
+                superposition_energy_density[en] = superposition_energy_density.get(en, 0) + scale * ener
 
         # compute FI in each element at superposed step
-        for en in superposition_stress:
-            FI_int_pt = [[] for _ in range(len(criteria))]
-            for ip in range(len(superposition_stress[en])):
-                sxx = superposition_stress[en][ip][0]
-                syy = superposition_stress[en][ip][1]
-                szz = superposition_stress[en][ip][2]
-                sxy = superposition_stress[en][ip][3]
-                sxz = superposition_stress[en][ip][4]
-                syz = superposition_stress[en][ip][5]
-                syx = sxy
-                szx = sxz
-                szy = syz
-                compute_FI()  # fill FI_int_pt
-            sn = -1  # last step number
-            save_FI(sn, en)  # save value to FI_step for given en
+        sn = -1  # last step number
+        if superposition_stress:
+            en_block = np.array(list(superposition_stress.keys()), dtype=np.int64)
+            stress = list(superposition_stress.values())
+            starts = np.append(0, np.cumsum([len(en_stress) for en_stress in stress])[:-1])
+            FI_step[sn].update(element_FI(en_block, starts, np.concatenate(stress), criteria, criteria_elm,
+                                          reference_value, file_name))
         # compute average energy density over integration point at superposed step
-        for en in superposition_energy_density:
-            ener_int_pt = []
-            for ip in range(len(superposition_energy_density[en])):
-                ener_int_pt.append(superposition_energy_density[en][ip])
-            sn = -1  # last step number
-            energy_density_step[sn][en] = np.average(ener_int_pt)
+        for en, ener in superposition_energy_density.items():
+            energy_density_step[sn][en] = float(np.average(ener))
 
         # superposition of displacements to graph, same code block as in import_displacement function
         cn = 0
         for (ns, component) in displacement_graph:
             ns = ns.upper()
-            uxe = []
-            uye = []
-            uze = []
-            for en2 in range(len(disp_components[0][ns])):
-                uxe.append(0)
-                uye.append(0)
-                uze.append(0)
-                for (scale, sn) in steps_superposition[LCn]:
-                    sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
-                    uxe[-1] += scale * disp_components[sn][ns][en2][0]
-                    uye[-1] += scale * disp_components[sn][ns][en2][1]
-                    uze[-1] += scale * disp_components[sn][ns][en2][2]
-
-            for en2 in range(len(uxe)):  # iterate over elements in nset
-                ux = uxe.pop()
-                uy = uye.pop()
-                uz = uze.pop()
-                if component.upper() == "TOTAL":  # total displacement
-                    disp_condition[cn].append(sqrt(ux ** 2 + uy ** 2 + uz ** 2))
-                else:
-                    disp_condition[cn].append(eval(component))
+            displacement = np.zeros(disp_components[0][ns].shape)
+            for (scale, sn) in steps_superposition[LCn]:
+                sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
+                displacement += scale * disp_components[sn][ns]
+            disp_condition[cn] += displacement_component(component, displacement).tolist()
             try:
                 disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
             except TypeError:
@@ -982,89 +983,43 @@ def import_FI_int_pt(reference_value, file_nameW, domains, criteria, domain_FI,
 
 
 # function for importing displacements if import_FI_int_pt is not called to read .dat file
+# displacement blocks are read at once to arrays
 def import_displacement(file_nameW, displacement_graph, steps_superposition):
-    f = open(os.path.join(file_nameW + ".dat"), "r")
-    read_displacement = 0
+    with open(os.path.join(file_nameW + ".dat"), "r") as f:
+        text = f.read()
     disp_i = [None for _ in range(len(displacement_graph))]
     disp_condition = {}
-    disp_components = []
+    disp_components = []  # [{ns: array of [ux, uy, uz] for nodes, next nset}, next step]
     last_time = "initial"
-    step_number = -1
-    for line in f:
-        line_split = line.split()
-        if line.replace(" ", "") == "\n":
-            if read_displacement == 1:
-                for cn in ns_reading:
-                    try:
-                        disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
-                    except TypeError:
-                        disp_i[cn] = max(disp_condition[cn])
-            read_displacement -= 1
-
-        elif line[:14] == " displacements":
-            cn = 0
-            ns_reading = []
-            for [ns, component] in displacement_graph:
-                if ns.upper() == line_split[4]:
-                    ns_reading.append(cn)
-                    disp_condition[cn] = []
-                cn += 1
-            read_displacement = 2
-            if steps_superposition:
-                if last_time != line_split[-1]:
-                    step_number += 1
-                    disp_components.append({})  # appending sn
-                    last_time = line_split[-1]
-                ns = line_split[4]
-                disp_components[-1][ns] = []  # appending ns
-
-        elif read_displacement == 1:
-            ux = float(line_split[1])
-            uy = float(line_split[2])
-            uz = float(line_split[3])
-            for cn in ns_reading:
-                component = displacement_graph[cn][1]
-                if component.upper() == "TOTAL":  # total displacement
-                    disp_condition[cn].append(sqrt(ux ** 2 + uy ** 2 + uz ** 2))
-                else:
-                    disp_condition[cn].append(eval(component))
-            if steps_superposition:  # save ux, uy, uz for steps superposition
-                disp_components[step_number][ns].append((ux, uy, uz))
-
-    if read_displacement == 1:
-        for cn in ns_reading:
-            try:
-                disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
-            except TypeError:
-                disp_i[cn] = max(disp_condition[cn])
-    f.close()
+    # header line, blank line and data lines up to the next blank line
+    displacement_blocks = re.compile(r"^( displacements[^\n]*)\n *\n(.*?)(?=\n *\n|\n?\Z)", re.M | re.S)
+    for match in displacement_blocks.finditer(text):
+        line_split = match.group(1).split()
+        ns = line_split[4]
+        displacement = block_values([match.group(2)], float, 4)[:, 1:]  # nn, ux, uy, uz
+        for cn, (ns_graph, component) in enumerate(displacement_graph):
+            if ns_graph.upper() == ns:
+                disp_condition[cn] = displacement_component(component, displacement).tolist()
+                try:
+                    disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
+                except TypeError:
+                    disp_i[cn] = max(disp_condition[cn])
+        if steps_superposition:  # save ux, uy, uz for steps superposition
+            if last_time != line_split[-1]:
+                disp_components.append({})  # appending sn
+                last_time = line_split[-1]
+            disp_components[-1][ns] = displacement
 
     # superposition of displacements to graph, same code block as in import_FI_int_pt function
     for LCn in range(len(steps_superposition)):  # steps superposition
         cn = 0
         for (ns, component) in displacement_graph:
             ns = ns.upper()
-            uxe = []
-            uye = []
-            uze = []
-            for en2 in range(len(disp_components[0][ns])):
-                uxe.append(0)
-                uye.append(0)
-                uze.append(0)
-                for (scale, sn) in steps_superposition[LCn]:
-                    sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
-                    uxe[-1] += scale * disp_components[sn][ns][en2][0]
-                    uye[-1] += scale * disp_components[sn][ns][en2][1]
-                    uze[-1] += scale * disp_components[sn][ns][en2][2]
-
-            for en2 in range(len(uxe)):  # iterate over elements in nset
-                ux = uxe.pop()
-                uy = uye.pop()
-                uz = uze.pop()
-                if component.upper() == "TOTAL":  # total displacement
-                    disp_condition[cn].append(sqrt(ux ** 2 + uy ** 2 + uz ** 2))
-                else:
-                    disp_condition[cn].append(eval(component))
+            displacement = np.zeros(disp_components[0][ns].shape)
+            for (scale, sn) in steps_superposition[LCn]:
+                sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
+                displacement += scale * disp_components[sn][ns]
+            disp_condition[cn] += displacement_component(component, displacement).tolist()
             try:
                 disp_i[cn] = max([disp_i[cn]] + disp_condition[cn])
             except TypeError:
@@ -1073,28 +1028,153 @@ def import_displacement(file_nameW, displacement_graph, steps_superposition):
     return disp_i
 
 
+# frd element type numbers with their number of nodes
+FRD_ELEMENT_NODES = {1: 8, 2: 6, 3: 4, 4: 20, 5: 15, 6: 10, 7: 3, 8: 6, 9: 4, 10: 8, 11: 2, 12: 3}
+
+
+# function returning node numbers and values of ASCII records " -1 nn value value ..." of a nodal result block
+# fields have fixed width, thus records of equal length are decoded at once without splitting lines
+def frd_ascii_values(block, id_width):
+    first_line = block[:block.find(b"\n") + 1]
+    number_of_values = (len(first_line.rstrip(b"\r\n")) - 3 - id_width) // 12
+    record = np.dtype([("key", "S3"), ("node", "S{}".format(id_width)), ("values", "S12", (number_of_values,)),
+                       ("end", "S{}".format(len(first_line) - 3 - id_width - 12 * number_of_values))])
+    if len(block) % record.itemsize == 0:
+        records = np.frombuffer(block, dtype=record)
+        if np.all(records["key"] == b" -1"):
+            return records["node"].astype(np.int64), records["values"].astype(float)
+    # records of different length, e.g. continuation lines " -2"
+    lines = [line for line in block.splitlines() if line[:3] == b" -1"]
+    node_ids = np.array([line[3:3 + id_width] for line in lines]).astype(np.int64)
+    values = np.array([[line[k:k + 12] for k in range(3 + id_width, 3 + id_width + 12 * number_of_values, 12)]
+                       for line in lines]).astype(float)
+    return node_ids, values
+
+
+# function reading the element block of the frd file in ASCII format, returns element numbers, element types and node
+# numbers of all elements one after another
+def frd_ascii_elements(block, id_width):
+    if id_width == 10:  # long format, all numbers are separated by spaces
+        numbers = np.array(block.split(), dtype=np.int64)
+    else:  # short format, numbers of 5 digits may touch each other
+        numbers = []
+        for line in block.splitlines():
+            numbers.append(int(line[:3]))
+            if line[:3] == b" -1":
+                numbers += [int(line[3:8]), int(line[8:13]), int(line[13:18]), int(line[18:23])]
+            else:
+                numbers += [int(line[k:k + 5]) for k in range(3, len(line.rstrip()), 5)]
+        numbers = np.array(numbers, dtype=np.int64)
+    # element records are -1 en type group material, followed by lines -2 nn nn ...
+    record_starts = np.flatnonzero(numbers == -1)
+    node_mask = numbers >= 0
+    for k in range(5):
+        node_mask[record_starts + k] = False
+    return numbers[record_starts + 1], numbers[record_starts + 2], numbers[node_mask]
+
+
+# function reading nodal results and elements from the frd file
+# returns element numbers, element nodes in CSR form (elm_indptr, elm_nodes) and list of (result name, node numbers,
+# values) for blocks with names in result_names
+# ASCII blocks are decoded in bulk by fixed width fields, binary blocks (format 2) are read as records of
+# node int32 + 3 float64 coordinates, element int32 en, type, group, material + int32 nodes, and float32 nodal values
+# in the order of nodes of the node block
+def read_frd(file_nameW, result_names):
+    with open(os.path.join(file_nameW + ".frd"), "rb") as f:
+        data = f.read()
+    node_ids = np.zeros(0, dtype=np.int64)
+    en = np.zeros(0, dtype=np.int64)
+    elm_types = np.zeros(0, dtype=np.int64)
+    elm_nodes = np.zeros(0, dtype=np.int64)
+    results = []
+
+    def block_end(pos):  # position after the ASCII block, before the line " -3"
+        end = data.find(b"\n -3", pos - 1)
+        return len(data) if end == -1 else end + 1
+
+    pos = 0
+    while pos < len(data):
+        line_end = data.find(b"\n", pos)
+        if line_end == -1:
+            line_end = len(data)
+        line = data[pos:line_end]
+        pos = line_end + 1
+        if line[:6] in [b"    2C", b"    3C"]:
+            line_split = line.split()
+            number = int(line_split[1])
+            frd_format = int(line_split[-1])
+            if line[:6] == b"    2C" and frd_format == 2:
+                records = np.frombuffer(data, dtype=[("node", "<i4"), ("xyz", "<f8", (3,))], count=number, offset=pos)
+                node_ids = records["node"].astype(np.int64)
+                pos += records.nbytes
+            elif line[:6] == b"    2C":  # ASCII results have their node numbers, coordinates are not needed
+                pos = block_end(pos)
+            elif frd_format == 2:
+                en = []
+                elm_types = []
+                elm_nodes = []
+                for _ in range(number):
+                    [en_k, type_k] = np.frombuffer(data, dtype="<i4", count=4, offset=pos)[:2].tolist()
+                    pos += 16
+                    elm_nodes.append(np.frombuffer(data, dtype="<i4", count=FRD_ELEMENT_NODES[type_k], offset=pos))
+                    pos += 4 * FRD_ELEMENT_NODES[type_k]
+                    en.append(en_k)
+                    elm_types.append(type_k)
+                en = np.array(en, dtype=np.int64)
+                elm_types = np.array(elm_types, dtype=np.int64)
+                elm_nodes = np.concatenate(elm_nodes).astype(np.int64) if elm_nodes else np.zeros(0, dtype=np.int64)
+            else:
+                end = block_end(pos)
+                [en, elm_types, elm_nodes] = frd_ascii_elements(data[pos:end], 10 if frd_format else 5)
+                pos = end
+        elif line.lstrip()[:4] == b"100C":
+            frd_format = int(line.split()[-1])
+            name_line_end = data.find(b"\n", pos)
+            name = data[pos:name_line_end].split()[1].decode()  # line -4 name number_of_components
+            pos = name_line_end + 1
+            number_of_components = 0
+            while data[pos:pos + 3] == b" -5":  # component lines
+                component_line_end = data.find(b"\n", pos)
+                if data[pos:component_line_end].split()[1] != b"ALL":  # ALL is computed, it has no values
+                    number_of_components += 1
+                pos = component_line_end + 1
+            if frd_format == 2:
+                values = np.frombuffer(data, dtype="<f4", count=len(node_ids) * number_of_components, offset=pos)
+                pos += values.nbytes
+                block = (node_ids, values.reshape(len(node_ids), number_of_components).astype(float))
+            else:
+                end = block_end(pos)
+                block = frd_ascii_values(data[pos:end], 10 if frd_format else 5) if name in result_names else None
+                pos = end
+            if name in result_names:
+                results.append((name, block[0], block[1]))
+
+    elm_counts = np.array([FRD_ELEMENT_NODES[elm_type] for elm_type in elm_types.tolist()], dtype=np.int64)
+    if elm_counts.sum() != len(elm_nodes):
+        raise ValueError("unexpected number of element nodes in " + file_nameW + ".frd")
+    elm_indptr = np.append(0, np.cumsum(elm_counts))
+    return en, elm_indptr, elm_nodes, results
+
+
 # function for importing results from .frd file
 # Failure Indices are computed at each node and maximum or average above each element is returned
+# nodal stresses of all elements are read to arrays and reduced to elements through element connectivities
 def import_FI_node(reference_value, file_nameW, domains, criteria, domain_FI, file_name, elm_states,
                    steps_superposition):
-    try:
-        f = open(os.path.join(file_nameW + ".frd"), "r")
-    except IOError:
+    if not os.path.isfile(os.path.join(file_nameW + ".frd")):
         msg = "CalculiX result file not found, check your inputs"
         write_to_log(file_name, "\nERROR: " + msg + "\n")
         assert False, msg
 
     memorized_steps = set()  # steps to use in superposition
     if steps_superposition:
-        # {sn: {en: [sxx, syy, szz, sxy, sxz, syz], next element with int. pt. stresses}, next step, ...}
-        step_stress = {}
+        step_stress = {}  # {sn: array of [sxx, syy, szz, sxy, sxz, syz] at element nodes, next step, ...}
         for LCn in range(len(steps_superposition)):
             for (scale, sn) in steps_superposition[LCn]:
                 sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
                 memorized_steps.add(sn)
-                step_stress[sn] = {}
 
-    # prepare ordered elements of interest and failure criteria for each element
+    # prepare elements of interest and failure criteria for each element
     criteria_elm = {}
     for dn in domain_FI:
         for en in domains[dn]:
@@ -1102,272 +1182,165 @@ def import_FI_node(reference_value, file_nameW, domains, criteria, domain_FI, fi
             for dn_crit in domain_FI[dn][elm_states[en]]:
                 cr.append(criteria.index(dn_crit))
             criteria_elm[en] = cr
-    sorted_elements = sorted(criteria_elm.keys())  # [en_lowest, ..., en_highest]
-
-    def compute_FI():  # for the actual node
-        if en in criteria_elm:
-            for FIn in criteria_elm[en]:
-                if criteria[FIn][0] == "stress_von_Mises":
-                    s_allowable = criteria[FIn][1]
-                    FI_node[nn][FIn] = np.sqrt(0.5 * ((sxx - syy) ** 2 + (syy - szz) ** 2 + (szz - sxx) ** 2 +
-                                                      6 * (sxy ** 2 + syz ** 2 + sxz ** 2))) / s_allowable
-                elif criteria[FIn][0] == "user_def":
-                    FI_node[nn][FIn] = eval(criteria[FIn][1])
-                else:
-                    msg = "\nError: failure criterion " + str(criteria[FIn]) + " not recognised.\n"
-                    write_to_log(file_name, msg)
-
-    def save_FI(sn, en):
-        FI_step[sn][en] = []
-        for FIn in range(len(criteria)):
-            FI_step[sn][en].append(None)
-            if FIn in criteria_elm[en]:
-                if reference_value == "max":
-                    FI_step[sn][en][FIn] = max(FI_elm[en][FIn])
-                elif reference_value == "average":
-                    FI_step[sn][en][FIn] = np.average(FI_elm[en][FIn])
-
-    read_mesh = False
-    frd_nodes = {}  # en associated to given node
-    elm_nodes = {}
-    for en in sorted_elements:
-        elm_nodes[en] = []
-    read_stress = False
-    sn = -1
+
+    [en_frd, elm_indptr, elm_nodes, results] = read_frd(file_nameW, ["STRESS"])
+    # nodes of elements of interest, nodes of element en_block[k] start at starts[k]
+    elm_counts = np.diff(elm_indptr)
+    elm_mask = np.isin(en_frd, np.fromiter(criteria_elm.keys(), dtype=np.int64, count=len(criteria_elm)))
+    en_block = en_frd[elm_mask]
+    node_rows = elm_nodes[np.repeat(elm_mask, elm_counts)]
+    starts = np.append(0, np.cumsum(elm_counts[elm_mask])[:-1])
+
     FI_step = []  # list for steps - [{en1: list for criteria FI, en2: [], ...}, {en1: [], en2: [], ...}, next step]
-    for line in f:
-        # reading mesh
-        if line[:6] == "    3C":
-            read_mesh = True
-        elif read_mesh is True:
-            if line[:3] == " -1":
-                en = int(line[3:13])
-                if en == sorted_elements[0]:
-                    sorted_elements.pop(0)
-                    read_elm_nodes = True
-                else:
-                    read_elm_nodes = False
-            elif line[:3] == " -2" and read_elm_nodes is True:
-                associated_nn = list(map(int, line.split()[1:]))
-                elm_nodes[en] += associated_nn
-                for nn in associated_nn:
-                    frd_nodes[nn] = en
-
-        # block end
-        if line[:3] == " -3":
-            if read_mesh is True:
-                read_mesh = False
-                frd_nodes_sorted = sorted(frd_nodes.items())  # [(nn, en), ...]
-            elif read_stress is True:
-                read_stress = False
-                FI_elm = {}
-                for en in elm_nodes:
-                    FI_elm[en] = [[] for _ in range(len(criteria))]
-                    if en in criteria_elm:
-                        for FIn in criteria_elm[en]:
-                            for nn in elm_nodes[en]:
-                                FI_elm[en][FIn].append(FI_node[nn][FIn])
-                FI_step.append({})
-                for en in FI_elm:
-                    save_FI(sn, en)
-
-        # reading stresses
-        elif line[:11] == " -4  STRESS":
-            read_stress = True
-            sn += 1
-            FI_node = {}
-            for nn in frd_nodes:
-                FI_node[nn] = [[] for _ in range(len(criteria))]
-            next_node = 0
-        elif read_stress is True:
-            if line[:3] == " -1":
-                nn = int(line[3:13])
-                if nn == frd_nodes_sorted[next_node][0]:
-                    next_node += 1
-                    sxx = float(line[13:25])
-                    syy = float(line[25:37])
-                    szz = float(line[37:49])
-                    sxy = float(line[49:61])
-                    syz = float(line[61:73])
-                    szx = float(line[73:85])
-                    syx = sxy
-                    szy = syz
-                    sxz = szx
-                    en = frd_nodes[nn]
-                    compute_FI()
-                    if sn in memorized_steps:
-                        try:
-                            step_stress[sn][en]
-                        except KeyError:
-                            step_stress[sn][en] = {}
-                        step_stress[sn][en][nn] = [sxx, syy, szz, sxy, sxz, syz]
-    f.close()
+    for sn, (name, node_ids, values) in enumerate(results):
+        node_order = np.argsort(node_ids, kind="stable")
+        position = np.minimum(np.searchsorted(node_ids[node_order], node_rows), len(node_ids) - 1)
+        if len(node_ids) == 0 or np.any(node_ids[node_order[position]] != node_rows):
+            msg = "\nERROR: stresses of some element nodes are missing in " + file_nameW + ".frd\n"
+            write_to_log(file_name, msg)
+            raise Exception(msg)
+        # frd components are sxx, syy, szz, sxy, syz, szx
+        stress = values[node_order[position]][:, [0, 1, 2, 3, 5, 4]]
+        FI_step.append(element_FI(en_block, starts, stress, criteria, criteria_elm, reference_value, file_name))
+        if sn in memorized_steps:
+            step_stress[sn] = stress
 
     # superposed steps
-    # step_stress = {sn: {en: [[sxx, syy, szz, sxy, sxz, syz], next node], next element with nodal stresses}, next step, ...}
     # steps_superposition = [[(sn, scale), next scaled step to add, ...], next superposed step]
     for LCn in range(len(steps_superposition)):
-        FI_step.append({})
-
-        # sum scaled stress components at each integration node
-        superposition_stress = {}
+        # sum scaled stress components at each node
+        superposition_stress = np.zeros((len(node_rows), 6))
         for (scale, sn) in steps_superposition[LCn]:
             sn -= 1  # step numbering in CalculiX is from 1, but we have it 0 based
-            for en in step_stress[sn]:
-                try:
-                    superposition_stress[en]
-                except KeyError:
-                    superposition_stress[en] = {}  # for nodes
-                for nn in elm_nodes[en]:
-                    try:
-                        superposition_stress[en][nn]
-                    except KeyError:
-                        superposition_stress[en][nn] = [0, 0, 0, 0, 0, 0]  # components of stress
-                    for component in range(6):
-                        superposition_stress[en][nn][component] += scale * step_stress[sn][en][nn][component]
-
+            superposition_stress += scale * step_stress[sn]
         # compute FI in each element at superposed step
-        for en in superposition_stress:
-            FI_node = {}
-            for nn in elm_nodes[en]:
-                FI_node[nn] = [[] for _ in range(len(criteria))]
-                sxx = superposition_stress[en][nn][0]
-                syy = superposition_stress[en][nn][1]
-                szz = superposition_stress[en][nn][2]
-                sxy = superposition_stress[en][nn][3]
-                sxz = superposition_stress[en][nn][4]
-                syz = superposition_stress[en][nn][5]
-                syx = sxy
-                szx = sxz
-                szy = syz
-                compute_FI()  # fill FI_node
-            FI_elm[en] = [[] for _ in range(len(criteria))]
-
-            if en in criteria_elm:
-                for FIn in criteria_elm[en]:
-                    for nn in elm_nodes[en]:
-                        FI_elm[en][FIn].append(FI_node[nn][FIn])
-            sn = -1  # last step number
-            save_FI(sn, en)  # save value to FI_step for given en
+        FI_step.append(element_FI(en_block, starts, superposition_stress, criteria, criteria_elm, reference_value,
+                                  file_name))
 
     return FI_step
 
 
+# function returning masses of elements in their states and mass differences for switching down and up
+# states are indices to domain_density and domain_thickness, shells have sizes given by area, volumes by volume
+# missing differences (switching down from the lowest state, up from the highest state) are nan
+def state_masses(states, size, shell, density, thickness):
+    density = np.array(density, dtype=float)
+    # thickness is used only by shells
+    thickness = np.append(np.array(thickness, dtype=float), np.ones(len(density)))[:len(density)]
+    lower = np.maximum(states - 1, 0)
+    upper = np.minimum(states + 1, len(density) - 1)
+    mass_elm = np.where(shell, size * density[states] * thickness[states], size * density[states])
+    mass_decrease = np.where(shell, size * (density[states] * thickness[states] - density[lower] * thickness[lower]),
+                             size * (density[states] - density[lower]))
+    mass_increase = np.where(shell, size * (density[upper] * thickness[upper] - density[states] * thickness[states]),
+                             size * (density[upper] - density[states]))
+    mass_decrease[states == 0] = np.nan
+    mass_increase[states == len(density) - 1] = np.nan
+    return mass_elm, mass_decrease, mass_increase
+
+
+# function returning the sum of values added one after another to the start value, i.e. the same value as adding
+# them in a loop (cumsum does not use pairwise summation)
+def sequential_sum(start, values):
+    return np.cumsum(np.append(start, values))
+
+
 # function for switch element states
+# element states, masses and sensitivity numbers are processed as arrays, the order of summing masses and sorting
+# sensitivity numbers is kept as in the element by element evaluation
 def switching(elm_states, domains_from_config, domain_optimized, domains, FI_step_max, domain_density, domain_thickness,
               domain_shells, area_elm, volume_elm, sensitivity_number, mass, mass_referential, mass_addition_ratio,
               mass_removal_ratio, compensate_state_filter, mass_excess, decay_coefficient, FI_violated, i_violated, i,
               mass_goal_i, domain_same_state):
 
-    def compute_difference(failing=False):
-        if en in domain_shells[dn]:  # shells mass difference
-            mass[i] += area_elm[en] * domain_density[dn][elm_states_en] * domain_thickness[dn][elm_states_en]
-            if (failing is False) and (elm_states_en != 0):  # for potential switching down
-                mass_decrease[en] = area_elm[en] * (
-                    domain_density[dn][elm_states_en] * domain_thickness[dn][elm_states_en] -
-                    domain_density[dn][elm_states_en - 1] * domain_thickness[dn][elm_states_en - 1])
-            if elm_states_en < len(domain_density[dn]) - 1:  # for potential switching up
-                mass_increase[en] = area_elm[en] * (
-                    domain_density[dn][elm_states_en + 1] * domain_thickness[dn][elm_states_en + 1] -
-                    domain_density[dn][elm_states_en] * domain_thickness[dn][elm_states_en])
-        else:  # volumes mass difference
-            mass[i] += volume_elm[en] * domain_density[dn][elm_states_en]
-            if (failing is False) and (elm_states_en != 0):  # for potential switching down
-                mass_decrease[en] = volume_elm[en] * (
-                    domain_density[dn][elm_states_en] - domain_density[dn][elm_states_en - 1])
-            if elm_states_en < len(domain_density[dn]) - 1:  # for potential switching up
-                mass_increase[en] = volume_elm[en] * (
-                    domain_density[dn][elm_states_en + 1] - domain_density[dn][elm_states_en])
-
-    mass_increase = {}
-    mass_decrease = {}
-    sensitivity_number_opt = {}
     mass.append(0)
-    mass_overloaded = 0.0
+    mass_terms = []  # masses added to mass[i] in the order of evaluation
+    mass_overloaded_terms = []  # masses of switched up failing elements
+    # candidates for switching - elements or domains with the same state (given by domain name)
+    candidate_keys = []
+    candidate_sensitivity = []
+    candidate_states = []  # states of elements, domains use -1
+    candidate_increase = []
+    candidate_decrease = []
     # switch up overloaded elements
     for dn in domains_from_config:
         if domain_optimized[dn] is True:
             len_domain_density_dn = len(domain_density[dn])
+            en_dn = np.array(domains[dn], dtype=np.int64)
+            en_list = en_dn.tolist()
+            states = np.fromiter(map(elm_states.__getitem__, en_list), dtype=np.int64, count=len(en_list))
+            failing_elm = np.fromiter(map(FI_step_max.__getitem__, en_list), dtype=float, count=len(en_list)) >= 1
+            shell = np.fromiter(map(domain_shells[dn].__contains__, en_list), dtype=bool, count=len(en_list))
+            size = np.fromiter((area_elm[en] if sh else volume_elm[en] for en, sh in zip(en_list, shell.tolist())),
+                               dtype=float, count=len(en_list))
+            sensitivity = np.fromiter(map(sensitivity_number.__getitem__, en_list), dtype=float, count=len(en_list))
+            if len(en_list) == 0:
+                continue
+
             if domain_same_state[dn] in ["max", "average"]:
-                new_state = 0
-                failing = False
-                highest_state = 0
-                sensitivity_number_list = []
-                sensitivity_number_of_domain = 0
-                for en in domains[dn]:  # find highest state, sensitivity number and if failing
-                    elm_states_en = elm_states[en]
-                    if elm_states_en >= highest_state:
-                        if domain_same_state[dn] == "max":
-                            sensitivity_number_of_domain = max(sensitivity_number_of_domain, sensitivity_number[en])
-                        highest_state = elm_states_en
-                    if FI_step_max[en] >= 1:  # new state if failing
-                        failing = True
-                        if elm_states_en < len_domain_density_dn - 1:
-                            new_state = max(new_state, elm_states_en + 1)
-                        else:
-                            new_state = max(new_state, elm_states_en)
-                    else:
-                        new_state = max(new_state, elm_states_en)
-                    if domain_same_state[dn] == "average":
-                        sensitivity_number_list.append(sensitivity_number[en])
-
-                if domain_same_state[dn] == "average":
-                    sensitivity_number_of_domain = np.average(sensitivity_number_list)
-
-                mass_increase[dn] = 0
-                mass_decrease[dn] = 0
-                for en in domains[dn]:  # evaluate mass, prepare to sorting and switching
-                    elm_states[en] = highest_state
-                    elm_states_en = elm_states[en]
-                    compute_difference(failing)
-                    if (failing is True) and (new_state != highest_state):
-                        elm_states[en] = new_state
-                        elm_states_en = elm_states[en]
-                        mass[i] += mass_increase[en]
-                        mass_overloaded += mass_increase[en]
-                        mass_goal_i += mass_increase[en]
-                    elif failing is False:  # use domain name dn instead of element number for future switching
-                        sensitivity_number_opt[dn] = sensitivity_number_of_domain
-                        try:
-                            mass_increase[dn] += mass_increase[en]
-                        except KeyError:
-                            pass
-                        try:
-                            mass_decrease[dn] += mass_decrease[en]
-                        except KeyError:
-                            pass
+                highest_state = int(states.max())
+                # sensitivity number of the domain from elements reaching the highest state so far (for "max")
+                reaching = states >= np.maximum.accumulate(np.append(0, states[:-1]))
+                if domain_same_state[dn] == "max":
+                    sensitivity_number_of_domain = max([0] + sensitivity[reaching].tolist())
+                else:
+                    sensitivity_number_of_domain = np.average(sensitivity)
+                failing = bool(failing_elm.any())
+                new_state = int(np.where(failing_elm, np.minimum(states + 1, len_domain_density_dn - 1),
+                                         states).max())
+                new_state = max(new_state, 0)
+
+                states[:] = highest_state
+                [mass_elm, mass_decrease, mass_increase] = state_masses(states, size, shell, domain_density[dn],
+                                                                        domain_thickness[dn])
+                if failing and (new_state != highest_state):
+                    elm_states.update(zip(en_list, [new_state] * len(en_list)))
+                    mass_terms.append(np.column_stack((mass_elm, mass_increase)).ravel())
+                    mass_overloaded_terms.append(mass_increase)
+                else:
+                    elm_states.update(zip(en_list, [highest_state] * len(en_list)))
+                    mass_terms.append(mass_elm)
+                if failing is False:  # use domain name dn instead of element number for future switching
+                    candidate_keys.append(dn)
+                    candidate_sensitivity.append(sensitivity_number_of_domain)
+                    candidate_states.append(-1)
+                    candidate_increase.append(sequential_sum(0, mass_increase[~np.isnan(mass_increase)])[-1])
+                    candidate_decrease.append(sequential_sum(0, mass_decrease[~np.isnan(mass_decrease)])[-1])
 
             else:  # domain_same_state is False
-                for en in domains[dn]:
-                    if FI_step_max[en] >= 1:  # increase state if it is not the highest
-                        en_added = False
-                        if elm_states[en] < len_domain_density_dn - 1:
-                            elm_states[en] += 1
-                            en_added = True
-                        elm_states_en = elm_states[en]
-                        if en in domain_shells[dn]:  # shells
-                            mass[i] += area_elm[en] * domain_density[dn][elm_states_en] * domain_thickness[
-                                dn][elm_states_en]
-                            if en_added is True:
-                                mass_difference = area_elm[en] * (
-                                    domain_density[dn][elm_states_en] * domain_thickness[dn][elm_states_en] -
-                                    domain_density[dn][elm_states_en - 1] * domain_thickness[dn][elm_states_en - 1])
-                                mass_overloaded += mass_difference
-                                mass_goal_i += mass_difference
-                        else:  # volumes
-                            mass[i] += volume_elm[en] * domain_density[dn][elm_states_en]
-                            if en_added is True:
-                                mass_difference = volume_elm[en] * (
-                                    domain_density[dn][elm_states_en] - domain_density[dn][elm_states_en - 1])
-                                mass_overloaded += mass_difference
-                                mass_goal_i += mass_difference
-                    else:  # rest of elements prepare to sorting and switching
-                        elm_states_en = elm_states[en]
-                        compute_difference()  # mass to add or remove
-                        sensitivity_number_opt[en] = sensitivity_number[en]
-    # sorting
-    sensitivity_number_sorted = sorted(sensitivity_number_opt.items(), key=operator.itemgetter(1))
-    sensitivity_number_sorted2 = list(sensitivity_number_sorted)
+                # increase state of failing elements if it is not the highest
+                en_added = failing_elm & (states < len_domain_density_dn - 1)
+                states += en_added
+                elm_states.update(zip(en_list, states.tolist()))
+                [mass_elm, mass_decrease, mass_increase] = state_masses(states, size, shell, domain_density[dn],
+                                                                        domain_thickness[dn])
+                mass_terms.append(mass_elm)
+                mass_overloaded_terms.append(mass_decrease[en_added])
+                # rest of elements prepare to sorting and switching
+                rest = ~failing_elm
+                candidate_keys += en_dn[rest].tolist()
+                candidate_sensitivity.append(sensitivity[rest])
+                candidate_states.append(states[rest])
+                candidate_increase.append(mass_increase[rest])
+                candidate_decrease.append(mass_decrease[rest])
+
+    def concatenate(values, dtype=float):
+        return np.concatenate([np.atleast_1d(np.asarray(v, dtype=dtype)) for v in values] + [np.zeros(0, dtype)])
+
+    mass_terms = concatenate(mass_terms)
+    mass_overloaded_terms = concatenate(mass_overloaded_terms)
+    if len(mass_terms):
+        mass[i] = float(sequential_sum(mass[i], mass_terms)[-1])
+    mass_overloaded = float(sequential_sum(0.0, mass_overloaded_terms)[-1])
+    mass_goal_i = sequential_sum(mass_goal_i, mass_overloaded_terms)[-1]
+    candidate_sensitivity = concatenate(candidate_sensitivity)
+    candidate_states = concatenate(candidate_states, np.int64)
+    candidate_increase = concatenate(candidate_increase)
+    candidate_decrease = concatenate(candidate_decrease)
+    is_domain = candidate_states == -1
+
+    # sorting, stable as sorting the dictionary items by value
+    sensitivity_order = np.argsort(candidate_sensitivity, kind="stable")
     if i_violated:
         if mass_removal_ratio - mass_addition_ratio > 0:  # removing from initial mass
             mass_to_add = mass_addition_ratio * mass_referential * np.exp(decay_coefficient * (i - i_violated))
@@ -1388,154 +1361,117 @@ def switching(elm_states, domains_from_config, domain_optimized, domains, FI_ste
             mass_to_remove += mass_excess
         else:  # compensate by adding more mass
             mass_to_add -= mass_excess
-    mass_added = mass_overloaded
-    mass_removed = 0.0
-    # if mass_goal_i < mass[i - 1]:  # going from bigger mass to lower
-    added_elm = set()
-    while mass_added < mass_to_add:
-        if sensitivity_number_sorted:
-            en = sensitivity_number_sorted.pop(-1)[0]  # highest sensitivity number
-            try:
-                mass[i] += mass_increase[en]
-                mass_added += mass_increase[en]
-                if isinstance(en, int):
-                    elm_states[en] += 1
-                else:  # same state domain en
-                    if mass_increase[en] == 0:
-                        raise KeyError
-                    for en2 in domains[en]:
-                        elm_states[en2] += 1
-                added_elm.add(en)
-            except KeyError:  # there is no mass_increase due to highest element state
-                pass
-        else:
-            break
-    popped = 0
-    while mass_removed < mass_to_remove:
-        if mass[i] <= mass_goal_i:
-            break
-        if sensitivity_number_sorted:
-            en = sensitivity_number_sorted.pop(0)[0]  # lowest sensitivity number
-            popped += 1
-            if isinstance(en, int):
-                if elm_states[en] != 0:
-                    mass[i] -= mass_decrease[en]
-                    mass_removed += mass_decrease[en]
-                    elm_states[en] -= 1
-            else:  # same state domain en
-                if mass_decrease[en] != 0:
-                    mass[i] -= mass_decrease[en]
-                    mass_removed += mass_decrease[en]
-                    for en2 in domains[en]:
-                        elm_states[en2] -= 1
-        else:  # switch down elements just switched up or tried to be switched up (already in the highest state)
-            try:
-                en = sensitivity_number_sorted2[popped][0]
-                popped += 1
-            except IndexError:
-                break
-            if isinstance(en, int):
-                if elm_states[en] != 0:
-                    elm_states[en] -= 1
-                    if en in added_elm:
-                        mass[i] -= mass_increase[en]
-                        mass_removed += mass_increase[en]
-                    else:
-                        mass[i] -= mass_decrease[en]
-                        mass_removed += mass_decrease[en]
-            else:  # same state domain en
-                if mass_decrease[en] != 0:
-                    for en2 in domains[en]:
-                        elm_states[en2] -= 1
-                    if en in added_elm:
-                        mass[i] -= mass_increase[en]
-                        mass_removed += mass_increase[en]
-                    else:
-                        mass[i] -= mass_decrease[en]
-                        mass_removed += mass_decrease[en]
+
+    # switching up from the highest sensitivity number while mass_added < mass_to_add
+    # elements in the highest state and domains without mass increase are skipped
+    descending = sensitivity_order[::-1]
+    increase_descending = np.nan_to_num(candidate_increase[descending])
+    mass_added = sequential_sum(mass_overloaded, increase_descending)
+    number_popped = np.append(np.flatnonzero(~(mass_added < mass_to_add)), len(descending))[0]
+    mass[i] = sequential_sum(mass[i], increase_descending[:number_popped])[-1]
+    popped = descending[:number_popped]
+    added = np.zeros(len(candidate_keys), dtype=bool)
+    added[popped] = np.where(is_domain[popped], candidate_increase[popped] != 0, ~np.isnan(candidate_increase[popped]))
+    # switching down from the lowest sensitivity number while mass_removed < mass_to_remove and mass[i] > mass_goal_i
+    # elements not switched up are taken first, then elements just switched up or tried to be switched up (already
+    # in the highest state) follow in the same order
+    states_after_adding = candidate_states + added
+    switched_up = np.zeros(len(candidate_keys), dtype=bool)
+    switched_up[popped] = True
+    in_second_pass = switched_up[sensitivity_order]
+    removable = np.where(is_domain, (candidate_decrease != 0) & ~np.isnan(candidate_decrease),
+                         np.where(switched_up, states_after_adding, candidate_states) != 0)[sensitivity_order]
+    mass_difference = np.where(in_second_pass & added[sensitivity_order], candidate_increase[sensitivity_order],
+                               candidate_decrease[sensitivity_order])
+    mass_difference = np.where(removable, mass_difference, 0.0)
+    mass_removed = sequential_sum(0.0, mass_difference)
+    mass_remaining = sequential_sum(mass[i], -mass_difference)
+    number_removed = np.append(np.flatnonzero(~(mass_removed < mass_to_remove) | (mass_remaining <= mass_goal_i)),
+                               len(sensitivity_order))[0]
+    number_removed = min(number_removed, len(sensitivity_order))
+    mass[i] = float(mass_remaining[number_removed])
+
+    # apply switching to element states
+    removed = np.zeros(len(candidate_keys), dtype=bool)
+    removed[sensitivity_order[:number_removed][removable[:number_removed]]] = True
+    for k in np.flatnonzero(added | removed).tolist():
+        change = int(added[k]) - int(removed[k])
+        if change:
+            en = candidate_keys[k]
+            for en2 in (domains[en] if is_domain[k] else [en]):
+                elm_states[en2] += change
     return elm_states, mass
 
 
+# element categories in the order used by the frd and vtk exports with frd element type, inp element type and vtk
+# cell type
+EXPORT_ELEMENTS = [("tria3", "7", "S3", 5), ("tria6", "8", "S6", 22), ("quad4", "9", "S4", 9), ("quad8", "10", "S8", 23),
+                   ("tetra4", "3", "C3D4", 10), ("tetra10", "6", "C3D10", 24), ("penta6", "2", "C3D6", 13),
+                   ("penta15", "5", "C3D15", 26), ("hexa8", "1", "C3D8", 12), ("hexa20", "4", "C3D20", 25)]
+# different node numbering in inp and frd file
+FRD_NODE_ORDER = {"hexa20": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 16, 17, 18, 19, 12, 13, 14, 15],
+                  "penta15": [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 13, 14, 9, 10, 11]}
+
+
+# function to write values separated by space, new line after each per_line values
+def write_values(f, values, per_line):
+    values = list(values)
+    chunks = []
+    for k in range(0, len(values), per_line):
+        chunk = values[k:k + per_line]
+        chunks.append(" ".join(chunk) + (" \n" if len(chunk) == per_line else " "))
+    f.write("".join(chunks))
+
+
+# function returning array of element values (e.g. states) for elements of the category in the mesh order
+def category_values(mesh, category, values, dtype=int):
+    en_list = mesh.element_ids[category].tolist()
+    return np.fromiter(map(values.__getitem__, en_list), dtype=dtype, count=len(en_list))
+
+
+# function returning sorted row indices of nodes associated to elements in the given state
+def associated_node_rows(mesh, states, state):
+    rows = [mesh.connectivity[category][states[category] == state].ravel() for category in states]
+    if not rows:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(rows))
+
+
 # function for exporting the resulting mesh in separate files for each state of elm_states
 # only elements found by import_inp function are taken into account
 def export_frd(file_nameW, nodes, Elements, elm_states, number_of_states):
-
-    def get_associated_nodes(elm_category):
-        for en in elm_category:
-            if elm_states[en] == state:
-                associated_nodes.extend(elm_category[en])
-
-    def write_elm(elm_category, category_symbol):
-        for en in elm_category:
-            if elm_states[en] == state:
-                f.write(" -1" + str(en).rjust(10, " ") + category_symbol.rjust(5, " ") + "\n")
-                line = ""
-                nodes_done = 0
-                if category_symbol == "4":  # hexa20 different node numbering in inp and frd file
-                    for np in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9,
-                               10, 11, 16, 17, 18, 19, 12, 13, 14, 15]:
-                        nn = elm_category[en][np]
-                        line += str(nn).rjust(10, " ")
-                        if np in [9, 15]:
-                            f.write(" -2" + line + "\n")
-                            line = ""
-                elif category_symbol == "5":  # penta15 has different node numbering in inp and frd file
-                    for np in [0, 1, 2, 3, 4, 5, 6, 7, 8, 12,
-                               13, 14, 9, 10, 11]:
-                        nn = elm_category[en][np]
-                        line += str(nn).rjust(10, " ")
-                        if np in [12, 11]:
-                            f.write(" -2" + line + "\n")
-                            line = ""
-                else:
-                    for nn in elm_category[en]:
-                        line += str(nn).rjust(10, " ")
-                        nodes_done += 1
-                        if nodes_done == 10 and elm_category != Elements.tetra10:
-                            f.write(" -2" + line + "\n")
-                            line = ""
-                    f.write(" -2" + line + "\n")
+    mesh = beso_mesh.as_mesh(nodes, Elements)
+    states = {category: category_values(mesh, category, elm_states) for category in mesh.categories()}
 
     # find all possible states in elm_states and run separately for each of them
     for state in range(number_of_states):
         f = open(os.path.join(file_nameW + "_state" + str(state) + ".frd"), "w")
 
         # print nodes
-        associated_nodes = []
-        get_associated_nodes(Elements.tria3)
-        get_associated_nodes(Elements.tria6)
-        get_associated_nodes(Elements.quad4)
-        get_associated_nodes(Elements.quad8)
-        get_associated_nodes(Elements.tetra4)
-        get_associated_nodes(Elements.tetra10)
-        get_associated_nodes(Elements.penta6)
-        get_associated_nodes(Elements.penta15)
-        get_associated_nodes(Elements.hexa8)
-        get_associated_nodes(Elements.hexa20)
-
-        associated_nodes = sorted(list(set(associated_nodes)))
+        rows = associated_node_rows(mesh, states, state)
         f.write("    1C\n")
-        f.write("    2C" + str(len(associated_nodes)).rjust(30, " ") + 37 * " " + "1\n")
-        for nn in associated_nodes:
-            f.write(" -1" + str(nn).rjust(10, " ") + "% .5E% .5E% .5E\n" % (nodes[nn][0], nodes[nn][1], nodes[nn][2]))
+        f.write("    2C" + str(len(rows)).rjust(30, " ") + 37 * " " + "1\n")
+        f.writelines(" -1%10d% .5E% .5E% .5E\n" % (nn, x, y, z)
+                     for nn, (x, y, z) in zip(mesh.node_ids[rows].tolist(), mesh.coordinates[rows].tolist()))
         f.write(" -3\n")
 
         # print elements
-        elm_sum = 0
-        for en in elm_states:
-            if elm_states[en] == state:
-                elm_sum += 1
+        elm_sum = sum(1 for sn in elm_states.values() if sn == state)
         f.write("    3C" + str(elm_sum).rjust(30, " ") + 37 * " " + "1\n")
-        write_elm(Elements.tria3, "7")
-        write_elm(Elements.tria6, "8")
-        write_elm(Elements.quad4, "9")
-        write_elm(Elements.quad8, "10")
-        write_elm(Elements.tetra4, "3")
-        write_elm(Elements.tetra10, "6")
-        write_elm(Elements.penta6, "2")
-        write_elm(Elements.penta15, "5")
-        write_elm(Elements.hexa8, "1")
-        write_elm(Elements.hexa20, "4")
+        for category, category_symbol, _, _ in EXPORT_ELEMENTS:
+            if category not in states:
+                continue
+            in_state = states[category] == state
+            element_nodes = mesh.element_nodes(category)[in_state]
+            if category in FRD_NODE_ORDER:
+                element_nodes = element_nodes[:, FRD_NODE_ORDER[category]]
+            # at most 10 nodes on each line
+            lines = []
+            for en, nod in zip(mesh.element_ids[category][in_state].tolist(), element_nodes.tolist()):
+                lines.append(" -1" + str(en).rjust(10, " ") + category_symbol.rjust(5, " ") + "\n")
+                for k in range(0, len(nod), 10):
+                    lines.append(" -2" + "".join(str(nn).rjust(10, " ") for nn in nod[k:k + 10]) + "\n")
+            f.writelines(lines)
         f.write(" -3\n")
         f.close()
 
@@ -1543,70 +1479,40 @@ def export_frd(file_nameW, nodes, Elements, elm_states, number_of_states):
 # function for exporting the resulting mesh in separate files for each state of elm_states
 # only elements found by import_inp function are taken into account
 def export_inp(file_nameW, nodes, Elements, elm_states, number_of_states):
-
-    def get_associated_nodes(elm_category):
-        for en in elm_category:
-            if elm_states[en] == state:
-                associated_nodes.extend(elm_category[en])
-
-    def write_elements_of_type(elm_type, elm_type_inp):
-        if elm_type:
-            f.write("*ELEMENT, TYPE=" + elm_type_inp + ", ELSET=state" + str(state) + "\n")
-            for en, nod in elm_type.items():
-                if elm_states[en] == state:
-                    f.write(str(en))
-                    for nn in nod:
-                        f.write(", " + str(nn))
-                    f.write("\n")
+    mesh = beso_mesh.as_mesh(nodes, Elements)
+    states = {category: category_values(mesh, category, elm_states) for category in mesh.categories()}
 
     # find all possible states in elm_states and run separately for each of them
     for state in range(number_of_states):
         f = open(os.path.join(file_nameW + "_state" + str(state) + ".inp"), "w")
         # print nodes
-        associated_nodes = []
-        get_associated_nodes(Elements.tria3)
-        get_associated_nodes(Elements.tria6)
-        get_associated_nodes(Elements.quad4)
-        get_associated_nodes(Elements.quad8)
-        get_associated_nodes(Elements.tetra4)
-        get_associated_nodes(Elements.tetra10)
-        get_associated_nodes(Elements.penta6)
-        get_associated_nodes(Elements.penta15)
-        get_associated_nodes(Elements.hexa8)
-        get_associated_nodes(Elements.hexa20)
-
-        associated_nodes = sorted(list(set(associated_nodes)))
+        rows = associated_node_rows(mesh, states, state)
         f.write("*NODE\n")
-        for nn in associated_nodes:
-            f.write(str(nn) + ", % .5E, % .5E, % .5E\n" % (nodes[nn][0], nodes[nn][1], nodes[nn][2]))
+        f.writelines(str(nn) + ", % .5E, % .5E, % .5E\n" % (x, y, z)
+                     for nn, (x, y, z) in zip(mesh.node_ids[rows].tolist(), mesh.coordinates[rows].tolist()))
         f.write("\n")
 
         # print elements
         # prints only basic element types
-        write_elements_of_type(Elements.tria3, "S3")
-        write_elements_of_type(Elements.tria6, "S6")
-        write_elements_of_type(Elements.quad4, "S4")
-        write_elements_of_type(Elements.quad8, "S8")
-        write_elements_of_type(Elements.tetra4, "C3D4")
-        write_elements_of_type(Elements.tetra10, "C3D10")
-        write_elements_of_type(Elements.penta6, "C3D6")
-        write_elements_of_type(Elements.penta15, "C3D15")
-        write_elements_of_type(Elements.hexa8, "C3D8")
-        if Elements.hexa20:
+        for category, _, elm_type_inp, _ in EXPORT_ELEMENTS:
+            if category not in states or category == "hexa20":
+                continue
+            in_state = states[category] == state
+            f.write("*ELEMENT, TYPE=" + elm_type_inp + ", ELSET=state" + str(state) + "\n")
+            f.writelines(", ".join(map(str, [en] + nod)) + "\n" for en, nod in
+                         zip(mesh.element_ids[category][in_state].tolist(),
+                             mesh.element_nodes(category)[in_state].tolist()))
+        if "hexa20" in states:
             f.write("*ELEMENT, TYPE=C3D20\n")
-            for en, nod in Elements.hexa20.items():
-                f.write(str(en))
-                for nn in nod[:15]:
-                    f.write(", " + str(nn))
-                f.write("\n")
-                for nn in nod[15:]:
-                    f.write(", " + str(nn))
-                f.write("\n")
+            for en, nod in zip(mesh.element_ids["hexa20"].tolist(), mesh.element_nodes("hexa20").tolist()):
+                f.write(str(en) + "".join(", " + str(nn) for nn in nod[:15]) + "\n")
+                f.write("".join(", " + str(nn) for nn in nod[15:]) + "\n")
         f.close()
 
 
 # sub-function to write vtk mesh
 def vtk_mesh(file_nameW, nodes, Elements):
+    mesh = beso_mesh.as_mesh(nodes, Elements)
     f = open(os.path.join(file_nameW + ".vtk"), "w")
     f.write("# vtk DataFile Version 3.0\n")
     f.write("Results from optimization\n")
@@ -1614,74 +1520,34 @@ def vtk_mesh(file_nameW, nodes, Elements):
     f.write("DATASET UNSTRUCTURED_GRID\n")
 
     # nodes
-    associated_nodes = set()
-    for nn_lists in list(Elements.tria3.values()) + list(Elements.tria6.values()) + list(Elements.quad4.values()) + \
-            list(Elements.quad8.values()) + list(Elements.tetra4.values()) + list(Elements.tetra10.values()) + \
-            list(Elements.penta6.values()) + list(Elements.penta15.values()) + list(Elements.hexa8.values()) + \
-            list(Elements.hexa20.values()):
-        associated_nodes.update(nn_lists)
-    associated_nodes = sorted(associated_nodes)
+    rows = np.unique(np.concatenate([mesh.connectivity[category].ravel() for category in beso_mesh.ELEMENT_CATEGORIES]))
+    associated_nodes = mesh.node_ids[rows].tolist()
     # node renumbering table for vtk format which does not jump over node numbers and contains only associated nodes
-    nodes_vtk = [None for _ in range(max(nodes.keys()) + 1)]
-    nn_vtk = 0
-    for nn in associated_nodes:
-        nodes_vtk[nn] = nn_vtk
-        nn_vtk += 1
+    nodes_vtk = np.full(len(mesh.node_ids), -1, dtype=np.int64)
+    nodes_vtk[rows] = np.arange(len(rows))
 
     f.write("\nPOINTS " + str(len(associated_nodes)) + " float\n")
-    line_count = 0
-    for nn in associated_nodes:
-        f.write("{} {} {} ".format(nodes[nn][0], nodes[nn][1], nodes[nn][2]))
-        line_count += 1
-        if line_count % 2 == 0:
-            f.write("\n")
+    write_values(f, ("{} {} {}".format(x, y, z) for x, y, z in mesh.coordinates[rows].tolist()), 2)
     f.write("\n")
 
     # elements
-    number_of_elements = len(Elements.tria3) + len(Elements.tria6) + len(Elements.quad4) + len(Elements.quad8) + \
-        len(Elements.tetra4) + len(Elements.tetra10) + len(Elements.penta6) + len(Elements.penta15) + \
-        len(Elements.hexa8) + len(Elements.hexa20)
-    en_all = list(Elements.tria3.keys()) + list(Elements.tria6.keys()) + list(Elements.quad4.keys()) + \
-        list(Elements.quad8.keys()) + list(Elements.tetra4.keys()) + list(Elements.tetra10.keys()) + \
-        list(Elements.penta6.keys()) + list(Elements.penta15.keys()) + list(Elements.hexa8.keys()) + \
-        list(Elements.hexa20.keys())  # defines vtk element numbering from 0
-
-    size_of_cells = 4 * len(Elements.tria3) + 7 * len(Elements.tria6) + 5 * len(Elements.quad4) + \
-        9 * len(Elements.quad8) + 5 * len(Elements.tetra4) + 11 * len(Elements.tetra10) + \
-        7 * len(Elements.penta6) + 16 * len(Elements.penta15) + 9 * len(Elements.hexa8) + \
-        21 * len(Elements.hexa20)
+    number_of_elements = mesh.number_of_elements()
+    en_all = []  # defines vtk element numbering from 0
+    size_of_cells = 0
+    for category, _, _, _ in EXPORT_ELEMENTS:
+        en_all += mesh.element_ids[category].tolist()
+        size_of_cells += (beso_mesh.NODES_PER_ELEMENT[category] + 1) * len(mesh.element_ids[category])
     f.write("\nCELLS " + str(number_of_elements) + " " + str(size_of_cells) + "\n")
-
-    def write_elm(elm_category, node_length):
-        for en in elm_category:
-            f.write(node_length)
-            for nn in elm_category[en]:
-                f.write(" " + str(nodes_vtk[nn]) + " ")
-            f.write("\n")
-
-    write_elm(Elements.tria3, "3")
-    write_elm(Elements.tria6, "6")
-    write_elm(Elements.quad4, "4")
-    write_elm(Elements.quad8, "8")
-    write_elm(Elements.tetra4, "4")
-    write_elm(Elements.tetra10, "10")
-    write_elm(Elements.penta6, "6")
-    write_elm(Elements.penta15, "15")
-    write_elm(Elements.hexa8, "8")
-    write_elm(Elements.hexa20, "20")
+    for category, _, _, _ in EXPORT_ELEMENTS:
+        node_length = str(beso_mesh.NODES_PER_ELEMENT[category])
+        f.writelines(node_length + " " + "  ".join(map(str, nod)) + " \n"
+                     for nod in nodes_vtk[mesh.connectivity[category]].tolist())
 
     f.write("\nCELL_TYPES " + str(number_of_elements) + "\n")
-    cell_types = "5 " * len(Elements.tria3) + "22 " * len(Elements.tria6) + "9 " * len(Elements.quad4) + \
-                 "23 " * len(Elements.quad8) + "10 " * len(Elements.tetra4) + "24 " * len(Elements.tetra10) + \
-                 "13 " * len(Elements.penta6) + "26 " * len(Elements.penta15) + "12 " * len(Elements.hexa8) + \
-                 "25 " * len(Elements.hexa20)
-    line_count = 0
-    for char in cell_types:
-        f.write(char)
-        if char == " ":
-            line_count += 1
-            if line_count % 30 == 0:
-                f.write("\n")
+    cell_types = []
+    for category, _, _, vtk_type in EXPORT_ELEMENTS:
+        cell_types += [str(vtk_type)] * len(mesh.element_ids[category])
+    write_values(f, cell_types, 30)
     f.write("\n")
 
     f.write("\nCELL_DATA " + str(number_of_elements) + "\n")
@@ -1696,12 +1562,7 @@ def append_vtk_states(file_nameW, i, en_all, elm_states):
     # element state
     f.write("\nSCALARS element_states" + str(i).zfill(3) + " float\n")
     f.write("LOOKUP_TABLE default\n")
-    line_count = 0
-    for en in en_all:
-        f.write(str(elm_states[en]) + " ")
-        line_count += 1
-        if line_count % 30 == 0:
-            f.write("\n")
+    write_values(f, (str(elm_states[en]) for en in en_all), 30)
     f.write("\n")
     f.close()
 
@@ -1710,29 +1571,20 @@ def append_vtk_states(file_nameW, i, en_all, elm_states):
 
 
 def export_vtk(file_nameW, nodes, Elements, elm_states, sensitivity_number, criteria, FI_step, FI_step_max):
+    mesh = beso_mesh.as_mesh(nodes, Elements)
     [en_all, associated_nodes] = vtk_mesh(file_nameW, nodes, Elements)
     f = open(os.path.join(file_nameW + ".vtk"), "a")
 
     # element state
     f.write("\nSCALARS element_states float\n")
     f.write("LOOKUP_TABLE default\n")
-    line_count = 0
-    for en in en_all:
-        f.write(str(elm_states[en]) + " ")
-        line_count += 1
-        if line_count % 30 == 0:
-            f.write("\n")
+    write_values(f, (str(elm_states[en]) for en in en_all), 30)
     f.write("\n")
 
     # sensitivity number
     f.write("\nSCALARS sensitivity_number float\n")
     f.write("LOOKUP_TABLE default\n")
-    line_count = 0
-    for en in en_all:
-        f.write(str(sensitivity_number[en]) + " ")
-        line_count += 1
-        if line_count % 6 == 0:
-            f.write("\n")
+    write_values(f, (str(sensitivity_number[en]) for en in en_all), 6)
     f.write("\n")
 
     # FI
@@ -1753,67 +1605,32 @@ def export_vtk(file_nameW, nodes, Elements, elm_states, sensitivity_number, crit
         elif criteria[FIn][0] == "user_def":
             f.write("SCALARS FI=" + criteria[FIn][1].replace(" ", "") + " float\n")
         f.write("LOOKUP_TABLE default\n")
-        line_count = 0
-        for en in en_all:
-            if FI_criteria[en][FIn]:
-                f.write(str(FI_criteria[en][FIn]) + " ")
-            else:
-                f.write("0 ")  # since Paraview do not recognise None value
-            line_count += 1
-            if line_count % 6 == 0:
-                f.write("\n")
+        # 0 since Paraview do not recognise None value
+        write_values(f, (str(FI_criteria[en][FIn]) if FI_criteria[en][FIn] else "0" for en in en_all), 6)
         f.write("\n")
 
     # FI_max
     f.write("\nSCALARS FI_max float\n")
     f.write("LOOKUP_TABLE default\n")
-    line_count = 0
-    for en in en_all:
-        f.write(str(FI_step_max[en]) + " ")
-        line_count += 1
-        if line_count % 6 == 0:
-            f.write("\n")
+    write_values(f, (str(FI_step_max[en]) for en in en_all), 6)
     f.write("\n")
 
     # element state averaged at nodes
-    def append_nodal_state(en, elm_type):
-        for nn in elm_type[en]:
-            try:
-                nodal_state[nn].append(elm_states[en])
-            except KeyError:
-                nodal_state[nn] = [elm_states[en]]
-
-    nodal_state = {}
-    for en in Elements.tria3:
-        append_nodal_state(en, Elements.tria3)
-    for en in Elements.tria6:
-        append_nodal_state(en, Elements.tria6)
-    for en in Elements.quad4:
-        append_nodal_state(en, Elements.quad4)
-    for en in Elements.quad8:
-        append_nodal_state(en, Elements.quad8)
-    for en in Elements.tetra4:
-        append_nodal_state(en, Elements.tetra4)
-    for en in Elements.tetra10:
-        append_nodal_state(en, Elements.tetra10)
-    for en in Elements.penta6:
-        append_nodal_state(en, Elements.penta6)
-    for en in Elements.penta15:
-        append_nodal_state(en, Elements.penta15)
-    for en in Elements.hexa8:
-        append_nodal_state(en, Elements.hexa8)
-    for en in Elements.hexa20:
-        append_nodal_state(en, Elements.hexa20)
+    state_sum = np.zeros(len(mesh.node_ids))
+    state_count = np.zeros(len(mesh.node_ids))
+    for category in mesh.categories():
+        connectivity = mesh.connectivity[category]
+        states = category_values(mesh, category, elm_states, dtype=float)
+        state_sum += np.bincount(connectivity.ravel(), weights=np.repeat(states, connectivity.shape[1]),
+                                 minlength=len(mesh.node_ids))
+        state_count += np.bincount(connectivity.ravel(), minlength=len(mesh.node_ids))
+    rows = mesh.node_index(associated_nodes)
+    nodal_state = state_sum[rows] / state_count[rows]
 
     f.write("\nPOINT_DATA " + str(len(associated_nodes)) + "\n")
     f.write("FIELD field_data 1\n")
     f.write("\nelement_states_averaged_at_nodes 1 " + str(len(associated_nodes)) + " float\n")
-    line_count = 0
-    for nn in associated_nodes:
-        f.write(str(np.average(nodal_state[nn])) + " ")
-        line_count += 1
-        if line_count % 10 == 0:
-            f.write("\n")
+    write_values(f, map(str, nodal_state.tolist()), 10)
     f.write("\n")
 
     f.close()
@@ -1,45 +1,53 @@
 class BesoMain:
-    import FreeCADGui
-    import FreeCAD
+    try:
+        import FreeCADGui
+        import FreeCAD
+        import Fem
+    except ImportError:  # headless run without FreeCAD (see beso_batch)
+        FreeCADGui = FreeCAD = Fem = None
     import os
     import time
     import sys
-    import Fem
     import shutil
     import subprocess
     import numpy as np
-    from fembygen.topology import beso_filters, beso_separate, beso_lib
-
-    def __init__(self, analysis):
-
-        self.doc = self.FreeCAD.ActiveDocument
-        self.path = self.doc.Topology.path
-        self.path_calculix = self.doc.Topology.path_calculix
-        self.file_name = self.doc.Topology.file_name
-        self.domain_optimized = self.doc.Topology.domain_optimized[analysis]
+    from fembygen.topology import beso_filters, beso_separate, beso_lib, beso_solver
+
+    def __init__(self, analysis, config=None):
+        """config is an object with the properties of the Topology object, the Topology object of the active document
+        is used if it is not given"""
+        if config is None:
+            self.doc = self.FreeCAD.ActiveDocument
+            config = self.doc.Topology
+        else:
+            self.doc = None
+        self.path = config.path
+        self.path_calculix = config.path_calculix
+        self.file_name = config.file_name
+        self.domain_optimized = config.domain_optimized[analysis]
         self.domains_from_config = self.domain_optimized.keys()
-        self.mass_goal_ratio = self.doc.Topology.mass_goal_ratio
-        self.continue_from = self.doc.Topology.continue_from
-        self.filter_list = self.doc.Topology.filter_list
-        self.optimization_base = self.doc.Topology.optimization_base
-        self.cpu_cores = self.doc.Topology.cpu_cores
-        self.FI_violated_tolerance = self.doc.Topology.FI_violated_tolerance
-        self.decay_coefficient = self.doc.Topology.decay_coefficient
-        self.shells_as_composite = self.doc.Topology.shells_as_composite
-        self.reference_points = self.doc.Topology.reference_points
-        self.reference_value = self.doc.Topology.reference_value
-        self.mass_addition_ratio = self.doc.Topology.mass_addition_ratio
-        self.mass_removal_ratio = self.doc.Topology.mass_removal_ratio
-        self.ratio_type = self.doc.Topology.ratio_type
-        self.compensate_state_filter = self.doc.Topology.compensate_state_filter
-        self.sensitivity_averaging = self.doc.Topology.sensitivity_averaging
-        self.steps_superposition = self.doc.Topology.steps_superposition
-        self.iterations_limit = self.doc.Topology.iterations_limit
-        self.tolerance = self.doc.Topology.tolerance
-        self.displacement_graph = self.doc.Topology.displacement_graph
-        self.save_iteration_results = self.doc.Topology.save_iteration_results
-        self.save_solver_files = self.doc.Topology.save_solver_files
-        self.save_resulting_format = self.doc.Topology.save_resulting_format
+        self.mass_goal_ratio = config.mass_goal_ratio
+        self.continue_from = config.continue_from
+        self.filter_list = config.filter_list
+        self.optimization_base = config.optimization_base
+        self.cpu_cores = config.cpu_cores
+        self.FI_violated_tolerance = config.FI_violated_tolerance
+        self.decay_coefficient = config.decay_coefficient
+        self.shells_as_composite = config.shells_as_composite
+        self.reference_points = config.reference_points
+        self.reference_value = config.reference_value
+        self.mass_addition_ratio = config.mass_addition_ratio
+        self.mass_removal_ratio = config.mass_removal_ratio
+        self.ratio_type = config.ratio_type
+        self.compensate_state_filter = config.compensate_state_filter
+        self.sensitivity_averaging = config.sensitivity_averaging
+        self.steps_superposition = config.steps_superposition
+        self.iterations_limit = config.iterations_limit
+        self.tolerance = config.tolerance
+        self.displacement_graph = config.displacement_graph
+        self.save_iteration_results = config.save_iteration_results
+        self.save_solver_files = config.save_solver_files
+        self.save_resulting_format = config.save_resulting_format
 
         self.criteria = []
         self.domain_thickness = {}
@@ -47,24 +55,27 @@ class BesoMain:
         self.domain_orientation = {}
         self.domain_same_state = {}
         self.domain_FI_filled = False
-        self.weight_factor2 = {}
-        self.near_elm = {}
+        # filter values are stored for each filter of the type, filtered elements with sparse weight matrices
+        self.en_filter2 = []
+        self.weight_factor2 = []
+        self.en_filter_morphology = []
+        self.near_elm = []
+        self.en_filter3 = []
         self.weight_factor3 = []
-        self.near_elm3 = []
-        self.near_points = []
+        self.en_mesh1 = []
         self.weight_factor_node = []
-        self.M = []
+        self.en_filter1 = []
         self.weight_factor_distance = []
-        self.near_nodes = []
-        self.above_elm = {}
-        self.below_elm = {}
+        self.en_filter_casting = []
+        self.above_elm = []
+        self.below_elm = []
         self.filter_auto = False
 
-        self.domain_density = self.doc.Topology.domain_density[analysis]
-        self.domain_material = self.doc.Topology.domain_material[analysis]
+        self.domain_density = config.domain_density[analysis]
+        self.domain_material = config.domain_material[analysis]
 
         try:
-            self.domain_FI = self.doc.Topology.domain_FI[analysis]
+            self.domain_FI = config.domain_FI[analysis]
             for dn in self.domain_FI:  # extracting each type of criteria
                 if self.domain_FI[dn]:
                     self.domain_FI_filled = True
@@ -78,19 +89,19 @@ class BesoMain:
         for dn in self.domain_optimized:
 
             try:
-                self.domain_thickness[dn] = self.doc.Topology.domain_thickness[analysis][dn]
+                self.domain_thickness[dn] = config.domain_thickness[analysis][dn]
             except KeyError:
                 self.domain_thickness[dn] = []
             try:
-                self.domain_offset[dn] = self.doc.Topology.domain_offset[analysis][dn]
+                self.domain_offset[dn] = config.domain_offset[analysis][dn]
             except KeyError:
                 self.domain_offset[dn] = 0.0
             try:
-                self.domain_orientation[dn] = self.doc.Topology.domain_orientation[analysis][dn]
+                self.domain_orientation[dn] = config.domain_orientation[analysis][dn]
             except KeyError:
                 self.domain_orientation[dn] = []
             try:
-                self.domain_same_state[dn] = self.doc.Topology.domain_same_state[analysis][dn]
+                self.domain_same_state[dn] = config.domain_same_state[analysis][dn]
             except KeyError:
                 self.domain_same_state[dn] = False
 
@@ -106,10 +117,18 @@ class BesoMain:
         except:
             self.shutil.rmtree(self.os.path.join(path, "topology_iterations"))
             msg = "Earlier topology simulations deleted"
-            self.FreeCAD.Console.PrintMessage(msg)
+            if self.FreeCAD:
+                self.FreeCAD.Console.PrintMessage(msg)
+            else:
+                print(msg)
             self.beso_lib.write_to_log(file_name, msg)
             self.os.mkdir(self.os.path.join(path, "topology_iterations"))
 
+    def setLastState(self, state):
+        self.last_state = state
+        if self.doc is not None:
+            self.doc.Topology.LastState = state
+
     def deleteFiles(self, file_nameW, save_solver_files, reference_points):
         if "inp" not in save_solver_files:
             self.os.remove(file_nameW + ".inp")
@@ -126,10 +145,14 @@ class BesoMain:
         if "12d" not in save_solver_files:
             self.os.remove(file_nameW + ".12d")
 
-    def main(self):
-        from fembygen.topology import beso_plots
+    def main(self, plots=True):
+        """run the optimization, plots are shown in FreeCAD if plots is True
 
-        self.os.putenv('OMP_NUM_THREADS', str(self.doc.Topology.cpu_cores))
+        returns a summary with the last state (the resulting iteration), element states and histories of iterations"""
+        if plots:
+            from fembygen.topology import beso_plots
+
+        self.os.putenv('OMP_NUM_THREADS', str(self.cpu_cores))
         self.start_time = self.time.time()
         # writing log file with settings
         msg = "\n"
@@ -176,6 +199,18 @@ class BesoMain:
         self.file_name = self.os.path.join(self.path, self.file_name)
         self.beso_lib.write_to_log(self.file_name, msg)
 
+        # compile user defined expressions once, unsupported syntax is reported before the first solution
+        expressions = [(criterion[1], self.beso_lib.STRESS_VARIABLES) for criterion in self.criteria
+                       if criterion[0] == "user_def"]
+        expressions += [(component, self.beso_lib.DISPLACEMENT_VARIABLES) for [ns, component] in self.displacement_graph
+                        if component.upper() != "TOTAL"]
+        for (expression, variables) in expressions:
+            try:
+                self.beso_lib.compile_expression(expression, variables)
+            except ValueError as err:
+                self.beso_lib.write_to_log(self.file_name, "\nERROR: " + str(err) + "\n")
+                raise
+
         # mesh and domains importing
         [nodes, Elements, domains, opt_domains, en_all, plane_strain, plane_stress, axisymmetry] = self.beso_lib.import_inp(
             self.file_name, self.domains_from_config, self.domain_optimized, self.shells_as_composite)
@@ -254,6 +289,8 @@ class BesoMain:
             print("\niterations_limit set automatically to %s" % iterations_limit)
             msg = ("\niterations_limit        = %s\n" % iterations_limit)
             self.beso_lib.write_to_log(self.file_name, msg)
+        else:
+            iterations_limit = int(self.iterations_limit)
 
         # preparing parameters for filtering sensitivity numbers
         """weight_factor2 = {}
@@ -268,6 +305,7 @@ class BesoMain:
         above_elm = {}
         below_elm = {}
         filter_auto = False"""
+        filter_cache = self.os.path.join(self.path, "filter_cache")  # filter values reused by next runs on the same mesh
         for ft in self.filter_list:  # find if automatic filter range is used
             if ft[0] and (ft[1] == "auto") and not self.filter_auto:
                 size_elm = self.beso_filters.find_size_elm(Elements, nodes)
@@ -300,8 +338,14 @@ class BesoMain:
                                                                                                                  f_range)
                         print(msg)
                         self.beso_lib.write_to_log(self.file_name, msg)
-                    [above_elm, below_elm] = self.beso_filters.prepare2s_casting(cg, f_range, domains_to_filter,
-                                                                                 above_elm, below_elm, casting_vector)
+                    key = self.beso_filters.filter_cache_key(nodes, Elements, "casting", f_range, domains_to_filter,
+                                                             casting_vector)
+                    [e_f, a_e, b_e] = self.beso_filters.cached_prepare(filter_cache, key,
+                                                                       self.beso_filters.prepare2s_casting, cg, f_range,
+                                                                       domains_to_filter, casting_vector)
+                    self.en_filter_casting.append(e_f)
+                    self.above_elm.append(a_e)
+                    self.below_elm.append(b_e)
                     continue  # to evaluate other filters
                 if len(ft) == 2:
                     domains_to_filter = list(opt_domains)
@@ -323,27 +367,35 @@ class BesoMain:
                         size_avg, f_range)
                     print(msg)
                     self.beso_lib.write_to_log(self.file_name, msg)
+                key = self.beso_filters.filter_cache_key(nodes, Elements, ft[0], f_range, domains_to_filter)
                 if ft[0] == "over points":
                     self.beso_filters.check_same_state(self.domain_same_state, self.domains_from_config, self.file_name)
-                    [w_f3, n_e3, n_p] = self.beso_filters.prepare3_tetra_grid(
-                        self.file_name, cg, f_range, domains_to_filter)
+                    [e_f, w_f3] = self.beso_filters.cached_prepare(filter_cache, key,
+                                                                   self.beso_filters.prepare3_tetra_grid, self.file_name, cg,
+                                                                   f_range, domains_to_filter)
+                    self.en_filter3.append(e_f)
                     self.weight_factor3.append(w_f3)
-                    self.near_elm3.append(n_e3)
-                    self.near_points.append(n_p)
                 elif ft[0] == "over nodes":
                     self.beso_filters.check_same_state(self.domain_same_state, self.domains_from_config, self.file_name)
-                    [w_f_n, M_, w_f_d, n_n] = self.beso_filters.prepare1s(
-                        nodes, Elements, cg, f_range, domains_to_filter)
+                    [e_m, w_f_n, e_f, w_f_d] = self.beso_filters.cached_prepare(
+                        filter_cache, key, self.beso_filters.prepare1s, nodes, Elements, cg, f_range, domains_to_filter)
+                    self.en_mesh1.append(e_m)
                     self.weight_factor_node.append(w_f_n)
-                    self.M.append(M_)
+                    self.en_filter1.append(e_f)
                     self.weight_factor_distance.append(w_f_d)
-                    self.near_nodes.append(n_n)
                 elif ft[0] == "simple":
-                    [weight_factor2, near_elm] = self.beso_filters.prepare2s(cg, cg_min, cg_max, f_range, domains_to_filter,
-                                                                             self.weight_factor2, self.near_elm)
+                    [e_f, w_f2] = self.beso_filters.cached_prepare(filter_cache, key, self.beso_filters.prepare2s, cg,
+                                                                   cg_min, cg_max, f_range, domains_to_filter)
+                    self.en_filter2.append(e_f)
+                    self.weight_factor2.append(w_f2)
                 elif ft[0].split()[0] in ["erode", "dilate", "open", "close", "open-close", "close-open", "combine"]:
-                    near_elm = self.beso_filters.prepare_morphology(
-                        cg, cg_min, cg_max, f_range, domains_to_filter, near_elm)
+                    # all morphology filters use the same near elements
+                    key = self.beso_filters.filter_cache_key(nodes, Elements, "morphology", f_range, domains_to_filter)
+                    [e_f, n_e] = self.beso_filters.cached_prepare(filter_cache, key,
+                                                                  self.beso_filters.prepare_morphology, cg, cg_min, cg_max,
+                                                                  f_range, domains_to_filter)
+                    self.en_filter_morphology.append(e_f)
+                    self.near_elm.append(n_e)
 
         # separating elements for reading nodal input
         if self.reference_points == "nodes":
@@ -411,10 +463,14 @@ class BesoMain:
         oscillations = False
 
         self.createFolder(self.path, self.file_name)
+        # exports of iteration results run on a worker thread while the next iteration is evaluated
+        exports = self.beso_solver.BackgroundTasks()
+        solver_output = self.os.path.join(self.path, "topology_iterations", "calculix_output.txt")
+        plot_previous = None  # replot arguments of the previous iteration, plotted while CalculiX is solving
 
         while True:
-            if self.FreeCADGui.activeDocument() == None:
-                self.doc.Topology.LastState = 0
+            if self.doc is not None and self.FreeCADGui.activeDocument() == None:
+                self.setLastState(0)
                 break
             # creating the new .inp file for CalculiX
             file_nameW = self.os.path.join(self.path, "topology_iterations", "file" + str(i).zfill(3))
@@ -423,12 +479,16 @@ class BesoMain:
                                     domain_volumes, domain_shells, plane_strain, plane_stress, axisymmetry, self.save_iteration_results,
                                     i, self.reference_points, self.shells_as_composite, self.optimization_base, self.displacement_graph,
                                     self.domain_FI_filled)
-            # running CalculiX analysis
-
-            if self.sys.platform.startswith('linux'):
-                self.subprocess.call([self.os.path.normpath(self.path_calculix), file_nameW], cwd=self.path)
-            else:
-                self.subprocess.call([self.os.path.normpath(self.path_calculix), file_nameW], cwd=self.path, shell=True)
+            # running CalculiX analysis in the directory of the .inp file which includes the static mesh parts
+            solver = self.beso_solver.SolverRun(self.path_calculix, file_nameW, solver_output)
+            if plots and plot_previous:
+                beso_plots.replot(*plot_previous, savefig=True)
+                plot_previous = None
+            if solver.wait() != 0:
+                msg = "\nWARNING: CalculiX analysis of " + file_nameW + ".inp ended with return code " + \
+                    str(solver.process.returncode) + ", last output lines:\n" + "\n".join(solver.tail) + "\n"
+                self.beso_lib.write_to_log(self.file_name, msg)
+            exports.check()
 
             # reading results and computing failure indices
             if (self.reference_points == "integration points") or (self.optimization_base == "stiffness") or \
@@ -537,6 +597,9 @@ class BesoMain:
             # filtering sensitivity number
             kp = 0
             kn = 0
+            ks = 0
+            km = 0
+            kc = 0
             for ft in self.filter_list:
                 if ft[0] and ft[1]:
                     if ft[0] == "casting":
@@ -546,8 +609,10 @@ class BesoMain:
                             domains_to_filter = []
                             for dn in ft[3:]:
                                 domains_to_filter += domains[dn]
-                        sensitivity_number = self.beso_filters.run2_casting(sensitivity_number, above_elm, below_elm,
+                        sensitivity_number = self.beso_filters.run2_casting(sensitivity_number, self.en_filter_casting[kc],
+                                                                            self.above_elm[kc], self.below_elm[kc],
                                                                             domains_to_filter)
+                        kc += 1
                         continue  # to evaluate other filters
                     if len(ft) == 2:
                         domains_to_filter = list(opt_domains)
@@ -556,21 +621,25 @@ class BesoMain:
                         for dn in ft[2:]:
                             domains_to_filter += domains[dn]
                     if ft[0] == "over points":
-                        sensitivity_number = self.beso_filters.run3(sensitivity_number, self.weight_factor3[kp], self.near_elm3[kp],
-                                                                    self.near_points[kp])
+                        sensitivity_number = self.beso_filters.run3(sensitivity_number, self.en_filter3[kp],
+                                                                    self.weight_factor3[kp])
                         kp += 1
                     elif ft[0] == "over nodes":
-                        sensitivity_number = self.beso_filters.run1(self.file_name, sensitivity_number, self.weight_factor_node[kn], self.M[kn],
-                                                                    self.weight_factor_distance[kn], self.near_nodes[kn], nodes,
-                                                                    domains_to_filter)
+                        sensitivity_number = self.beso_filters.run1(self.file_name, sensitivity_number, self.en_mesh1[kn],
+                                                                    self.weight_factor_node[kn], self.en_filter1[kn],
+                                                                    self.weight_factor_distance[kn], domains_to_filter)
                         kn += 1
                     elif ft[0] == "simple":
-                        sensitivity_number = self.beso_filters.run2(self.file_name, sensitivity_number, weight_factor2, near_elm,
-                                                                    domains_to_filter)
+                        sensitivity_number = self.beso_filters.run2(self.file_name, sensitivity_number, self.en_filter2[ks],
+                                                                    self.weight_factor2[ks], domains_to_filter)
+                        ks += 1
                     elif ft[0].split()[0] in ["erode", "dilate", "open", "close", "open-close", "close-open", "combine"]:
                         if ft[0].split()[1] == "sensitivity":
-                            sensitivity_number = self.beso_filters.run_morphology(sensitivity_number, near_elm, domains_to_filter,
+                            sensitivity_number = self.beso_filters.run_morphology(sensitivity_number,
+                                                                                  self.en_filter_morphology[km],
+                                                                                  self.near_elm[km], domains_to_filter,
                                                                                   ft[0].split()[0])
+                        km += 1
 
             if self.sensitivity_averaging:
                 for en in opt_domains:
@@ -664,11 +733,11 @@ class BesoMain:
             # export element values
             if self.save_iteration_results and self.np.mod(float(i), self.save_iteration_results) == 0:
                 if "csv" in self.save_resulting_format:
-                    self.beso_lib.export_csv(self.domains_from_config, domains, self.criteria, FI_step, FI_step_max, file_nameW, cg,
-                                             elm_states, sensitivity_number)
+                    exports.submit(self.beso_lib.export_csv, self.domains_from_config, domains, self.criteria, FI_step, FI_step_max,
+                                   file_nameW, cg, elm_states.copy(), sensitivity_number.copy())
                 if "vtk" in self.save_resulting_format:
-                    self.beso_lib.export_vtk(file_nameW, nodes, Elements, elm_states, sensitivity_number, self.criteria, FI_step,
-                                             FI_step_max)
+                    exports.submit(self.beso_lib.export_vtk, file_nameW, nodes, Elements, elm_states.copy(), sensitivity_number.copy(),
+                                   self.criteria, FI_step, FI_step_max)
 
             # relative difference in a mean stress for the last 5 iterations must be < tolerance
             if len(FI_mean) > 5:
@@ -707,17 +776,18 @@ class BesoMain:
             if continue_iterations is False or i >= iterations_limit:
                 if not(self.save_iteration_results and self.np.mod(float(i), self.save_iteration_results) == 0):
                     if "csv" in self.save_resulting_format:
-                        self.beso_lib.export_csv(self.domains_from_config, domains, self.criteria, FI_step, FI_step_max, file_nameW, cg,
-                                                 elm_states, sensitivity_number)
+                        exports.submit(self.beso_lib.export_csv, self.domains_from_config, domains, self.criteria, FI_step,
+                                       FI_step_max, file_nameW, cg, elm_states.copy(), sensitivity_number.copy())
                     if "vtk" in self.save_resulting_format:
-                        self.beso_lib.export_vtk(file_nameW, nodes, Elements, elm_states, sensitivity_number, self.criteria, FI_step,
-                                                 FI_step_max)
-                self.doc.Topology.LastState = i
+                        exports.submit(self.beso_lib.export_vtk, file_nameW, nodes, Elements, elm_states.copy(),
+                                       sensitivity_number.copy(), self.criteria, FI_step, FI_step_max)
+                self.setLastState(i)
                 break
-            # plot and save figures
-            beso_plots.replot(self.path, i, oscillations, mass, self.domain_FI_filled, self.domains_from_config, FI_violated, FI_mean,
-                              FI_mean_without_state0, FI_max, self.optimization_base, energy_density_mean, heat_flux_mean,
-                              self.displacement_graph, disp_max, buckling_factors_all, savefig=True)
+            # plot and save figures during the next analysis, lists are copied as they grow in the next iteration
+            plot_previous = (self.path, i, oscillations, mass[:i + 1], self.domain_FI_filled, self.domains_from_config,
+                             list(FI_violated), list(FI_mean), list(FI_mean_without_state0), list(FI_max), self.optimization_base,
+                             list(energy_density_mean), list(heat_flux_mean), self.displacement_graph, list(disp_max),
+                             list(buckling_factors_all))
 
             i += 1  # iteration number
             print("\n----------- new iteration number %d ----------" % i)
@@ -765,6 +835,7 @@ class BesoMain:
 
             # filtering state
             mass_not_filtered = mass[i]  # use variable to store the "right" mass
+            km = 0
             for ft in self.filter_list:
                 if ft[0] and ft[1]:
                     if ft[0] == "casting":
@@ -779,7 +850,8 @@ class BesoMain:
                     if ft[0].split()[0] in ["erode", "dilate", "open", "close", "open-close", "close-open", "combine"]:
                         if ft[0].split()[1] == "state":
                             # the same filter as for sensitivity numbers
-                            elm_states_filtered = self.beso_filters.run_morphology(elm_states, near_elm, domains_to_filter,
+                            elm_states_filtered = self.beso_filters.run_morphology(elm_states, self.en_filter_morphology[km],
+                                                                                   self.near_elm[km], domains_to_filter,
                                                                                    ft[0].split()[0], FI_step_max)
                             # compute mass difference
                             for dn in self.domains_from_config:
@@ -796,18 +868,19 @@ class BesoMain:
                                             mass[i] += volume_elm[en] * (
                                                 self.domain_density[dn][elm_states_filtered[en]] - self.domain_density[dn][elm_states[en]])
                                             elm_states[en] = elm_states_filtered[en]
+                        km += 1
             print("mass = {}" .format(mass[i]))
             mass_excess = mass[i] - mass_not_filtered
 
             # export the present mesh
-            self.beso_lib.append_vtk_states(file_name_resulting_states, i, en_all_vtk, elm_states)
+            exports.submit(self.beso_lib.append_vtk_states, file_name_resulting_states, i, en_all_vtk, elm_states.copy())
 
             file_nameW2 = self.os.path.join(self.path, "topology_iterations", "file" + str(i).zfill(3))
             if self.save_iteration_results and self.np.mod(float(i), self.save_iteration_results) == 0:
                 if "frd" in self.save_resulting_format:
-                    self.beso_lib.export_frd(file_nameW2, nodes, Elements, elm_states, self.number_of_states)
+                    exports.submit(self.beso_lib.export_frd, file_nameW2, nodes, Elements, elm_states.copy(), self.number_of_states)
                 if "inp" in self.save_resulting_format:
-                    self.beso_lib.export_inp(file_nameW2, nodes, Elements, elm_states, self.number_of_states)
+                    exports.submit(self.beso_lib.export_inp, file_nameW2, nodes, Elements, elm_states.copy(), self.number_of_states)
 
             # check for oscillation state
             if elm_states_before_last == elm_states:  # oscillating state
@@ -816,9 +889,9 @@ class BesoMain:
                 print(msg)
                 oscillations = True
                 if i > 2:
-                    self.doc.Topology.LastState = i-2
+                    self.setLastState(i - 2)
                 else:
-                    self.doc.Topology.LastState = i
+                    self.setLastState(i)
                 break
             elm_states_before_last = elm_states_last.copy()
             elm_states_last = elm_states.copy()
@@ -835,6 +908,7 @@ class BesoMain:
                 self.os.remove(file_nameW + ".cvg")
                 self.os.remove(file_nameW + ".12d")
 
+        exports.shutdown()
         # export the resulting mesh
         if not (self.save_iteration_results and self.np.mod(float(i), self.save_iteration_results) == 0):
             if "frd" in self.save_resulting_format:
@@ -846,9 +920,10 @@ class BesoMain:
         self.deleteFiles(file_nameW, self.save_solver_files, self.reference_points)
 
         # plot and save figures
-        beso_plots.replot(self.path, i, oscillations, mass, self.domain_FI_filled, self.domains_from_config, FI_violated, FI_mean,
-                          FI_mean_without_state0, FI_max, self.optimization_base, energy_density_mean, heat_flux_mean,
-                          self.displacement_graph, disp_max, buckling_factors_all, savefig=True)
+        if plots:
+            beso_plots.replot(self.path, i, oscillations, mass, self.domain_FI_filled, self.domains_from_config, FI_violated,
+                              FI_mean, FI_mean_without_state0, FI_max, self.optimization_base, energy_density_mean, heat_flux_mean,
+                              self.displacement_graph, disp_max, buckling_factors_all, savefig=True)
         # print total time
         total_time = self.time.time() - self.start_time
         total_time_h = int(total_time / 3600.0)
@@ -861,3 +936,7 @@ class BesoMain:
         msg += showMsg + "\n"
         self.beso_lib.write_to_log(self.file_name, msg)
         print(showMsg)
+        return {"last_state": self.last_state, "iterations": i, "oscillations": oscillations, "total_time": total_time,
+                "elm_states": elm_states, "mass": list(mass), "FI_max": FI_max, "FI_mean": FI_mean,
+                "FI_mean_without_state0": FI_mean_without_state0, "energy_density_mean": energy_density_mean,
+                "heat_flux_mean": heat_flux_mean, "disp_max": disp_max, "buckling_factors": buckling_factors_all}
@@ -0,0 +1,248 @@
+# Array based storage of the mesh used by the optimization.
+# Node coordinates and element connectivities are held in contiguous NumPy arrays, element connectivities store row
+# indices into the coordinate array. Dict-like views keep the interface of the former {number: list} dictionaries so
+# that code indexing nodes[nn] or Elements.tetra10[en] works unchanged.
+import hashlib
+import numpy as np
+from collections.abc import Mapping
+
+# element categories in the order of beso_lib.Elements iteration
+ELEMENT_CATEGORIES = ("tria3", "tria6", "quad4", "quad8", "tetra4", "tetra10", "hexa8", "hexa20", "penta6", "penta15")
+NODES_PER_ELEMENT = {"tria3": 3, "tria6": 6, "quad4": 4, "quad8": 8, "tetra4": 4, "tetra10": 10, "hexa8": 8,
+                     "hexa20": 20, "penta6": 6, "penta15": 15}
+SHELL_CATEGORIES = ("tria3", "tria6", "quad4", "quad8")
+VOLUME_CATEGORIES = ("tetra4", "tetra10", "hexa8", "hexa20", "penta6", "penta15")
+
+
+def _lookup(sorted_ids, ids, what):
+    """return positions of ids in the sorted array sorted_ids, raise KeyError for missing ids"""
+    ids = np.asarray(ids, dtype=np.int64)
+    position = np.searchsorted(sorted_ids, ids)
+    if ids.size == 0:
+        return position
+    if len(sorted_ids) == 0:
+        found = np.zeros(ids.shape, dtype=bool)
+    else:
+        found = sorted_ids[np.minimum(position, len(sorted_ids) - 1)] == ids
+    if not np.all(found):
+        raise KeyError("{} {} not found in the mesh".format(what, ids[~found].ravel()[:10].tolist()))
+    return position
+
+
+class Mesh:
+    """Nodes and elements of the model stored in arrays
+
+    node_ids      sorted node numbers, shape (n,)
+    coordinates   node positions, shape (n, 3), row k belongs to node_ids[k]
+    element_ids   {category: element numbers in input file order}
+    connectivity  {category: row indices into coordinates, shape (number of elements, nodes per element)}
+    """
+
+    def __init__(self, node_ids, coordinates, element_ids=None, element_nodes=None):
+        """element_nodes are given as node numbers, they are converted to row indices of coordinates"""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        order = np.argsort(node_ids, kind="stable")
+        self.node_ids = node_ids[order]
+        self.coordinates = np.ascontiguousarray(np.asarray(coordinates, dtype=float).reshape(-1, 3)[order])
+        self.element_ids = {}
+        self.connectivity = {}
+        self._element_order = {}
+        element_ids = element_ids or {}
+        element_nodes = element_nodes or {}
+        for category in ELEMENT_CATEGORIES:
+            ids = np.asarray(element_ids.get(category, ()), dtype=np.int64)
+            nod = np.asarray(element_nodes.get(category, ()), dtype=np.int64).reshape(len(ids),
+                                                                                    NODES_PER_ELEMENT[category])
+            self._set_category(category, ids, self.node_index(nod).astype(np.int32))
+
+    def _set_category(self, category, ids, connectivity):
+        self.element_ids[category] = ids
+        self.connectivity[category] = connectivity
+        self._element_order[category] = np.argsort(ids, kind="stable")
+
+    @classmethod
+    def from_dicts(cls, nodes, Elements):
+        """build the mesh from {nn: [x, y, z]} and an object with {en: [nn, ...]} dicts as category attributes"""
+        node_ids = np.fromiter(nodes.keys(), dtype=np.int64, count=len(nodes))
+        coordinates = np.array(list(nodes.values()), dtype=float).reshape(-1, 3)
+        element_ids = {}
+        element_nodes = {}
+        for category in ELEMENT_CATEGORIES:
+            elm_category = getattr(Elements, category)
+            element_ids[category] = np.fromiter(elm_category.keys(), dtype=np.int64, count=len(elm_category))
+            element_nodes[category] = list(elm_category.values())
+        return cls(node_ids, coordinates, element_ids, element_nodes)
+
+    def node_index(self, nn):
+        """row indices of node numbers nn (scalar or array)"""
+        return _lookup(self.node_ids, nn, "nodes")
+
+    def element_index(self, category, en):
+        """row indices of element numbers en within the connectivity array of the given category"""
+        ids = self.element_ids[category]
+        order = self._element_order[category]
+        return order[_lookup(ids[order], en, "elements")]
+
+    def element_nodes(self, category):
+        """node numbers of all elements of the category, shape (number of elements, nodes per element)"""
+        return self.node_ids[self.connectivity[category]]
+
+    def categories(self):
+        """element categories which contain at least one element"""
+        return [category for category in ELEMENT_CATEGORIES if len(self.element_ids[category])]
+
+    def all_element_ids(self, categories=ELEMENT_CATEGORIES):
+        return np.concatenate([self.element_ids[category] for category in categories])
+
+    def number_of_elements(self):
+        return sum(len(self.element_ids[category]) for category in ELEMENT_CATEGORIES)
+
+    def fingerprint(self):
+        """sha1 hex digest of node numbers, coordinates and element connectivities"""
+        digest = hashlib.sha1()
+        digest.update(self.node_ids.tobytes())
+        digest.update(self.coordinates.tobytes())
+        for category in ELEMENT_CATEGORIES:
+            digest.update(category.encode())
+            digest.update(self.element_ids[category].tobytes())
+            digest.update(np.ascontiguousarray(self.connectivity[category], dtype=np.int32).tobytes())
+        return digest.hexdigest()
+
+    def node_element_adjacency(self):
+        """elements adjacent to each node in CSR form
+
+        returns indptr, adjacent; elements adjacent to node row k are adjacent[indptr[k]:indptr[k + 1]] given as
+        positions in all_element_ids(), each element listed once per node"""
+        rows = []
+        elements = []
+        offset = 0
+        for category in ELEMENT_CATEGORIES:
+            connectivity = self.connectivity[category]
+            if len(connectivity):
+                # drop repeated nodes within one element
+                sorted_connectivity = np.sort(connectivity, axis=1)
+                unique = np.ones(sorted_connectivity.shape, dtype=bool)
+                unique[:, 1:] = sorted_connectivity[:, 1:] != sorted_connectivity[:, :-1]
+                element_position = np.broadcast_to(np.arange(offset, offset + len(connectivity))[:, None],
+                                                   connectivity.shape)
+                rows.append(sorted_connectivity[unique])
+                elements.append(element_position[unique])
+            offset += len(connectivity)
+        if rows:
+            rows = np.concatenate(rows)
+            elements = np.concatenate(elements)
+        else:
+            rows = np.zeros(0, dtype=np.int32)
+            elements = np.zeros(0, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.node_ids)), out=indptr[1:])
+        return indptr, elements[order]
+
+    def subset(self, en):
+        """new mesh with all nodes and only elements with numbers in en"""
+        en = np.asarray(list(en) if not isinstance(en, np.ndarray) else en, dtype=np.int64)
+        mesh = Mesh.__new__(Mesh)
+        mesh.node_ids = self.node_ids
+        mesh.coordinates = self.coordinates
+        mesh.element_ids = {}
+        mesh.connectivity = {}
+        mesh._element_order = {}
+        for category in ELEMENT_CATEGORIES:
+            keep = np.isin(self.element_ids[category], en)
+            mesh._set_category(category, self.element_ids[category][keep], self.connectivity[category][keep])
+        return mesh
+
+    @property
+    def nodes(self):
+        return NodesView(self)
+
+    @property
+    def elements(self):
+        return ElementsView(self)
+
+
+class NodesView(Mapping):
+    """read-only {nn: [x, y, z]} view of the mesh nodes"""
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def __getitem__(self, nn):
+        try:
+            return self.mesh.coordinates[self.mesh.node_index(nn)].tolist()
+        except (TypeError, ValueError):
+            raise KeyError(nn)
+
+    def __contains__(self, nn):
+        try:
+            self.mesh.node_index(nn)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.mesh.node_ids.tolist())
+
+    def __len__(self):
+        return len(self.mesh.node_ids)
+
+    def items(self):
+        return zip(self.mesh.node_ids.tolist(), self.mesh.coordinates.tolist())
+
+    def values(self):
+        return self.mesh.coordinates.tolist()
+
+
+class ElementTypeView(Mapping):
+    """read-only {en: [nn, ...]} view of the elements of one category"""
+
+    def __init__(self, mesh, category):
+        self.mesh = mesh
+        self.category = category
+
+    def __getitem__(self, en):
+        try:
+            row = self.mesh.element_index(self.category, en)
+        except (TypeError, ValueError):
+            raise KeyError(en)
+        return self.mesh.node_ids[self.mesh.connectivity[self.category][row]].tolist()
+
+    def __contains__(self, en):
+        try:
+            self.mesh.element_index(self.category, en)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.mesh.element_ids[self.category].tolist())
+
+    def __len__(self):
+        return len(self.mesh.element_ids[self.category])
+
+    def items(self):
+        return zip(self.mesh.element_ids[self.category].tolist(), self.mesh.element_nodes(self.category).tolist())
+
+    def values(self):
+        return self.mesh.element_nodes(self.category).tolist()
+
+
+class ElementsView:
+    """replacement of beso_lib.Elements with a category attribute for each element type"""
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+        for category in ELEMENT_CATEGORIES:
+            setattr(self, category, ElementTypeView(mesh, category))
+
+    def __iter__(self):
+        return (getattr(self, category) for category in ELEMENT_CATEGORIES)
+
+
+def as_mesh(nodes, Elements):
+    """return the array mesh behind the views or build it from plain dictionaries"""
+    mesh = getattr(Elements, "mesh", None)
+    if mesh is None:
+        mesh = Mesh.from_dicts(nodes, Elements)
+    return mesh
@@ -4,54 +4,13 @@ from fembygen.topology import beso_lib
 
 def separating(file_name, nodes={}):
 
-    # reading node position if it is not defined
+    # reading node position if it is not defined, the mesh is loaded from the cache of import_inp if available
     if not nodes:
         if file_name[-4:] == ".inp":
             file_nameR = file_name
         else:
             file_nameR = file_name + ".inp"
-        fR = open(file_nameR, "r")
-
-        nodes = {}  # dict with nodes position
-        model_definition = True
-        read_node = False
-        line = "\n"
-        include = ""
-        while line != "":
-            if include:
-                line = f_include.readline()
-                if line == "":
-                    f_include.close()
-                    include = ""
-                    line = fR.readline()
-            else:
-                line = fR.readline()
-            if line.strip() == '':
-                continue
-            elif line[0] == '*':  # start/end of a reading set
-                if line[0:2] == '**':  # comments
-                    continue
-                if line[:8].upper() == "*INCLUDE":
-                    start = 1 + line.index("=")
-                    include = line[start:].strip().strip('"')
-                    f_include = open(include, "r")
-                    continue
-                read_node = False
-
-            # reading nodes
-            if (line[:5].upper() == "*NODE") and (model_definition is True):
-                read_node = True
-            elif read_node is True:
-                line_list = line.split(',')
-                number = int(line_list[0])
-                x = float(line_list[1])
-                y = float(line_list[2])
-                z = float(line_list[3])
-                nodes[number] = [x, y, z]
-
-            elif line[:5].upper() == "*STEP":
-                model_definition = False
-        fR.close()
+        nodes = beso_lib.load_inp_mesh(file_nameR)[0].nodes
 
     # creating new file from old one with separated elements
     if file_name[-4:] == ".inp":
@@ -79,7 +38,8 @@ def separating(file_name, nodes={}):
             fW.write("** Nodes added by optimization to separate nodal stresses\n")
             fW.write("*NODE\n")
             for [nn, nn_added] in coincident_nodes:
-                fW.write("{}, {}, {}, {}\n" .format(nn_added, nodes[nn][0], nodes[nn][1], nodes[nn][2]))
+                x, y, z = nodes[nn]
+                fW.write("{}, {}, {}, {}\n" .format(nn_added, x, y, z))
             fW.write(" \n")
             fW.write("**Equations added by optimization to separate nodal stresses\n")
             fW.write("*EQUATION\n")
@@ -0,0 +1,139 @@
+# Running CalculiX analyses and post-processing of the optimization iterations in the background.
+# The solver runs in a subprocess whose output is read line by line on a thread, exports of iteration results run on a
+# worker thread in the order of submission, so that the main thread can prepare the next iteration meanwhile.
+# SolverPool runs queued analyses (e.g. all load cases of all generations) concurrently in bounded number.
+import collections
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SolverRun:
+    """CalculiX analysis of file_nameW (without .inp) running in a subprocess
+
+    output lines are appended to output_file (if given) as they come, the last lines are kept in tail,
+    threads sets OMP_NUM_THREADS of the solver (inherited from the environment if not given)"""
+
+    def __init__(self, path_calculix, file_nameW, output_file=None, tail_length=20, threads=None):
+        self.file_nameW = file_nameW
+        self.output_file = output_file
+        self.tail = collections.deque(maxlen=tail_length)
+        env = None
+        if threads:
+            env = dict(os.environ, OMP_NUM_THREADS=str(int(threads)))
+        self.process = subprocess.Popen([os.path.normpath(path_calculix), file_nameW],
+                                        cwd=os.path.dirname(file_nameW), stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, shell=not sys.platform.startswith('linux'), env=env)
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        f = open(self.output_file, "ab") if self.output_file else None
+        try:
+            for line in self.process.stdout:
+                self.tail.append(line.decode(errors="replace").rstrip())
+                if f:
+                    f.write(line)
+                    f.flush()
+        finally:
+            self.process.stdout.close()
+            if f:
+                f.close()
+
+    def running(self):
+        return self.process.poll() is None
+
+    def wait(self):
+        """wait for the end of the analysis and return its return code"""
+        returncode = self.process.wait()
+        self.reader.join()
+        return returncode
+
+    def kill(self):
+        if self.running():
+            self.process.kill()
+        return self.wait()
+
+
+class SolverPool:
+    """queue of CalculiX analyses running concurrently, at most jobs of them at once with threads OpenMP threads each
+
+    analyses are started by submit and poll calls, poll returns [(key, returncode, run)] of analyses finished since
+    the previous call, so that the caller (e.g. a GUI loop) gathers results as they come without blocking"""
+
+    def __init__(self, path_calculix, jobs=None, threads=1):
+        self.path_calculix = path_calculix
+        self.threads = max(1, int(threads))
+        if not jobs:
+            jobs = (os.cpu_count() or 1) // self.threads
+        self.jobs = max(1, int(jobs))
+        self.queue = collections.deque()
+        self.runs = {}
+
+    def submit(self, key, file_nameW, output_file=None):
+        self.queue.append((key, file_nameW, output_file))
+        self._start()
+
+    def _start(self):
+        while self.queue and len(self.runs) < self.jobs:
+            key, file_nameW, output_file = self.queue.popleft()
+            self.runs[key] = SolverRun(self.path_calculix, file_nameW, output_file, threads=self.threads)
+
+    def poll(self):
+        finished = []
+        for key, run in list(self.runs.items()):
+            if not run.running():
+                finished.append((key, run.wait(), run))
+                del self.runs[key]
+        self._start()
+        return finished
+
+    def running(self):
+        """keys of analyses being solved"""
+        return list(self.runs)
+
+    def done(self):
+        return not self.queue and not self.runs
+
+    def kill(self):
+        """cancel queued analyses and kill running ones"""
+        self.queue.clear()
+        for run in self.runs.values():
+            run.kill()
+        self.runs = {}
+
+
+class BackgroundTasks:
+    """tasks (e.g. exports of iteration results) running one by one on a worker thread in the order of submission
+
+    exceptions of finished tasks are raised by the next submit, check or wait call"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.futures = []
+
+    def submit(self, function, *args, **kwargs):
+        self.check()
+        self.futures.append(self.executor.submit(function, *args, **kwargs))
+
+    def check(self):
+        """raise exception of finished tasks, forget finished tasks"""
+        done = [future.done() for future in self.futures]
+        finished = [future for future, d in zip(self.futures, done) if d]
+        self.futures = [future for future, d in zip(self.futures, done) if not d]
+        for future in finished:
+            future.result()
+
+    def wait(self):
+        """wait for all submitted tasks"""
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()